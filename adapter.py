@@ -1,33 +1,58 @@
+import time
+# 导入耗时计入启动报告
+IMPORT_START = time.perf_counter()
 import os
+import re
+import math
+import asyncio
 import argparse
-import uvicorn
 import httpx
 import logging
-import json
+import importlib.util
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
 from urllib.parse import urlparse
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import APIRouter, FastAPI, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, field_validator
 
 from config import *
+import config as config_module
 from pluginManager import plugin_manager
-import mimetypes
+from backendPool import Backend, BackendPool
+from admission import AdmissionController, AdmissionRejected, AdmissionSlot, BACKGROUND_PRIORITY
+from prewarm import Prewarmer
+from srtJobs import JobManager, OutputStore
+from microBatch import MicroBatcher
+from speculative import SpeculativeSession, SpeculativeStore
+from audioCache import AudioCache
+from wavUtils import normalize_wav_stream
+from voiceIndex import VoiceIndex
+from refAudio import RefAudioPreprocessor
+from sharedState import SharedState, SharedAudioCacheIndex
+from configReloader import load_models_file, load_config_file, diff_models, diff_config, validate_config, watch_files
+import metrics
+from metrics import timed, observe_stage
 
+# 启动各阶段的耗时(秒)，启动完成时输出报告
+STARTUP_REPORT = {"imports": time.perf_counter() - IMPORT_START}
 
 # 基础路径设置
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 REF_AUDIO_DIR = os.path.join(BASE_DIR, REF_AUDIO_DIR_NAME)
 OUTPUT_DIR = os.path.join(BASE_DIR, OUTPUT_DIR_NAME)
 MODELS_CONFIG_PATH = os.path.join(BASE_DIR, MODELS_CONFIG_NAME)
+SHARED_STATE_PATH = os.path.join(BASE_DIR, SHARED_STATE_FILE_NAME)
+# 工作进程数，主进程通过环境变量传给各工作进程
+WORKER_COUNT = max(1, int(os.environ.get("ADAPTER_WORKERS") or WORKERS))
 
 if API_V2_URL.endswith("/"):
     API_V2_URL = API_V2_URL[:-1]
-
-# 初始化目录
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-os.makedirs(REF_AUDIO_DIR, exist_ok=True)
+# 后端地址列表，未配置多后端时只使用 API_V2_URL
+BACKEND_URLS = [url[:-1] if url.endswith("/") else url for url in (API_V2_URLS or [API_V2_URL])]
 
 # 日志配置
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -35,30 +60,221 @@ logger = logging.getLogger("Driver")
 if DEBUG_MODE:
     logger.setLevel(logging.DEBUG)
 
-# FastAPI应用初始化
-app = FastAPI(title="SillyTavern Adapter for GPT-SoVITS")
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],)
+# 后端共享客户端，在 lifespan 中创建，关闭时释放
+BACKEND_CLIENT: Optional[httpx.AsyncClient] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global BACKEND_CLIENT
+    lifespan_start = time.perf_counter()
+    startup()
+    BACKEND_CLIENT = httpx.AsyncClient(**get_localhost_client_kwargs())
+    logger.info(f"后端连接池已创建 (HTTP/2: {'开启' if backend_http2_enabled() else '关闭'})")
+    if VOICE_INDEX_WATCH:
+        voice_index.start_watching(VOICE_INDEX_POLL_INTERVAL)
+    health_task = None
+    if BACKEND_HEALTH_CHECK_INTERVAL > 0:
+        health_task = asyncio.create_task(backend_pool.run_health_checks(
+            get_backend_client, BACKEND_HEALTH_CHECK_INTERVAL, BACKEND_HEALTH_CHECK_PATH
+        ))
+    reload_task = None
+    if CONFIG_RELOAD_WATCH:
+        reload_task = asyncio.create_task(watch_files(
+            lambda: [get_models_config_path(), config_module.__file__],
+            reload_on_change,
+            CONFIG_RELOAD_POLL_INTERVAL
+        ))
+    shared_task = None
+    if shared_state is not None:
+        # 先登记本进程，其他进程才不会把本进程的租约当作遗留数据回收
+        await shared_state.heartbeat()
+        shared_task = asyncio.create_task(run_shared_state_sync())
+        logger.info(f"多进程模式: 工作进程 {os.getpid()} 已启动 (共 {WORKER_COUNT} 个)")
+    with startup_step("audio_cache"):
+        await audio_cache.load_disk_index()
+    cleanup_task = asyncio.create_task(output_store.run_cleanup(OUTPUT_CLEANUP_INTERVAL))
+    preprocess_task = None
+    if ref_audio_preprocessor is not None and any(not entry["preprocessed"] for entry in voice_index.by_filename.values()):
+        preprocess_task = asyncio.get_running_loop().run_in_executor(None, voice_index.rebuild)
+    prewarm_tasks = [asyncio.create_task(prewarmer.run_idle())]
+    if PREWARM_DEFAULT_CHARACTER:
+        prewarm_tasks.append(asyncio.create_task(prewarmer.prewarm_on_startup(PREWARM_DEFAULT_CHARACTER)))
+    if PLUGIN_PRELOAD:
+        # 服务已可用，在后台导入插件，首个请求不必等待
+        prewarm_tasks.append(asyncio.create_task(plugin_manager.load_all()))
+    STARTUP_REPORT["lifespan"] = time.perf_counter() - lifespan_start
+    log_startup_report()
+    try:
+        yield
+    finally:
+        for task in prewarm_tasks:
+            task.cancel()
+        speculative_store.clear()
+        cleanup_task.cancel()
+        if preprocess_task is not None:
+            preprocess_task.cancel()
+        await srt_jobs.shutdown()
+        if reload_task is not None:
+            reload_task.cancel()
+        if health_task is not None:
+            health_task.cancel()
+        await voice_index.stop_watching()
+        # 插件释放各自的资源(如翻译服务的连接池)
+        await plugin_manager.run_hook("on_shutdown", None)
+        await BACKEND_CLIENT.aclose()
+        BACKEND_CLIENT = None
+        logger.info("后端连接池已关闭")
+        if shared_task is not None:
+            shared_task.cancel()
+            await asyncio.get_running_loop().run_in_executor(None, shared_state.close)
+
+# 路由，由 create_app 挂载到应用上
+router = APIRouter()
 timeout_config = httpx.Timeout(120.0, connect=10.0)
-app.mount("/srt", StaticFiles(directory=OUTPUT_DIR), name="音频输出")
+plugin_manager.observer = metrics.observe_plugin
+
+def create_app() -> FastAPI:
+    """
+    创建 FastAPI 应用。导入本模块只构建对象，不读写文件；
+    创建目录、读取角色配置、建立参考音频索引和发现插件都在 startup() 中进行，由 lifespan 调用。
+    也可以通过 uvicorn adapter:create_app --factory 启动。
+    """
+    application = FastAPI(title="SillyTavern Adapter for GPT-SoVITS", lifespan=lifespan)
+    application.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],)
+    # 输出目录在 startup() 中创建
+    application.mount("/srt", StaticFiles(directory=OUTPUT_DIR, check_dir=False), name="音频输出")
+    application.include_router(router)
+    return application
 
-# 加载插件
-plugin_manager.load_plugins_from_dir("plugins")
 
+def get_models_config_path() -> str:
+    """ 存在 models_local.json 时优先使用 """
+    return MODELS_CONFIG_PATH if not os.path.exists("models_local.json") else "models_local.json"
 
 CHARACTER_MODEL_MAP = {}
-# 加载角色模型配置
-MODELS_CONFIG_PATH_INFO = MODELS_CONFIG_PATH if not os.path.exists("models_local.json") else "models_local.json" 
-if os.path.exists(MODELS_CONFIG_PATH_INFO):
+STARTED = False
+
+@contextmanager
+def startup_step(name: str):
+    start = time.perf_counter()
     try:
-        with open(MODELS_CONFIG_PATH_INFO, "r", encoding="utf-8") as f:
-            CHARACTER_MODEL_MAP = json.load(f)
-        logger.info(f"已加载配置: 成功读取{len(CHARACTER_MODEL_MAP)} 个角色配置")
-    except Exception as e:
-        logger.error(f"加载 models.json 失败: {e}")
+        yield
+    finally:
+        STARTUP_REPORT[name] = STARTUP_REPORT.get(name, 0.0) + time.perf_counter() - start
+
+def startup():
+    """
+    启动时的初始化，只执行一次(已执行过时直接返回)。
+    需要在启动前修改角色配置等的程序(如基准测试)可以先调用本函数，lifespan 不会再次执行。
+    """
+    global STARTED, CHARACTER_MODEL_MAP
+    if STARTED:
+        return
+    STARTED = True
+    with startup_step("directories"):
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        os.makedirs(REF_AUDIO_DIR, exist_ok=True)
+    with startup_step("models"):
+        # 加载角色模型配置
+        models_config_path = get_models_config_path()
+        if os.path.exists(models_config_path):
+            try:
+                CHARACTER_MODEL_MAP = load_models_file(models_config_path)
+                logger.info(f"已加载配置: 成功读取{len(CHARACTER_MODEL_MAP)} 个角色配置")
+            except Exception as e:
+                logger.error(f"加载 models.json 失败: {e}")
+    with startup_step("voice_index"):
+        # 只使用已有的参考音频预处理结果，新增或修改的参考音频在启动后于后台预处理
+        voice_index.rebuild(preprocess=False)
+    with startup_step("plugins"):
+        # 只读取插件清单，启用的插件在首次调用钩子时才导入
+        plugin_manager.load_plugins_from_dir("plugins", plugins_config)
 
+def log_startup_report():
+    steps = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in STARTUP_REPORT.items())
+    plugins = plugin_manager.info()
+    enabled = [name for name, plugin in plugins.items() if plugin["enabled"]]
+    logger.info(f"启动完成: {steps}; 启用的插件: {', '.join(enabled) or '无'}")
 
-# 初始化当前加载的模型状态
-CURRENT_LOADED_MODELS = {"gpt": None, "sovits": None}
+# 当前生效的 config.py 配置，用于热重载时对比差异
+CURRENT_CONFIG = {name: value for name, value in vars(config_module).items() if name.isupper() or name == "plugins_config"}
+# 最近一次读取的 config.py 配置(包括尚未生效、需要重启的修改)，重启项只在与上次读取相比有变化时报告
+LOADED_CONFIG = dict(CURRENT_CONFIG)
+# 可以热重载的配置项，其余配置项(目录、后端地址、连接池、插件配置等)修改后需要重启
+HOT_RELOAD_CONFIG = {
+    "DEBUG_MODE", "GLOBAL_DEFAULT_LANG", "BACKEND_TIMEOUTS", "METRICS_SERVER_TIMING",
+    "SCHEDULER_ENABLED", "SCHEDULER_MAX_BATCH", "SCHEDULER_MAX_WAIT",
+    "ADMISSION_MAX_ACTIVE", "ADMISSION_MAX_QUEUE", "ADMISSION_MAX_WAIT", "ADMISSION_DROP_DUPLICATES", "ADMISSION_RETRY_AFTER",
+    "MICRO_BATCH_ENABLED", "MICRO_BATCH_WINDOW", "MICRO_BATCH_MAX_SIZE", "MICRO_BATCH_MAX_CHARS",
+    "STREAM_FRAME_MS", "STREAM_INSERT_SILENCE",
+    "OUTPUT_RETENTION", "OUTPUT_MAX_BYTES", "OUTPUT_MAX_FILES",
+    "PREWARM_IDLE_ENABLED", "PREWARM_STRATEGY", "PREWARM_IDLE_AFTER", "PREWARM_REFERENCE_WARMUP", "PREWARM_WARMUP_TEXTS",
+    "PIPELINE_ENABLED", "PIPELINE_CONCURRENCY", "PIPELINE_MIN_CHARS", "PIPELINE_QUEUE_CHUNKS",
+    "SPECULATIVE_ENABLED", "SPECULATIVE_CONCURRENCY", "SPECULATIVE_TTL", "SPECULATIVE_MAX_SESSIONS",
+    "AUDIO_CACHE_ENABLED", "AUDIO_CACHE_IGNORE_SEED",
+    "AUDIO_CACHE_MEMORY_MAX_BYTES", "AUDIO_CACHE_MEMORY_MAX_ENTRIES",
+    "AUDIO_CACHE_DISK_MAX_BYTES", "AUDIO_CACHE_DISK_MAX_ENTRIES",
+}
+# 热重载配置项的下限(未列出的数值配置项不能为负数)和可选值
+HOT_RELOAD_MINIMUMS = {
+    "SCHEDULER_MAX_BATCH": 1, "MICRO_BATCH_MAX_SIZE": 1, "PIPELINE_CONCURRENCY": 1, "SPECULATIVE_CONCURRENCY": 1,
+    "SPECULATIVE_MAX_SESSIONS": 1, "PIPELINE_QUEUE_CHUNKS": 1,
+}
+HOT_RELOAD_CHOICES = {"PREWARM_STRATEGY": ("recent", "frequent")}
+
+# 参考音频预处理(规范化格式和时长)
+ref_audio_preprocessor = RefAudioPreprocessor(
+    os.path.join(BASE_DIR, REF_AUDIO_CACHE_DIR_NAME),
+    sample_rate=REF_AUDIO_SAMPLE_RATE,
+    min_seconds=REF_AUDIO_MIN_SECONDS,
+    max_seconds=REF_AUDIO_MAX_SECONDS,
+    ffmpeg_path=FFMPEG_PATH,
+) if REF_AUDIO_PREPROCESS else None
+# 参考音频索引，按角色名查找参考音频、参考文本和语言
+voice_index = VoiceIndex(REF_AUDIO_DIR, GLOBAL_DEFAULT_LANG, lambda: CHARACTER_MODEL_MAP, ref_audio_preprocessor)
+
+# 后端池，记录每个后端当前加载的模型状态，并各自按模型亲和度调度请求
+backend_pool = BackendPool(
+    BACKEND_URLS,
+    max_batch=SCHEDULER_MAX_BATCH,
+    max_wait=SCHEDULER_MAX_WAIT,
+    max_failures=BACKEND_MAX_FAILURES,
+)
+def per_worker(limit: int) -> int:
+    """ 多进程时把全局的并发/排队上限平均分配给各工作进程，0 表示不限制 """
+    return max(1, math.ceil(limit / WORKER_COUNT)) if limit > 0 else limit
+
+# 准入控制，限制同时进行的合成请求数
+admission_controller = AdmissionController(
+    max_active=per_worker(ADMISSION_MAX_ACTIVE),
+    max_queue=per_worker(ADMISSION_MAX_QUEUE),
+    max_wait=ADMISSION_MAX_WAIT,
+    drop_duplicates=ADMISSION_DROP_DUPLICATES,
+)
+# srt 输出文件和后台合成任务
+output_store = OutputStore(OUTPUT_DIR, retention=OUTPUT_RETENTION, max_bytes=OUTPUT_MAX_BYTES, max_files=OUTPUT_MAX_FILES)
+# 多进程模式下的共享状态(单进程时为 None)
+shared_state = SharedState(SHARED_STATE_PATH, max_wait=SCHEDULER_MAX_WAIT) if WORKER_COUNT > 1 else None
+if shared_state is not None:
+    # 后端被摘除时加载状态重置为未知，同步给其他进程
+    backend_pool.on_eject = lambda backend: asyncio.ensure_future(shared_state.save_backend(backend))
+srt_jobs = JobManager(retention=OUTPUT_RETENTION, store=shared_state)
+# 合成音频缓存
+audio_cache = AudioCache(
+    os.path.join(OUTPUT_DIR, AUDIO_CACHE_DIR_NAME),
+    memory_max_bytes=AUDIO_CACHE_MEMORY_MAX_BYTES,
+    memory_max_entries=AUDIO_CACHE_MEMORY_MAX_ENTRIES,
+    disk_max_bytes=AUDIO_CACHE_DISK_MAX_BYTES,
+    disk_max_entries=AUDIO_CACHE_DISK_MAX_ENTRIES,
+    # 多进程时磁盘缓存的索引和容量限制由各进程共享
+    index=SharedAudioCacheIndex(shared_state) if shared_state is not None else None,
+)
+# 缓存命中时每次发送的数据块大小
+CACHE_CHUNK_SIZE = 64 * 1024
+# GPT-SoVITS api_v2 支持的输出格式
+BACKEND_MEDIA_TYPES = ("wav", "raw", "ogg", "aac")
+# 分句使用的句末标点，英文句号等需后接空白才视为句末，避免切开小数
+SENTENCE_SPLIT_PATTERN = re.compile(r'(?<=[。！？!?…~\n])|(?<=[.;])\s+')
 
 # TTS默认状态设置，当数据不完全时使用
 class TTS_Request(BaseModel):
@@ -90,98 +306,394 @@ class TTS_Request(BaseModel):
         if isinstance(v, str): return v.lower() == 'true'
         return v
 
+# 预合成的增量文本，其余参数与 /tts 请求相同
+class Ingest_Request(TTS_Request):
+    message_id: str
+    # 本次新增的文本
+    text: str = ""
+    # 消息是否已生成完毕
+    done: bool = False
+
 pass
 
+def backend_http2_enabled() -> bool:
+    """ 仅在配置开启且安装了 h2 时使用 HTTP/2 """
+    return BACKEND_HTTP2 and importlib.util.find_spec("h2") is not None
+
+def get_backend_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=BACKEND_MAX_CONNECTIONS,
+        max_keepalive_connections=BACKEND_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=BACKEND_KEEPALIVE_EXPIRY,
+    )
+
+def get_route_timeout(route: str) -> httpx.Timeout:
+    """ 按路由读取 BACKEND_TIMEOUTS 中的超时设置，未配置的路由使用默认超时 """
+    route_config = BACKEND_TIMEOUTS.get(route)
+    if not route_config:
+        return timeout_config
+    return httpx.Timeout(route_config.get("read", 120.0), connect=route_config.get("connect", 10.0))
+
+def get_backend_client() -> httpx.AsyncClient:
+    """ 获取共享的后端客户端，应用未经 lifespan 启动时(如被其他程序直接调用)按需创建 """
+    global BACKEND_CLIENT
+    if BACKEND_CLIENT is None or BACKEND_CLIENT.is_closed:
+        BACKEND_CLIENT = httpx.AsyncClient(**get_localhost_client_kwargs())
+    return BACKEND_CLIENT
+
 # 为本地/内网请求创建禁用代理的客户端配置，外部请求保留代理支持
 def get_localhost_client_kwargs():
     """
     为 127.0.0.1 等本地请求配置：禁用代理，避免代理拦截导致 502。
-    同时也为后端 API_V2_URL 的主机名禁用代理(支持内网 IP)。
+    同时也为所有后端地址的主机名禁用代理(支持内网 IP)。
     外部请求(如翻译 API)仍使用环境变量中的代理配置。
+    连接池限制和 HTTP/2 需要设置在每个 transport 上，客户端级别的设置只对默认 transport 生效。
     """
+    limits = get_backend_limits()
+    http2 = backend_http2_enabled()
+    # 各 transport 共用一个 SSL 上下文，每次新建都要重新加载证书，明显拖慢启动
+    ssl_context = httpx.create_ssl_context(trust_env=True)
+
+    def local_transport():
+        return httpx.AsyncHTTPTransport(proxy=None, limits=limits, http2=http2, verify=ssl_context)
+
     mounts = {
-        "http://127.0.0.1": httpx.AsyncHTTPTransport(proxy=None),
-        "http://localhost": httpx.AsyncHTTPTransport(proxy=None),
-        "https://127.0.0.1": httpx.AsyncHTTPTransport(proxy=None),
-        "https://localhost": httpx.AsyncHTTPTransport(proxy=None),
+        "http://127.0.0.1": local_transport(),
+        "http://localhost": local_transport(),
+        "https://127.0.0.1": local_transport(),
+        "https://localhost": local_transport(),
     } 
-    # 为后端 URL 的主机名也禁用代理（支持内网 IP）
-    try:
-        parsed = urlparse(API_V2_URL)
-        if parsed.hostname and parsed.hostname not in ["localhost", "127.0.0.1"]:
-            scheme = parsed.scheme or "http"
-            host_prefix = f"{scheme}://{parsed.hostname}"
-            if parsed.port:
-                # 如果指定了端口，也要加上
-                mounts[f"{scheme}://{parsed.hostname}:{parsed.port}"] = httpx.AsyncHTTPTransport(proxy=None)
-            else:
-                mounts[host_prefix] = httpx.AsyncHTTPTransport(proxy=None)
-            logger.debug(f"为后端 {host_prefix} 禁用代理")
-    except Exception as e:
-        logger.warning(f"解析 API_V2_URL 失败，已禁用本地代理: {e}")
+    # 为每个后端 URL 的主机名也禁用代理（支持内网 IP）
+    for backend_url in BACKEND_URLS:
+        try:
+            parsed = urlparse(backend_url)
+            if parsed.hostname and parsed.hostname not in ["localhost", "127.0.0.1"]:
+                scheme = parsed.scheme or "http"
+                host_prefix = f"{scheme}://{parsed.hostname}"
+                if parsed.port:
+                    # 如果指定了端口，也要加上
+                    mounts[f"{scheme}://{parsed.hostname}:{parsed.port}"] = local_transport()
+                else:
+                    mounts[host_prefix] = local_transport()
+                logger.debug(f"为后端 {host_prefix} 禁用代理")
+        except Exception as e:
+            logger.warning(f"解析后端地址 {backend_url} 失败，已禁用本地代理: {e}")
     return {
         "timeout": timeout_config,
         "mounts": mounts,
+        "limits": limits,
+        "http2": http2,
+        "verify": ssl_context,
         "trust_env": True,  # 外部请求仍使用环境变量代理
     }
 
-# 根据角色名称切换模型
-async def switch_model(character_name: str):
+# 根据角色名称切换指定后端的模型
+async def switch_model(character_name: str, backend: Backend):
     if character_name not in CHARACTER_MODEL_MAP:
         return None
-    target_gpt = CHARACTER_MODEL_MAP[character_name].get("gpt")
-    target_sovits = CHARACTER_MODEL_MAP[character_name].get("sovits")
-    
-    if target_gpt and CURRENT_LOADED_MODELS["gpt"] != target_gpt:
-        logger.info(f"[{character_name}] 切换GPT: ...{os.path.basename(target_gpt)[-15:]}")
-        try:
-            # 使用本地请求配置（禁用代理），避免代理拦截导致 502
-            async with httpx.AsyncClient(**get_localhost_client_kwargs()) as client:
-                resp = await client.get(f"{API_V2_URL}/set_gpt_weights", params={"weights_path": target_gpt})
+    async with backend.switch_lock:
+        previous = dict(backend.loaded)
+        failed = False
+        target_gpt = CHARACTER_MODEL_MAP[character_name].get("gpt")
+        target_sovits = CHARACTER_MODEL_MAP[character_name].get("sovits")
+
+        if target_gpt and backend.loaded["gpt"] != target_gpt:
+            logger.info(f"[{character_name}] {backend.url} 切换GPT: ...{os.path.basename(target_gpt)[-15:]}")
+            try:
+                # 使用共享的后端客户端（禁用代理），避免代理拦截导致 502
+                client = get_backend_client()
+                resp = await client.get(f"{backend.url}/set_gpt_weights", params={"weights_path": target_gpt}, timeout=get_route_timeout("switch_model"))
                 if resp.status_code == 200:
-                    CURRENT_LOADED_MODELS["gpt"] = target_gpt
+                    backend.loaded["gpt"] = target_gpt
+                    metrics.WEIGHT_SWITCHES.inc(kind="gpt", result="ok")
                     logger.info("GPT 切换成功")
                 else:
+                    failed = True
+                    metrics.WEIGHT_SWITCHES.inc(kind="gpt", result="error")
                     logger.error(f"GPT 切换失败: status={resp.status_code} reason={resp.reason_phrase} body={resp.text}")
-        except Exception as e:
-            logger.error(f"尝试切换GPT失败: {e}")
+            except Exception as e:
+                failed = True
+                metrics.WEIGHT_SWITCHES.inc(kind="gpt", result="error")
+                logger.error(f"尝试切换GPT失败: {e}")
 
-    if target_sovits and CURRENT_LOADED_MODELS["sovits"] != target_sovits:
-        logger.info(f"[{character_name}] 切换SoVITS: ...{os.path.basename(target_sovits)[-15:]}")
-        try:
-            # 使用本地请求配置（禁用代理），避免代理拦截导致 502
-            async with httpx.AsyncClient(**get_localhost_client_kwargs()) as client:
-                resp = await client.get(f"{API_V2_URL}/set_sovits_weights", params={"weights_path": target_sovits})
+        if target_sovits and backend.loaded["sovits"] != target_sovits:
+            logger.info(f"[{character_name}] {backend.url} 切换SoVITS: ...{os.path.basename(target_sovits)[-15:]}")
+            try:
+                # 使用共享的后端客户端（禁用代理），避免代理拦截导致 502
+                client = get_backend_client()
+                resp = await client.get(f"{backend.url}/set_sovits_weights", params={"weights_path": target_sovits}, timeout=get_route_timeout("switch_model"))
                 if resp.status_code == 200:
-                    CURRENT_LOADED_MODELS["sovits"] = target_sovits
+                    backend.loaded["sovits"] = target_sovits
+                    metrics.WEIGHT_SWITCHES.inc(kind="sovits", result="ok")
                     logger.info("SoVITS 切换成功")
                 else:
+                    failed = True
+                    metrics.WEIGHT_SWITCHES.inc(kind="sovits", result="error")
                     logger.error(f"SoVITS 切换失败: status={resp.status_code} reason={resp.reason_phrase} body={resp.text}")
+            except Exception as e:
+                failed = True
+                metrics.WEIGHT_SWITCHES.inc(kind="sovits", result="error")
+                logger.error(f"尝试切换SoVITS失败: {e}")
+
+        if failed:
+            # 切换失败后后端实际加载的权重未知，不能再按已加载该模型路由或预热
+            backend.forget_model()
+        if shared_state is not None and backend.loaded != previous:
+            await shared_state.save_backend(backend)
+
+
+def get_model_key(character_name: str):
+    """ 角色对应的模型标识，使用相同权重的角色可以在同一批次中执行 """
+    if character_name not in CHARACTER_MODEL_MAP:
+        return None
+    model_config = CHARACTER_MODEL_MAP[character_name]
+    return (model_config.get("gpt"), model_config.get("sovits"))
+
+@asynccontextmanager
+async def model_session(character_name: str, exclude: tuple = (), backend: Optional[Backend] = None):
+    """
+    选择后端(优先已加载该角色模型的后端)，切换到角色模型并持有调度租约，
+    直到上下文结束(即合成完成)才允许其他模型在该后端切入。
+    未配置模型的角色不需要切换权重，不参与调度。
+    :param exclude: 本次不使用的后端(如刚刚连接失败的后端)
+    :param backend: 指定使用的后端
+    :return: 选中的后端
+    """
+    key = get_model_key(character_name)
+    async with backend_pool.lease(key, exclude, backend) as backend:
+        if not SCHEDULER_ENABLED or key is None:
+            with timed("switch_model"):
+                await switch_model(character_name, backend)
+            yield backend
+        else:
+            wait_start = time.perf_counter()
+            async with backend.scheduler.acquire(key), shared_model_lease(backend, key):
+                observe_stage("scheduler_wait", time.perf_counter() - wait_start)
+                with timed("switch_model"):
+                    await switch_model(character_name, backend)
+                yield backend
+
+@asynccontextmanager
+async def shared_model_lease(backend: Backend, key):
+    """
+    多进程模式下在本进程的调度租约之外再获取跨进程的模型租约，
+    并读取其他进程切换后的模型加载状态；单进程时不做任何事
+    """
+    if shared_state is None:
+        yield
+        return
+    async with shared_state.model_lease(backend.url, key):
+        await shared_state.sync_backends([backend])
+        yield
+
+async def run_shared_state_sync():
+    """ 定期写入心跳和指标快照，并同步各后端的加载状态(用于选择后端和预热) """
+    while True:
+        try:
+            await shared_state.heartbeat(metrics.registry.snapshot())
+            await shared_state.sync_backends(backend_pool.backends)
         except Exception as e:
-            logger.error(f"尝试切换SoVITS失败: {e}")
+            logger.error(f"同步共享状态失败: {e}")
+        await asyncio.sleep(shared_state.heartbeat_interval)
+
 
+# 模型预热
+def is_model_loaded(backend: Backend, key) -> bool:
+    return key is not None and all(
+        not target or backend.loaded[kind] == target
+        for kind, target in zip(("gpt", "sovits"), key)
+    )
 
-def get_real_audio_extension(file_path: str) -> str:
+async def warmup_reference(character_name: str, backend: Backend) -> bool:
     """
-    获取给定路径文件的真实音频拓展名。
-    通过文件头判断常见音频文件类型，如 wav, ogg, mp3, flac 等。
+    用角色的参考音频合成一句短文本，让后端提前提取并缓存参考音频特征。
+    GPT-SoVITS 只缓存最近一次使用的参考音频，因此只对预测的下一个角色有意义。
     """
-    # 先尝试获取文件的 MIME 类型
-    mime_type, _ = mimetypes.guess_type(file_path)
-    
-    # 根据 MIME 类型返回对应的音频拓展名
-    if mime_type:
-        if mime_type == 'audio/wav':
-            return 'wav'
-        elif mime_type == 'audio/ogg':
-            return 'ogg'
-        elif mime_type == 'audio/mpeg':
-            return 'mp3'
-        elif mime_type == 'audio/flac':
-            return 'flac'
-    
-    # 如果无法识别，返回空字符串
-    return ''
+    voice = voice_index.get_by_name(character_name)
+    if voice is None:
+        return False
+    lang = voice["prompt_lang"]
+    # 没有配置该语言的预热文本时使用参考文本本身，保证与语言一致
+    text = PREWARM_WARMUP_TEXTS.get(lang) or voice["prompt_text"][:20] or character_name
+    request_data = TTS_Request(text=text, text_lang=lang, ref_audio_path=voice["path"]).model_dump()
+    request_data["prompt_text"] = voice["prompt_text"]
+    request_data["prompt_lang"] = lang
+    client = get_backend_client()
+    try:
+        resp = await client.post(f"{backend.url}/tts", json=request_data, timeout=get_route_timeout("tts_file"))
+    except httpx.HTTPError as e:
+        backend_pool.report_failure(backend)
+        logger.warning(f"[{character_name}] 参考音频预热失败: {e}")
+        return False
+    backend_pool.report_success(backend)
+    if resp.status_code != 200:
+        logger.warning(f"[{character_name}] 参考音频预热失败: status={resp.status_code} body={resp.text}")
+        return False
+    return True
+
+async def prewarm_character(character_name: str, backend: Optional[Backend] = None, warmup: Optional[bool] = None) -> dict:
+    """
+    在后端上加载角色的模型权重，并可选地进行参考音频预热
+    :param backend: 目标后端，默认由后端池选择
+    :param warmup: 是否进行参考音频预热，默认使用 PREWARM_REFERENCE_WARMUP
+    """
+    if warmup is None:
+        warmup = PREWARM_REFERENCE_WARMUP
+    start = time.perf_counter()
+    warmed = False
+    async with model_session(character_name, backend=backend) as backend:
+        loaded = is_model_loaded(backend, get_model_key(character_name))
+        if warmup:
+            warmed = await warmup_reference(character_name, backend)
+    seconds = time.perf_counter() - start
+    observe_stage("prewarm", seconds)
+    logger.info(f"[{character_name}] {backend.url} 预热完成: 模型{'已' if loaded else '未'}加载, 参考音频{'已' if warmed else '未'}预热, 耗时 {seconds:.2f}s")
+    return {"character": character_name, "backend": backend.url, "ok": loaded or warmed, "loaded": loaded, "warmup": warmed, "seconds": round(seconds, 3)}
+
+def plan_prewarm(ranking: list):
+    """
+    为最可能使用且尚未加载的角色挑选空闲后端，返回 (角色名, 后端)。
+    排名前 N(N 为后端数)的角色所占用的后端不会被挤占。
+    """
+    ranked = []
+    for character_name in ranking:
+        key = get_model_key(character_name)
+        if key is not None and key not in [k for _, k in ranked]:
+            ranked.append((character_name, key))
+    keep = [key for _, key in ranked[:len(backend_pool.backends)]]
+    for character_name, key in ranked[:len(backend_pool.backends)]:
+        if any(backend.has_model(key) for backend in backend_pool.backends):
+            continue
+        idle = [
+            backend for backend in backend_pool.backends
+            if backend.healthy and backend.outstanding == 0 and not backend.scheduler.pending()
+            and (backend.loaded["gpt"], backend.loaded["sovits"]) not in keep
+        ]
+        if idle:
+            return character_name, idle[0]
+    return None
+
+async def prewarm_target(character_name: str, backend: Optional[Backend], warmup: Optional[bool] = None) -> Optional[dict]:
+    # 多进程时空闲预热只由一个进程执行，且不打断其他进程正在使用的后端
+    if backend is not None and shared_state is not None and not await shared_state.can_prewarm(backend.url):
+        return None
+    return await prewarm_character(character_name, backend, warmup)
+
+prewarmer = Prewarmer(
+    plan_prewarm,
+    prewarm_target,
+    enabled=PREWARM_IDLE_ENABLED,
+    strategy=PREWARM_STRATEGY,
+    idle_after=PREWARM_IDLE_AFTER,
+)
+
+def get_cache_key(request_data: dict, character_name: str) -> Optional[str]:
+    """ 计算请求的缓存键，不满足缓存条件时返回 None """
+    if not AUDIO_CACHE_ENABLED:
+        return None
+    if request_data.get("seed", -1) == -1 and not AUDIO_CACHE_IGNORE_SEED:
+        return None
+    model_config = CHARACTER_MODEL_MAP.get(character_name, {})
+    models = {"gpt": model_config.get("gpt"), "sovits": model_config.get("sovits")}
+    return audio_cache.make_key(request_data, models)
+
+async def iter_cached_audio(data: bytes):
+    for start in range(0, len(data), CACHE_CHUNK_SIZE):
+        yield data[start:start + CACHE_CHUNK_SIZE]
+
+
+# 热重载角色模型配置和 config.py，校验通过后整体替换，不影响进行中的请求
+RELOAD_LOCK: Optional[asyncio.Lock] = None
+
+def apply_hot_config(values: dict):
+    """ 把热重载配置项写入模块全局变量和 config 模块，并同步到各组件 """
+    for name, value in values.items():
+        globals()[name] = value
+        setattr(config_module, name, value)
+    logger.setLevel(logging.DEBUG if DEBUG_MODE else logging.INFO)
+    backend_pool.configure_schedulers(max_batch=SCHEDULER_MAX_BATCH, max_wait=SCHEDULER_MAX_WAIT)
+    if shared_state is not None:
+        shared_state.max_wait = SCHEDULER_MAX_WAIT
+    admission_controller.configure(
+        max_active=per_worker(ADMISSION_MAX_ACTIVE),
+        max_queue=per_worker(ADMISSION_MAX_QUEUE),
+        max_wait=ADMISSION_MAX_WAIT,
+        drop_duplicates=ADMISSION_DROP_DUPLICATES,
+    )
+    output_store.configure(retention=OUTPUT_RETENTION, max_bytes=OUTPUT_MAX_BYTES, max_files=OUTPUT_MAX_FILES)
+    srt_jobs.retention = OUTPUT_RETENTION
+    micro_batcher.configure(
+        enabled=MICRO_BATCH_ENABLED,
+        window=MICRO_BATCH_WINDOW,
+        max_size=MICRO_BATCH_MAX_SIZE,
+        max_chars=MICRO_BATCH_MAX_CHARS,
+    )
+    speculative_store.configure(
+        enabled=SPECULATIVE_ENABLED,
+        ttl=SPECULATIVE_TTL,
+        max_sessions=SPECULATIVE_MAX_SESSIONS,
+        concurrency=SPECULATIVE_CONCURRENCY,
+    )
+    prewarmer.configure(enabled=PREWARM_IDLE_ENABLED, strategy=PREWARM_STRATEGY, idle_after=PREWARM_IDLE_AFTER)
+    audio_cache.memory_max_bytes = AUDIO_CACHE_MEMORY_MAX_BYTES
+    audio_cache.memory_max_entries = AUDIO_CACHE_MEMORY_MAX_ENTRIES
+    audio_cache.disk_max_bytes = AUDIO_CACHE_DISK_MAX_BYTES
+    audio_cache.disk_max_entries = AUDIO_CACHE_DISK_MAX_ENTRIES
+    voice_index.default_lang = GLOBAL_DEFAULT_LANG
+
+async def reload_config() -> dict:
+    """
+    重新读取 models.json 和 config.py 并应用。
+    :return: 变化内容，包括角色的增删改、已生效的配置项和需要重启才能生效的配置项
+    :raises ValueError: 配置校验失败，此时不会应用任何修改
+    """
+    global RELOAD_LOCK, CHARACTER_MODEL_MAP, CURRENT_CONFIG, LOADED_CONFIG
+    if RELOAD_LOCK is None:
+        RELOAD_LOCK = asyncio.Lock()
+    async with RELOAD_LOCK:
+        loop = asyncio.get_running_loop()
+        models_path = get_models_config_path()
+        new_models = {}
+        if os.path.exists(models_path):
+            new_models = await loop.run_in_executor(None, load_models_file, models_path)
+        new_config = await loop.run_in_executor(None, load_config_file, config_module.__file__)
+
+        models_diff = diff_models(CHARACTER_MODEL_MAP, new_models)
+        applied = {name: change for name, change in diff_config(CURRENT_CONFIG, new_config).items() if name in HOT_RELOAD_CONFIG}
+        restart_required = {name: change for name, change in diff_config(LOADED_CONFIG, new_config).items() if name not in HOT_RELOAD_CONFIG}
+        # 先校验全部新值，有任何不合法的配置项都不做修改
+        validate_config(CURRENT_CONFIG, new_config, applied, HOT_RELOAD_MINIMUMS, HOT_RELOAD_CHOICES)
+
+        if applied:
+            previous = {name: CURRENT_CONFIG[name] for name in applied}
+            try:
+                apply_hot_config({name: new_config[name] for name in applied})
+            except Exception as e:
+                # 恢复原配置，不留下只应用了一部分的状态
+                apply_hot_config(previous)
+                raise ValueError(f"应用配置失败，已恢复原配置: {e}")
+            CURRENT_CONFIG = {**CURRENT_CONFIG, **{name: new_config[name] for name in applied}}
+        CHARACTER_MODEL_MAP = new_models
+        LOADED_CONFIG = new_config
+
+        # 参考音频索引中的 prompt_lang 来自角色配置和默认语言，需要重建
+        if any(models_diff.values()) or "GLOBAL_DEFAULT_LANG" in applied:
+            await loop.run_in_executor(None, voice_index.rebuild)
+
+        logger.info(
+            f"配置已重载: 新增角色 {len(models_diff['added'])} 个, 删除 {len(models_diff['removed'])} 个, "
+            f"修改 {len(models_diff['changed'])} 个; 生效配置项 {list(applied)}"
+        )
+        if restart_required:
+            logger.warning(f"以下配置项需要重启后生效: {list(restart_required)}")
+        return {"models": models_diff, "config": {"applied": applied, "restart_required": restart_required}}
+
+async def reload_on_change():
+    try:
+        await reload_config()
+    except Exception as e:
+        logger.error(f"配置热重载失败，继续使用原配置: {e}")
+
 
 # 依旧是ST和卡面兼容性问题，处理路径问题和加载角色prompt
 # (感觉ST的GPT-SoVITSv2好久没人维护了，传过来的路径特别奇怪，等有空了看看能不能改改交个pr(又挖坑...))
@@ -193,144 +705,595 @@ async def fix_request_path_and_load_prompt(request_data: dict):
         filename = ".".join(split_filename[:-2]) + "." + split_filename[-1]
     # 文件名就是对应的角色名
     character_name = os.path.splitext(filename)[0]
-    abs_file_path = os.path.join(REF_AUDIO_DIR, filename)
+    # 从参考音频索引中读取路径、参考文本、语言和格式
+    with timed("fix_path"):
+        voice = voice_index.get(filename)
+        if voice is None:
+            # 索引中尚未收录(如刚放入的文件)，直接读取文件系统
+            voice = await asyncio.get_running_loop().run_in_executor(None, voice_index.probe, filename)
+    abs_file_path = voice["path"]
     request_data["ref_audio_path"] = abs_file_path
     # 加载角色信息
-    target_lang = GLOBAL_DEFAULT_LANG
-    if character_name in CHARACTER_MODEL_MAP:
-        config_lang = CHARACTER_MODEL_MAP[character_name].get("prompt_lang")
-        if config_lang:
-            target_lang = config_lang
+    target_lang = voice["prompt_lang"]
     request_data["prompt_lang"] = target_lang
-    # 读取参考文本
-    txt_path = os.path.splitext(abs_file_path)[0] + ".txt"
-    prompt_text = ""
-    if os.path.exists(txt_path):
-        try:
-            with open(txt_path, "r", encoding="utf-8") as f:
-                prompt_text = f.read().strip()
-                logger.info(f"成功使用[{target_lang}]读取角色 {character_name} 参考文本:\"{prompt_text[:10]}...\"")
-        except: 
-            logger.warning(f"读取角色 {character_name} 参考文本失败，本次推理将以不使用参考文本的形式进行")
-    else:
-        prompt_text = character_name
-
+    # 参考文本
+    prompt_text = voice["prompt_text"]
+    logger.info(f"使用[{target_lang}]角色 {character_name} 参考文本:\"{prompt_text[:10]}...\"")
     request_data["prompt_text"] = prompt_text
-    # 读取参考音频后缀
-    true_extension_name = get_real_audio_extension(abs_file_path)
-    if true_extension_name != "":
-        request_data["media_type"] = true_extension_name
-    else:
-        logger.warning(f"无法识别参考音频 {abs_file_path} 的真实格式，使用默认 media_type: {request_data.get('media_type', 'wav')}")
+    # media_type 是客户端要求的输出格式，与参考音频格式无关，不再覆盖
+    if voice["media_type"] == "":
+        logger.warning(f"无法识别参考音频 {abs_file_path} 的真实格式")
     # 清理文本中的垃圾内容，将其单独抽象出来形成插件
-    request_data["text"] = await plugin_manager.run_hook(
-        "on_clean_text", 
-        data=request_data.get("text", ""),
-        character_name=character_name,
-        target_lang=target_lang
-    )
+    with timed("clean"):
+        request_data["text"] = await plugin_manager.run_hook(
+            "on_clean_text", 
+            data=request_data.get("text", ""),
+            character_name=character_name,
+            target_lang=target_lang
+        )
     return request_data, character_name, target_lang
 
 # 路由转发
 
-@app.post("/")
-@app.post("/tts")
-async def tts_stream_endpoint(request: TTS_Request):
-    request_data = request.model_dump()
-    request_data, character_name, target_lang = await fix_request_path_and_load_prompt(request_data)
-    logger.debug(f"处理后的请求数据: {request_data}")
+class BackendError(Exception):
+    """ 后端返回了非 200 的响应 """
+    def __init__(self, body: bytes):
+        super().__init__(body)
+        self.body = body
+        self.detail = body.decode("utf-8", errors="replace")
 
-    # 根据请求切换模型
-    await switch_model(character_name)
+async def stream_backend_tts(request_data: dict, character_name: str, route: str = "tts_stream", batchable: bool = True):
+    """
+    流式获取一次合成的音频，优先使用缓存，未命中时请求后端并在完整接收后写入缓存。
+    后端返回错误时抛出 BackendError。
+    :param route: 超时配置的路由名(BACKEND_TIMEOUTS 的键)
+    :param batchable: 是否允许与其他请求合并批量推理。分句流水线和预合成的单句需要尽快得到结果，
+                      合并后要等待整批完成和合并窗口，不参与合并
+    """
+    cache_key = get_cache_key(request_data, character_name)
+    cached_audio = await audio_cache.get(cache_key) if cache_key else None
+    if cache_key:
+        metrics.AUDIO_CACHE_REQUESTS.inc(result="hit" if cached_audio is not None else "miss")
+    if cached_audio is not None:
+        logger.info(f"[{character_name}] 命中音频缓存")
+        async for chunk in iter_cached_audio(cached_audio):
+            yield chunk
+        return
 
-    # 运行插件钩子
-    request_data = await plugin_manager.run_hook(
-        "on_tts_request_streaming", 
-        data=request_data, 
-        target_lang=target_lang
-    )
-    logger.debug(f"插件处理后的请求数据: {request_data}")
+    # 非流式请求尝试与同一角色的并发请求合并为一次批量推理
+    merged_audio = await micro_batcher.submit(character_name, request_data) if batchable else None
+    if merged_audio is not None:
+        metrics.MICRO_BATCHED_REQUESTS.inc()
+        if cache_key:
+            await audio_cache.put(cache_key, merged_audio)
+        async for chunk in iter_cached_audio(merged_audio):
+            yield chunk
+        return
 
-    # 发送请求到后端TTS服务
-    url = f"{API_V2_URL}/tts"
-    async def stream_generator():
+    chunks = []
+    tried = []
+    while True:
+        backend = None
+        yielded = False
         try:
-            # 使用本地请求配置（禁用代理），避免代理拦截导致 502
-            async with httpx.AsyncClient(**get_localhost_client_kwargs()) as client:
-                async with client.stream("POST", url, json=request_data) as resp:
+            # 根据请求选择后端并切换模型，在整个合成期间持有模型
+            async with model_session(character_name, tuple(tried)) as backend:
+                # 使用共享的后端客户端（禁用代理），避免代理拦截导致 502
+                client = get_backend_client()
+                request_start = time.perf_counter()
+                async with client.stream("POST", f"{backend.url}/tts", json=request_data, timeout=get_route_timeout(route)) as resp:
                     if resp.status_code != 200:
-                        err = await resp.aread()
-                        logger.error(f"后端错误: {err}")
-                        yield err
-                        return
-                    async for chunk in resp.aiter_bytes():
+                        metrics.BACKEND_ERRORS.inc(kind="status")
+                        raise BackendError(await resp.aread())
+                    backend_pool.report_success(backend)
+                    async for chunk in resp.aiter_bytes(CACHE_CHUNK_SIZE if route == "tts_file" else None):
+                        if not yielded:
+                            observe_stage("backend_ttfb", time.perf_counter() - request_start)
+                            yielded = True
+                        if cache_key:
+                            chunks.append(chunk)
                         yield chunk
+            break
+        except httpx.HTTPError as e:
+            metrics.BACKEND_ERRORS.inc(kind="connection")
+            if backend is None:
+                raise
+            backend_pool.report_failure(backend)
+            tried.append(backend)
+            # 还没有向客户端输出数据时，换一个后端重试
+            if yielded or len(tried) >= len(backend_pool.backends):
+                raise
+            logger.warning(f"后端 {backend.url} 请求失败，尝试其他后端: {e}")
+    # 完整接收后才写入缓存，中途断开的不缓存
+    if cache_key:
+        await audio_cache.put(cache_key, b"".join(chunks))
+
+async def execute_merged_request(character_name: str, request_data: dict) -> bytes:
+    """ 执行合并后的批量请求，返回完整的音频 """
+    async with model_session(character_name) as backend:
+        client = get_backend_client()
+        try:
+            with timed("backend_total"):
+                resp = await client.post(f"{backend.url}/tts", json=request_data, timeout=get_route_timeout("tts_file"))
+        except httpx.HTTPError:
+            metrics.BACKEND_ERRORS.inc(kind="connection")
+            backend_pool.report_failure(backend)
+            raise
+        backend_pool.report_success(backend)
+    if resp.status_code != 200:
+        metrics.BACKEND_ERRORS.inc(kind="status")
+        raise BackendError(resp.content)
+    return resp.content
+
+micro_batcher = MicroBatcher(
+    execute_merged_request,
+    enabled=MICRO_BATCH_ENABLED,
+    window=MICRO_BATCH_WINDOW,
+    max_size=MICRO_BATCH_MAX_SIZE,
+    max_chars=MICRO_BATCH_MAX_CHARS,
+)
+
+async def meter_stream(stream, endpoint: str, slot: Optional[AdmissionSlot] = None):
+    """
+    统计返回给客户端的字节数和整个流的耗时。
+    流结束或客户端断开时立即关闭上游(后端)流并归还执行名额。
+    """
+    start = time.perf_counter()
+    try:
+        async for chunk in stream:
+            metrics.BYTES_STREAMED.inc(len(chunk), endpoint=endpoint)
+            yield chunk
+    finally:
+        if hasattr(stream, "aclose"):
+            await stream.aclose()
+        if slot is not None:
+            slot.release()
+        observe_stage("stream_total", time.perf_counter() - start)
+
+def prepare_output(request_data: dict, output_format: Optional[str], sample_rate: int) -> dict:
+    """
+    确定客户端要求的输出格式(?format= 优先，其次是请求中的 media_type)。
+    注册了响应处理插件(如转码)时后端统一输出 WAV，由插件转换格式；否则交给后端处理。
+    """
+    requested = (output_format or request_data.get("media_type") or "wav").lower()
+    if plugin_manager.has_hook("on_tts_response_streaming"):
+        request_data["media_type"] = "wav"
+    elif requested in BACKEND_MEDIA_TYPES:
+        request_data["media_type"] = requested
+    else:
+        logger.warning(f"后端不支持输出格式 {requested} 且未启用转码插件，返回 wav")
+        request_data["media_type"] = "wav"
+    return {"format": requested, "sample_rate": sample_rate, "media_type": None}
+
+def client_id(req_obj: Request) -> Optional[str]:
+    """ 客户端地址(经过反向代理时由 uvicorn 根据 X-Forwarded-For 还原)，用于区分不同客户端 """
+    return req_obj.client.host if req_obj.client else None
+
+async def admit_request(is_disconnected, character_name: str, text: str, client: Optional[str] = None) -> AdmissionSlot:
+    """
+    获取执行名额，过载时抛出 AdmissionRejected。
+    同一客户端相同角色和文本(如 SillyTavern 重新生成同一句)的旧请求若仍在排队会被丢弃，
+    不同客户端恰好请求同一句台词时互不影响。
+    :param is_disconnected: 检查客户端是否已断开的协程函数，后台任务传 None
+    :param client: 客户端标识，未知时不丢弃重复请求
+    """
+    key = (client, character_name, text) if client is not None else None
+    try:
+        return await admission_controller.acquire(key, is_disconnected)
+    except AdmissionRejected as e:
+        metrics.ADMISSION_REJECTIONS.inc(reason=e.reason)
+        logger.warning(f"[{character_name}] 请求未被接纳: {e.detail}")
+        raise
+
+def rejection_response(e: AdmissionRejected) -> JSONResponse:
+    headers = {"Retry-After": str(ADMISSION_RETRY_AFTER)} if e.status_code in (429, 503) else None
+    return JSONResponse(status_code=e.status_code, content={"msg": "Error", "detail": e.detail}, headers=headers)
+
+def split_sentences(text: str) -> list:
+    """
+    按句末标点切分文本，过短的句子与后一句合并，避免产生大量很短的合成请求
+    """
+    def join(head: str, tail: str) -> str:
+        # 英文句子之间的空格在切分时被去掉了，合并时补回
+        return f"{head} {tail}" if head[-1:].isascii() and head[-1:].strip() else head + tail
+
+    pieces = [piece.strip() for piece in SENTENCE_SPLIT_PATTERN.split(text) if piece and piece.strip()]
+    sentences = []
+    buffer = ""
+    for piece in pieces:
+        buffer = join(buffer, piece)
+        if len(buffer) >= PIPELINE_MIN_CHARS:
+            sentences.append(buffer)
+            buffer = ""
+    if buffer:
+        if sentences:
+            sentences[-1] = join(sentences[-1], buffer)
+        else:
+            sentences.append(buffer)
+    return sentences
+
+async def pipeline_generator(request_data: dict, sentences: list, character_name: str, target_lang: str,
+                             prepared: Optional[dict] = None):
+    """
+    分句流水线：各句的插件处理(如翻译)与合成并发进行，按顺序输出。
+    各句的 WAV 文件头原样输出，由 normalize_wav_stream 合并为一个。
+    :param prepared: 句子序号 -> 预合成任务，有结果的句子不再合成
+    """
+    # 队列有上限，客户端读取较慢时合成随之暂停，不会把整段音频堆积在内存中。
+    # 合成名额按句子顺序发放(前一轮的句子结束后才轮到后面的句子)，
+    # 正在被读取的句子总能拿到名额，不会因后面的句子占满名额并等待读取而卡住
+    concurrency = PIPELINE_CONCURRENCY
+    turns = [asyncio.Event() for _ in sentences]
+    for turn in turns[:concurrency]:
+        turn.set()
+    queues = [asyncio.Queue(maxsize=PIPELINE_QUEUE_CHUNKS) for _ in sentences]
+
+    async def produce(index: int, sentence: str):
+        try:
+            task = prepared.get(index) if prepared else None
+            audio = None
+            if task is not None:
+                if task in speculative_waiting:
+                    # 预合成仍在排队等待准入名额，取消后直接合成，避免等待排在本请求之后的任务
+                    task.cancel()
+                try:
+                    audio = await task
+                except asyncio.CancelledError:
+                    # 被取消的是本协程自身时继续向上抛出
+                    if not task.cancelled():
+                        raise
+                    logger.info(f"第 {index + 1} 句的预合成已被取消，重新合成")
+                except Exception as e:
+                    logger.warning(f"第 {index + 1} 句的预合成失败，重新合成: {e}")
+            if audio is not None:
+                await queues[index].put(audio)
+            else:
+                await turns[index].wait()
+                chunk_data = dict(request_data, text=sentence)
+                chunk_data = await plugin_manager.run_hook(
+                    "on_tts_request_streaming",
+                    data=chunk_data,
+                    target_lang=target_lang
+                )
+                backend_stream = stream_backend_tts(chunk_data, character_name, batchable=False)
+                try:
+                    async for chunk in backend_stream:
+                        await queues[index].put(chunk)
+                finally:
+                    await backend_stream.aclose()
+        except BackendError as e:
+            logger.error(f"第 {index + 1} 句合成失败，已跳过: {e.body}")
         except Exception as e:
-            logger.error(f"连接后端失败: {e}")
-            yield b"Connection Error"
+            logger.error(f"第 {index + 1} 句连接后端失败，已跳过: {e}")
+        finally:
+            if index + concurrency < len(turns):
+                turns[index + concurrency].set()
+        # 结束标记在队列满时等待读取；任务被取消时(客户端已断开)不再需要
+        await queues[index].put(None)
+
+    tasks = [asyncio.create_task(produce(index, sentence)) for index, sentence in enumerate(sentences)]
+    try:
+        for queue in queues:
+            while (chunk := await queue.get()) is not None:
+                yield chunk
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def clean_ingested_text(text: str, session: SpeculativeSession) -> str:
+    return await plugin_manager.run_hook(
+        "on_clean_text",
+        data=text,
+        character_name=session.character_name,
+        target_lang=session.target_lang
+    )
+
+# 正在排队等待准入名额的预合成任务
+speculative_waiting = set()
+
+async def synthesize_segment(session: SpeculativeSession, sentence: str) -> bytes:
+    """
+    预合成一句，与分句流水线相同地经过请求插件(如翻译)，返回完整的 WAV。
+    预合成同样占用准入名额，但排在所有客户端请求之后，过载时被拒绝的句子在正式请求时照常合成
+    """
+    task = asyncio.current_task()
+    speculative_waiting.add(task)
+    try:
+        slot = await admission_controller.acquire(priority=BACKGROUND_PRIORITY)
+    finally:
+        speculative_waiting.discard(task)
+    try:
+        chunk_data = dict(session.request_data, text=sentence)
+        chunk_data = await plugin_manager.run_hook(
+            "on_tts_request_streaming",
+            data=chunk_data,
+            target_lang=session.target_lang
+        )
+        chunks = []
+        async for chunk in stream_backend_tts(chunk_data, session.character_name, batchable=False):
+            chunks.append(chunk)
+        return b"".join(chunks)
+    finally:
+        slot.release()
+
+speculative_store = SpeculativeStore(
+    clean_ingested_text,
+    split_sentences,
+    synthesize_segment,
+    enabled=SPECULATIVE_ENABLED,
+    ttl=SPECULATIVE_TTL,
+    max_sessions=SPECULATIVE_MAX_SESSIONS,
+    concurrency=SPECULATIVE_CONCURRENCY,
+)
+
+# 推送仍在生成中的消息的增量文本，提前合成已完成的句子
+@router.post("/ingest")
+async def ingest_endpoint(request: Ingest_Request):
+    if not speculative_store.enabled:
+        return JSONResponse(status_code=404, content={"msg": "Error", "detail": "预合成未启用"})
+    session = speculative_store.get(request.message_id)
+    if session is None:
+        request_data = request.model_dump(exclude={"message_id", "done"})
+        request_data["text"] = ""
+        request_data, character_name, target_lang = await fix_request_path_and_load_prompt(request_data)
+        # 各句合成完整的 WAV，由 /tts 拼接
+        request_data["media_type"] = "wav"
+        request_data["streaming_mode"] = False
+        session = speculative_store.open(request.message_id, character_name, target_lang, request_data)
+        prewarmer.record(character_name)
+    await speculative_store.feed(session, request.text, request.done)
+    return JSONResponse(session.info())
+
+# 丢弃消息的预合成结果(如生成被中止)
+@router.delete("/ingest/{message_id}")
+def ingest_discard_endpoint(message_id: str):
+    if not speculative_store.discard(message_id):
+        return JSONResponse(status_code=404, content={"msg": "Error", "detail": f"未找到消息 {message_id}"})
+    return JSONResponse({"message_id": message_id, "discarded": True})
+
+@router.get("/ingest/stats")
+def ingest_stats_endpoint():
+    return JSONResponse(speculative_store.info())
+
+@router.post("/")
+@router.post("/tts")
+async def tts_stream_endpoint(request: TTS_Request, req_obj: Request,
+                              output_format: Optional[str] = Query(None, alias="format"), sample_rate: int = 0,
+                              message_id: Optional[str] = None):
+    metrics.REQUESTS.inc(endpoint="tts")
+    timings = {}
+    metrics.current_timings.set(timings)
+    request_data = request.model_dump()
+    request_data, character_name, target_lang = await fix_request_path_and_load_prompt(request_data)
+    logger.debug(f"处理后的请求数据: {request_data}")
+    prewarmer.record(character_name)
+    output = prepare_output(request_data, output_format, sample_rate)
+
+    # 准入控制，过载时快速拒绝
+    try:
+        slot = await admit_request(req_obj.is_disconnected, character_name, request_data.get("text", ""), client_id(req_obj))
+    except AdmissionRejected as e:
+        return rejection_response(e)
+    try:
+        return await build_tts_stream_response(request_data, character_name, target_lang, timings, slot, output, message_id)
+    except BaseException:
+        slot.release()
+        raise
+
+async def build_tts_stream_response(request_data: dict, character_name: str, target_lang: str, timings: dict,
+                                    slot: AdmissionSlot, output: dict, message_id: Optional[str] = None):
+
+    # 分句流水线模式和预合成，仅支持 wav 输出(需要拼接多段音频)
+    sentences = []
+    prepared = None
+    if request_data.get("media_type") == "wav" and (PIPELINE_ENABLED or speculative_store.sessions):
+        sentences = split_sentences(request_data.get("text", ""))
+        prepared = speculative_store.match(character_name, request_data, sentences, message_id)
+    use_pipeline = bool(prepared) or (PIPELINE_ENABLED and len(sentences) > 1)
 
-    stream_data = stream_generator()
+    if use_pipeline:
+        logger.info(f"[{character_name}] 分句流水线合成: 共 {len(sentences)} 句")
+        stream_data = pipeline_generator(request_data, sentences, character_name, target_lang, prepared)
+    else:
+        # 运行插件钩子
+        with timed("request_plugins"):
+            request_data = await plugin_manager.run_hook(
+                "on_tts_request_streaming", 
+                data=request_data, 
+                target_lang=target_lang
+            )
+        logger.debug(f"插件处理后的请求数据: {request_data}")
+
+        # 发送请求到后端TTS服务
+        async def stream_generator():
+            backend_stream = stream_backend_tts(request_data, character_name)
+            try:
+                async for chunk in backend_stream:
+                    yield chunk
+            except BackendError as e:
+                logger.error(f"后端错误: {e.body}")
+                yield e.body
+            except Exception as e:
+                logger.error(f"连接后端失败: {e}")
+                yield b"Connection Error"
+            finally:
+                await backend_stream.aclose()
+
+        stream_data = stream_generator()
+
+    # 整理 WAV 流：合并多段文件头、按固定时长切分、片段间插入静音
+    if use_pipeline or STREAM_FRAME_MS > 0:
+        silence = request_data.get("fragment_interval", 0) if STREAM_INSERT_SILENCE else 0
+        stream_data = normalize_wav_stream(stream_data, STREAM_FRAME_MS, silence)
+
+    # 响应插件(如转码)可以通过 output["media_type"] 修改返回的 Content-Type
     stream_data = await plugin_manager.run_hook(
         "on_tts_response_streaming",
         data=stream_data,
         character_name=character_name,
-        target_lang=target_lang
+        target_lang=target_lang,
+        output=output
+    )
+    # 流式响应的响应头在合成开始前发出，Server-Timing 只包含合成前的阶段
+    headers = {"Server-Timing": metrics.server_timing_header(timings)} if METRICS_SERVER_TIMING else None
+    # 客户端在开始接收前断开时流不会被迭代，由后台任务兜底归还名额
+    return StreamingResponse(
+        meter_stream(stream_data, "tts", slot),
+        media_type=output["media_type"] or f"audio/{request_data.get('media_type') or 'wav'}",
+        headers=headers,
+        background=BackgroundTask(slot.release)
     )
-    return StreamingResponse(stream_data, media_type="audio/wav")
 
 # 获取可用角色列表
-@app.get("/speakers")
+@router.get("/speakers")
 def speakers_endpoint():
-    voices = []
-    if os.path.exists(REF_AUDIO_DIR):
-        for name in os.listdir(REF_AUDIO_DIR):
-            if name.lower().endswith(('.wav', '.mp3', '.ogg')):
-                display_name = os.path.splitext(name)[0]
-                voices.append({"name": display_name, "voice_id": name})
-    return JSONResponse(voices)
-
-@app.get("/speakers_list")
+    return JSONResponse(voice_index.voices())
+
+# Prometheus 指标
+@router.get("/metrics")
+async def metrics_endpoint():
+    # 多进程时汇总所有工作进程的指标
+    snapshots = await shared_state.other_metrics() if shared_state is not None else ()
+    return PlainTextResponse(metrics.registry.render(snapshots), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# 微批处理统计
+@router.get("/batch/stats")
+def batch_stats_endpoint():
+    return JSONResponse(micro_batcher.info())
+
+# 后端状态
+@router.get("/backends")
+def backends_endpoint():
+    return JSONResponse(backend_pool.info())
+
+# 预热角色模型，如 SillyTavern 切换聊天时提前调用
+@router.post("/prewarm")
+async def prewarm_endpoint(character: str, warmup: Optional[bool] = None):
+    if character not in CHARACTER_MODEL_MAP and voice_index.get_by_name(character) is None:
+        return JSONResponse(status_code=404, content={"msg": "Error", "detail": f"未找到角色 {character}"})
+    prewarmer.record(character)
+    # 经过 prewarmer 合并同一角色的并发预热，重复调用不会重复切换模型和合成
+    result = await prewarmer.prewarm(character, warmup=warmup)
+    if result is None:
+        return JSONResponse(status_code=502, content={"msg": "Error", "detail": f"预热角色 {character} 失败"})
+    return JSONResponse(result)
+
+# 音频缓存统计
+@router.get("/cache/stats")
+def cache_stats_endpoint():
+    return JSONResponse(audio_cache.info())
+
+# 启动各阶段耗时和插件加载状态
+@router.get("/startup")
+def startup_endpoint():
+    return JSONResponse({
+        "steps_ms": {name: round(seconds * 1000, 1) for name, seconds in STARTUP_REPORT.items()},
+        "plugins": plugin_manager.info(),
+    })
+
+# 重新加载角色模型配置和 config.py
+@router.post("/admin/reload")
+async def reload_endpoint():
+    try:
+        changes = await reload_config()
+    except Exception as e:
+        logger.error(f"配置热重载失败: {e}")
+        return JSONResponse(status_code=400, content={"msg": "Error", "detail": str(e)})
+    return JSONResponse(changes)
+
+@router.get("/speakers_list")
 def speakers_list_endpoint():
     return JSONResponse(["female", "male"], 200)
 
-@app.post("/srt")
-async def tts_file_endpoint(request: TTS_Request, req_obj: Request):
+async def synthesize_to_file(request_data: dict, character_name: str, filename: str, base: str, is_disconnected=None,
+                             client: Optional[str] = None) -> dict:
+    """
+    合成音频并分块写入输出目录，不在内存中保留完整音频(命中缓存或需要写入缓存时除外)
+    :raises AdmissionRejected: 请求未被接纳
+    :raises BackendError: 后端返回错误
+    """
+    slot = await admit_request(is_disconnected, character_name, request_data.get("text", ""), client)
+    try:
+        with timed("backend_total"):
+            size = await output_store.write(filename, stream_backend_tts(request_data, character_name, "tts_file"))
+    finally:
+        slot.release()
+    metrics.BYTES_STREAMED.inc(size, endpoint="srt")
+    return {
+        "srt": f"{base}/srt/tts-out.srt",
+        "audio": f"{base}/srt/{filename}"
+    }
+
+@router.post("/srt")
+async def tts_file_endpoint(request: TTS_Request, req_obj: Request, async_mode: bool = Query(False, alias="async")):
+    metrics.REQUESTS.inc(endpoint="srt")
+    timings = {}
+    metrics.current_timings.set(timings)
     request_data = request.model_dump()
-    request_data, character_name, target_lang = fix_request_path_and_load_prompt(request_data)
+    request_data, character_name, target_lang = await fix_request_path_and_load_prompt(request_data)
+    prewarmer.record(character_name)
     
     request_data["streaming_mode"] = False
-    await switch_model(character_name)
 
-    request_data = await plugin_manager.run_hook(
-        "on_srt_request_streaming", 
-        data=request_data, 
-        target_lang=target_lang,
-        character_name=character_name
-    )
+    with timed("request_plugins"):
+        request_data = await plugin_manager.run_hook(
+            "on_srt_request_streaming", 
+            data=request_data, 
+            target_lang=target_lang,
+            character_name=character_name
+        )
 
-    url = f"{API_V2_URL}/tts"
-    async with httpx.AsyncClient(**get_localhost_client_kwargs()) as client:
-        resp = await client.post(url, json=request_data)
-        if resp.status_code != 200:
-            return JSONResponse(status_code=400, content={"msg": "Error", "detail": resp.text})
-        data = resp.content
-
-    filename = "audio.wav"
-    with open(os.path.join(OUTPUT_DIR, filename), "wb") as f:
-        f.write(data)
-        
+    # 文件模式不经过转码插件，直接使用后端支持的格式
+    if request_data.get("media_type") not in BACKEND_MEDIA_TYPES:
+        request_data["media_type"] = "wav"
+    # 每个请求使用独立的输出文件，并发请求不会互相覆盖
+    filename = output_store.new_filename(f".{request_data['media_type']}")
     base = f"http://{req_obj.url.hostname}:{req_obj.url.port}"
-    return JSONResponse({
-        "code": "200", 
-        "srt": f"{base}/srt/tts-out.srt", 
-        "audio": f"{base}/srt/{filename}"
-    })
+    client = client_id(req_obj)
+
+    # 后台模式：立即返回任务 id，通过 /jobs/{job_id} 查询结果
+    if async_mode:
+        job = srt_jobs.submit(lambda: synthesize_to_file(request_data, character_name, filename, base, client=client))
+        return JSONResponse(status_code=202, content={
+            "code": "202",
+            "job_id": job["id"],
+            "status": f"{base}/jobs/{job['id']}"
+        })
+
+    try:
+        result = await synthesize_to_file(request_data, character_name, filename, base, req_obj.is_disconnected, client)
+    except AdmissionRejected as e:
+        return rejection_response(e)
+    except BackendError as e:
+        return JSONResponse(status_code=400, content={"msg": "Error", "detail": e.detail})
+
+    headers = {"Server-Timing": metrics.server_timing_header(timings)} if METRICS_SERVER_TIMING else None
+    return JSONResponse({"code": "200", **result}, headers=headers)
+
+# 查询后台合成任务
+@router.get("/jobs/{job_id}")
+async def job_endpoint(job_id: str):
+    job = await srt_jobs.lookup(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"msg": "Error", "detail": f"任务 {job_id} 不存在或已过期"})
+    return JSONResponse(job)
 
 # 启动服务
+app = create_app()
+
 if __name__ == "__main__":
+    import uvicorn
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--port", type=int, default=9881)
+    parser.add_argument("-w", "--workers", type=int, default=WORKERS, help="工作进程数")
     args = parser.parse_args()
     
     print(f"\n服务已启动, 监听端口: {args.port}") 
-    uvicorn.run(app, host="0.0.0.0", port=args.port)
\ No newline at end of file
+    if args.workers > 1:
+        # 多进程模式需要以模块路径启动，各工作进程重新导入本模块
+        SharedState.reset(SHARED_STATE_PATH)
+        os.environ["ADAPTER_WORKERS"] = str(args.workers)
+        uvicorn.run("adapter:app", host="0.0.0.0", port=args.port, workers=args.workers, app_dir=BASE_DIR)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=args.port)
\ No newline at end of file
@@ -0,0 +1,133 @@
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Hashable, Optional, Tuple
+
+# 排队优先级，数字越小越先放行；同一优先级按先来后到
+NORMAL_PRIORITY = 0
+# 后台任务(如预合成)排在所有客户端请求之后
+BACKGROUND_PRIORITY = 10
+
+
+class AdmissionRejected(Exception):
+    """ 请求未被接纳，status_code 为应返回给客户端的状态码 """
+
+    def __init__(self, status_code: int, reason: str, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.detail = detail
+
+
+class AdmissionSlot:
+    """ 已获得的执行名额，release 可以重复调用 """
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release()
+
+
+class AdmissionController:
+    """
+    限制同时执行的合成请求数，超出的请求排队等待。
+    队列已满时立即拒绝(429)，排队超时拒绝(503)；客户端在排队期间断开时直接移出队列；
+    同一句台词(相同 key)的新请求到达时，仍在排队的旧请求会被丢弃(409)，避免重复合成被放弃的请求。
+    """
+
+    def __init__(self, max_active: int = 8, max_queue: int = 32, max_wait: float = 30.0,
+                 drop_duplicates: bool = True, poll_interval: float = 0.5):
+        # 最大同时执行数，0 表示不限制
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.drop_duplicates = drop_duplicates
+        # 检查客户端是否断开的间隔(秒)
+        self.poll_interval = poll_interval
+        self.active = 0
+        # (优先级, key, future)，按优先级排列
+        self.waiters: Deque[Tuple[int, Optional[Hashable], asyncio.Future]] = deque()
+
+    def configure(self, max_active: Optional[int] = None, max_queue: Optional[int] = None,
+                  max_wait: Optional[float] = None, drop_duplicates: Optional[bool] = None):
+        if max_active is not None:
+            self.max_active = max_active
+        if max_queue is not None:
+            self.max_queue = max_queue
+        if max_wait is not None:
+            self.max_wait = max_wait
+        if drop_duplicates is not None:
+            self.drop_duplicates = drop_duplicates
+        self._wake()
+
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self.waiters if not future.done())
+
+    def _has_capacity(self) -> bool:
+        return self.max_active <= 0 or self.active < self.max_active
+
+    def _wake(self):
+        """ 按优先级和先来后到放行排队中的请求 """
+        while self.waiters and self._has_capacity():
+            _, _, future = self.waiters.popleft()
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(True)
+
+    def _release(self):
+        self.active -= 1
+        self._wake()
+
+    def _drop_duplicates(self, key: Hashable):
+        for _, waiter_key, future in self.waiters:
+            if waiter_key == key and not future.done():
+                future.set_exception(AdmissionRejected(409, "superseded", "相同内容的新请求已到达，本请求已被丢弃"))
+
+    async def acquire(self, key: Optional[Hashable] = None,
+                      is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+                      priority: int = NORMAL_PRIORITY) -> AdmissionSlot:
+        """
+        获取执行名额
+        :param key: 请求内容的标识(如角色名 + 文本)，用于丢弃重复的排队请求
+        :param is_disconnected: 检查客户端是否已断开的协程函数
+        :param priority: 排队优先级，数字越小越先放行
+        :raises AdmissionRejected: 请求被拒绝
+        """
+        if self.drop_duplicates and key is not None:
+            self._drop_duplicates(key)
+        if self.queued() == 0 and self._has_capacity():
+            self.active += 1
+            return AdmissionSlot(self)
+        if self.queued() >= self.max_queue:
+            raise AdmissionRejected(429, "queue_full", "请求过多，排队已满")
+
+        future = asyncio.get_running_loop().create_future()
+        # 插入到同优先级的最后一个请求之后
+        index = len(self.waiters)
+        while index > 0 and self.waiters[index - 1][0] > priority:
+            index -= 1
+        self.waiters.insert(index, (priority, key, future))
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise AdmissionRejected(503, "timeout", f"排队超过 {self.max_wait} 秒")
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), timeout=min(self.poll_interval, remaining))
+                    return AdmissionSlot(self)
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        raise AdmissionRejected(499, "disconnected", "客户端已断开")
+        except BaseException:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # 已被放行但随后被取消或拒绝，归还名额
+                self._release()
+            elif not future.done():
+                future.cancel()
+            raise
@@ -0,0 +1,201 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import tempfile
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+class DiskIndex:
+    """
+    单进程的磁盘缓存索引，按访问顺序淘汰。
+    多进程模式下替换为 sharedState.SharedAudioCacheIndex，各进程共用同一份索引和容量限制。
+    """
+
+    def __init__(self):
+        # key -> 文件大小，按访问顺序排列(末尾为最近使用)
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.count = 0
+        self.bytes = 0
+
+    def _evict(self, max_entries: int, max_bytes: int) -> List[str]:
+        evicted = []
+        while self.entries and (len(self.entries) > max_entries or self.bytes > max_bytes):
+            key, size = self.entries.popitem(last=False)
+            self.bytes -= size
+            evicted.append(key)
+        self.count = len(self.entries)
+        return evicted
+
+    async def load(self, entries: List[Tuple[float, str, int]], max_entries: int, max_bytes: int) -> List[str]:
+        """ 登记启动时扫描到的文件 [(修改时间, key, 大小)]，返回需要删除的 key """
+        for _, key, size in sorted(entries):
+            if key not in self.entries:
+                self.entries[key] = size
+                self.bytes += size
+        return self._evict(max_entries, max_bytes)
+
+    async def touch(self, key: str) -> bool:
+        """ 已登记时标记为最近使用并返回 True """
+        if key not in self.entries:
+            return False
+        self.entries.move_to_end(key)
+        return True
+
+    async def add(self, key: str, size: int, max_entries: int, max_bytes: int) -> List[str]:
+        """ 登记新写入的文件，返回被淘汰需要删除的 key """
+        self.bytes -= self.entries.pop(key, 0)
+        self.entries[key] = size
+        self.bytes += size
+        return self._evict(max_entries, max_bytes)
+
+    async def remove(self, key: str):
+        self.bytes -= self.entries.pop(key, 0)
+        self.count = len(self.entries)
+
+
+class AudioCache:
+    """
+    按最终请求内容寻址的合成音频缓存，分为内存和磁盘两级，均按 LRU 淘汰。
+
+    键为插件处理后的 request_data(文本、参考音频、参考文本、采样参数等)加上模型权重的哈希，
+    只要任一参数不同就视为不同的音频。
+    """
+
+    def __init__(self, cache_dir: str, memory_max_bytes: int = 64 * 1024 * 1024, memory_max_entries: int = 256,
+                 disk_max_bytes: int = 1024 * 1024 * 1024, disk_max_entries: int = 5000, index=None):
+        self.cache_dir = cache_dir
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_max_entries = disk_max_entries
+        # 内存缓存 key -> 音频数据，按访问顺序排列(末尾为最近使用)
+        self.memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self.memory_bytes = 0
+        # 磁盘缓存索引(文件大小和访问顺序)，多进程时由各进程共享
+        self.index = index or DiskIndex()
+        self.stats: Dict[str, int] = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(request_data: dict, models: Optional[dict] = None) -> str:
+        """ 计算请求的缓存键 """
+        payload = {"request": request_data, "models": models or {}}
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _scan_disk(self) -> List[Tuple[float, str, int]]:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".bin"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        return entries
+
+    async def load_disk_index(self):
+        """ 启动时扫描缓存目录，按修改时间恢复 LRU 顺序(由调用方在启动阶段调用) """
+        if self.disk_max_entries <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        entries = await loop.run_in_executor(None, self._scan_disk)
+        evicted = await self.index.load(entries, self.disk_max_entries, self.disk_max_bytes)
+        await self._remove_files(evicted)
+        if self.index.count:
+            logging.info(f"音频缓存: 已从磁盘恢复 {self.index.count} 条记录")
+
+    def _put_memory(self, key: str, data: bytes):
+        if len(data) > self.memory_max_bytes or self.memory_max_entries <= 0:
+            return
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = data
+        self.memory_bytes += len(data)
+        while len(self.memory) > self.memory_max_entries or self.memory_bytes > self.memory_max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+            self.stats["evictions"] += 1
+
+    async def _remove_files(self, keys: List[str]):
+        if not keys:
+            return
+        self.stats["evictions"] += len(keys)
+
+        def remove():
+            for key in keys:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+
+        await asyncio.get_running_loop().run_in_executor(None, remove)
+
+    def _read_file(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_file(self, key: str, data: bytes):
+        # 先写唯一的临时文件再替换，避免读到写了一半的文件，多个进程同时写入同一 key 时也互不影响
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return self.memory[key]
+        if self.disk_max_entries > 0 and await self.index.touch(key):
+            data = await asyncio.get_running_loop().run_in_executor(None, self._read_file, key)
+            if data is not None:
+                self.stats["disk_hits"] += 1
+                self._put_memory(key, data)
+                return data
+            # 文件已被外部(或其他进程淘汰时)删除
+            await self.index.remove(key)
+        self.stats["misses"] += 1
+        return None
+
+    async def put(self, key: str, data: bytes):
+        if not data:
+            return
+        self._put_memory(key, data)
+        self.stats["stores"] += 1
+        if self.disk_max_entries <= 0 or len(data) > self.disk_max_bytes or await self.index.touch(key):
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_file, key, data)
+        except OSError as e:
+            logging.warning(f"音频缓存写入磁盘失败: {e}")
+            return
+        evicted = await self.index.add(key, len(data), self.disk_max_entries, self.disk_max_bytes)
+        await self._remove_files(evicted)
+
+    def info(self) -> dict:
+        return {
+            **self.stats,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_bytes,
+            # 多进程时为最近一次访问共享索引时的数值
+            "disk_entries": self.index.count,
+            "disk_bytes": self.index.bytes,
+        }
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Callable, Hashable, Iterable, List, Optional
+
+import httpx
+
+from scheduler import ModelScheduler
+
+
+class Backend:
+    """ 单个 GPT-SoVITS 后端实例及其状态 """
+
+    def __init__(self, url: str, max_batch: int = 8, max_wait: float = 10.0):
+        self.url = url[:-1] if url.endswith("/") else url
+        # 该后端当前加载的模型权重
+        self.loaded = {"gpt": None, "sovits": None}
+        # 正在执行和排队中的请求数
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        # 每个后端各自按模型亲和度调度
+        self.scheduler = ModelScheduler(max_batch=max_batch, max_wait=max_wait)
+        # 切换模型的锁(在事件循环内创建，兼容 Python 3.8/3.9)
+        self._switch_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def switch_lock(self) -> asyncio.Lock:
+        if self._switch_lock is None:
+            self._switch_lock = asyncio.Lock()
+        return self._switch_lock
+
+    def has_model(self, key: Hashable) -> bool:
+        """ 已加载该模型，或调度器正在/即将执行该模型的请求 """
+        if key is None:
+            return False
+        return (self.loaded["gpt"], self.loaded["sovits"]) == key or self.scheduler.current == key
+
+    def forget_model(self):
+        """ 加载状态未知时调用，不再认为该后端已加载或即将加载任何模型，下次使用时重新切换 """
+        self.loaded = {"gpt": None, "sovits": None}
+        self.scheduler.forget()
+
+    def info(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "failures": self.failures,
+            "loaded": dict(self.loaded),
+            "current": str(self.scheduler.current) if self.scheduler.current is not None else None,
+            "pending": {str(key): count for key, count in self.scheduler.pending().items()},
+        }
+
+
+class BackendPool:
+    """
+    多后端池：优先把请求路由到已加载该角色模型的后端，没有时选择未完成请求最少的后端。
+    连续失败达到阈值的后端会被摘除，健康检查恢复后重新加入(加载状态重置为未知)。
+    """
+
+    def __init__(self, urls: Iterable[str], max_batch: int = 8, max_wait: float = 10.0, max_failures: int = 3):
+        self.backends: List[Backend] = [Backend(url, max_batch, max_wait) for url in urls]
+        self.max_failures = max_failures
+        # 后端被摘除时的回调(如同步到其他工作进程)
+        self.on_eject: Optional[Callable[[Backend], None]] = None
+        if not self.backends:
+            raise ValueError("至少需要配置一个后端地址")
+
+    def configure_schedulers(self, max_batch: Optional[int] = None, max_wait: Optional[float] = None):
+        for backend in self.backends:
+            backend.scheduler.configure(max_batch=max_batch, max_wait=max_wait)
+
+    def select(self, key: Hashable = None, exclude: Iterable[Backend] = ()) -> Backend:
+        excluded = set(id(backend) for backend in exclude)
+        candidates = [backend for backend in self.backends if id(backend) not in excluded]
+        if not candidates:
+            candidates = list(self.backends)
+        healthy = [backend for backend in candidates if backend.healthy]
+        # 全部不健康时仍然尝试，避免直接拒绝请求
+        candidates = healthy or candidates
+        matched = [backend for backend in candidates if backend.has_model(key)]
+        return min(matched or candidates, key=lambda backend: backend.outstanding)
+
+    @asynccontextmanager
+    async def lease(self, key: Hashable = None, exclude: Iterable[Backend] = (), backend: Optional[Backend] = None):
+        """
+        选择后端并计入未完成请求，离开上下文时释放。
+        需要固定模型时由调用方再通过 backend.scheduler.acquire 获取模型租约。
+        :param backend: 指定使用的后端(如预热目标)，不再自动选择
+        """
+        if backend is None:
+            backend = self.select(key, exclude)
+        backend.outstanding += 1
+        try:
+            yield backend
+        finally:
+            backend.outstanding -= 1
+
+    def report_success(self, backend: Backend):
+        backend.failures = 0
+
+    def report_failure(self, backend: Backend):
+        backend.failures += 1
+        if backend.healthy and backend.failures >= self.max_failures:
+            self.eject(backend)
+
+    def eject(self, backend: Backend):
+        backend.healthy = False
+        # 后端可能已重启，加载状态未知
+        backend.forget_model()
+        logging.warning(f"后端 {backend.url} 连续失败 {backend.failures} 次，已暂时摘除")
+        if self.on_eject is not None:
+            self.on_eject(backend)
+
+    async def check_health(self, client: httpx.AsyncClient, path: str = "/", timeout: float = 5.0):
+        """ 能够建立连接并收到非 5xx 响应即视为健康 """
+        async def check(backend: Backend):
+            try:
+                resp = await client.get(f"{backend.url}{path}", timeout=timeout)
+                ok = resp.status_code < 500
+            except httpx.HTTPError:
+                ok = False
+            if ok and not backend.healthy:
+                backend.healthy = True
+                backend.failures = 0
+                logging.info(f"后端 {backend.url} 已恢复")
+            elif not ok and backend.healthy:
+                backend.failures = max(backend.failures, self.max_failures)
+                self.eject(backend)
+        await asyncio.gather(*(check(backend) for backend in self.backends))
+
+    async def run_health_checks(self, client_getter: Callable[[], httpx.AsyncClient], interval: float, path: str = "/"):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check_health(client_getter(), path)
+            except Exception as e:
+                logging.error(f"后端健康检查失败: {e}")
+
+    def info(self) -> List[dict]:
+        return [backend.info() for backend in self.backends]
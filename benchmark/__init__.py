@@ -0,0 +1,5 @@
+"""
+性能基准与压力测试：使用模拟的 GPT-SoVITS 后端和硅基流动翻译接口，
+按 SillyTavern 的典型流量测试适配器的转发路径。
+在项目根目录运行: python -m benchmark.loadTest -o results.json
+"""
@@ -0,0 +1,391 @@
+"""
+适配器压力测试：启动模拟后端、模拟翻译接口和适配器，按 SillyTavern 的典型流量发送请求，
+统计首字节时间(TTFB)和首个音频数据时间的分位数、吞吐量、每个请求的适配器 CPU 时间和权重切换次数，结果写入 JSON。
+
+在项目根目录运行:
+    python -m benchmark.loadTest -o results.json
+    python -m benchmark.loadTest -o new.json --compare results.json --max-regression 0.2
+    python -m benchmark.loadTest --set SCHEDULER_ENABLED=false --scenario group
+    python -m benchmark.loadTest --scenario failover --backends 3
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import struct
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+import httpx
+
+from wavUtils import find_wav_data_offset
+from .mockServers import MockBackendSettings, ServerThread, create_translator_app, start_backends
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHARACTERS = ["anno", "bob", "carol", "dave"]
+
+LINES = [
+    "今天的天气真好呢，要不要一起出去走走？",
+    "你又来了啊，这次想聊些什么？",
+    "嗯，我明白了，那就按你说的做吧。",
+    "等一下！你刚才说的是真的吗？",
+    "其实我一直都想对你说一句谢谢。",
+    "这件事情说来话长，我们坐下慢慢聊。",
+    "好啦好啦，别生气了，是我不对。",
+    "明天早上八点，在车站门口见面。",
+]
+
+# 场景: 请求数、并发数、角色、是否流式、是否重新生成(先取消再重发)、
+# 后端数量(未指定时使用 --backends)、完成多少个请求后停掉第一个后端(故障注入)
+SCENARIOS = {
+    # 单角色对话
+    "single": {"requests": 40, "concurrency": 2, "characters": CHARACTERS[:1], "streaming": True},
+    # 多角色群聊，角色轮流发言
+    "group": {"requests": 40, "concurrency": 4, "characters": CHARACTERS, "streaming": True},
+    # 群聊的非流式请求(可以测试微批处理)
+    "group_file": {"requests": 40, "concurrency": 8, "characters": CHARACTERS[:2], "streaming": False},
+    # 重新生成：收到首个数据块后断开，立即以相同文本重发
+    "reroll": {"requests": 20, "concurrency": 2, "characters": CHARACTERS[:2], "streaming": True, "reroll": True},
+    # 故障转移：运行中停掉一个后端，请求应转到其他后端且全部成功，停掉的后端被摘除并不再被视为已加载模型
+    "failover": {"requests": 40, "concurrency": 4, "characters": CHARACTERS[:2], "streaming": True, "backends": 2, "kill_backend_after": 10},
+}
+
+# 比较结果时越小越好的指标
+LOWER_IS_BETTER = ["ttfb_ms.p50", "ttfb_ms.p95", "ttfb_ms.p99", "ttfa_ms.p50", "ttfa_ms.p95", "ttfa_ms.p99", "total_ms.p95", "cpu_ms_per_request", "weight_switches"]
+HIGHER_IS_BETTER = ["throughput_rps"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """ 线性插值的分位数 """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def summarize(values: List[float]) -> dict:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values) if values else None,
+    }
+
+
+def prepare_workdir(workdir: str) -> dict:
+    """ 生成参考音频和角色模型配置 """
+    voice_dir = os.path.join(workdir, "voice")
+    os.makedirs(voice_dir, exist_ok=True)
+    pcm = b"\x00\x00" * 32000 * 3
+    header = (
+        b"RIFF" + struct.pack("<I", 36 + len(pcm)) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, 32000, 64000, 2, 16)
+        + b"data" + struct.pack("<I", len(pcm))
+    )
+    models = {}
+    for name in CHARACTERS:
+        with open(os.path.join(voice_dir, f"{name}.wav"), "wb") as f:
+            f.write(header + pcm)
+        with open(os.path.join(voice_dir, f"{name}.txt"), "w", encoding="utf-8") as f:
+            f.write(f"我是{name}，很高兴认识你。")
+        models[name] = {"gpt": f"/models/{name}.ckpt", "sovits": f"/models/{name}.pth", "prompt_lang": "zh"}
+    return models
+
+
+def build_requests(scenario: dict, rng: random.Random) -> List[dict]:
+    characters = scenario["characters"]
+    requests = []
+    for index in range(scenario["requests"]):
+        requests.append({
+            "text": rng.choice(LINES),
+            "text_lang": "zh",
+            # SillyTavern 传来的参考音频路径
+            "ref_audio_path": f"voice/{characters[index % len(characters)]}.wav",
+            "streaming_mode": scenario["streaming"],
+        })
+    return requests
+
+
+async def send(client: httpx.AsyncClient, url: str, body: dict, abort_after_first_chunk: bool = False) -> dict:
+    """ 发送一个请求，记录首字节时间和首个音频数据(WAV 文件头之后)的时间 """
+    start = time.perf_counter()
+    ttfb = None
+    ttfa = None
+    head = b""
+    size = 0
+    try:
+        async with client.stream("POST", url, json=body) as resp:
+            async for chunk in resp.aiter_raw():
+                now = time.perf_counter() - start
+                if ttfb is None:
+                    ttfb = now
+                size += len(chunk)
+                if ttfa is None:
+                    head += chunk
+                    offset = find_wav_data_offset(head)
+                    if offset is not None and (offset == -1 or len(head) > offset):
+                        ttfa = now
+                if ttfa is not None and abort_after_first_chunk:
+                    break
+            status = resp.status_code
+    except httpx.HTTPError as e:
+        return {"ok": False, "error": str(e)}
+    return {"ok": status == 200, "status": status, "ttfb": ttfb, "ttfa": ttfa, "total": time.perf_counter() - start, "bytes": size}
+
+
+async def collect_backend_stats(client: httpx.AsyncClient, backends: List[ServerThread]) -> dict:
+    """ 汇总运行中的模拟后端的统计 """
+    total = {}
+    for backend in backends:
+        if not backend.running:
+            continue
+        stats = (await client.get(f"{backend.url}/__stats")).json()
+        for name, value in stats.items():
+            total[name] = max(total.get(name, 0), value) if name == "max_active" else total.get(name, 0) + value
+    return total
+
+
+async def check_failover(client: httpx.AsyncClient, adapter_url: str, killed: List[ServerThread], errors: int) -> Dict[str, bool]:
+    """ 停掉的后端应被摘除且加载状态被清除，客户端请求不应失败 """
+    states = {state["url"]: state for state in (await client.get(f"{adapter_url}/backends")).json()}
+    killed_states = [states[backend.url] for backend in killed]
+    return {
+        "no_errors": errors == 0,
+        "ejected": all(not state["healthy"] for state in killed_states),
+        "model_state_cleared": all(
+            state["current"] is None and not any(state["loaded"].values()) for state in killed_states
+        ),
+    }
+
+
+async def run_scenario(adapter_url: str, backends: List[ServerThread], name: str, scenario: dict, seed: int) -> dict:
+    requests = build_requests(scenario, random.Random(seed))
+    semaphore = asyncio.Semaphore(scenario["concurrency"])
+    limits = httpx.Limits(max_connections=scenario["concurrency"] * 2)
+    kill_after = scenario.get("kill_backend_after")
+    killed = []
+    completed = 0
+    async with httpx.AsyncClient(timeout=120, limits=limits, trust_env=False) as client:
+        for backend in backends:
+            await client.post(f"{backend.url}/__reset")
+        cpu_start = (await client.get(f"{adapter_url}/__bench/cpu")).json()["cpu"]
+
+        async def worker(body: dict) -> dict:
+            nonlocal completed
+            async with semaphore:
+                if scenario.get("reroll"):
+                    await send(client, f"{adapter_url}/tts", body, abort_after_first_chunk=True)
+                result = await send(client, f"{adapter_url}/tts", body)
+            completed += 1
+            if completed == kill_after:
+                # 停止接受新连接，进行中的请求正常结束
+                killed.append(backends[0])
+                await asyncio.get_running_loop().run_in_executor(None, backends[0].stop)
+            return result
+
+        wall_start = time.perf_counter()
+        results = await asyncio.gather(*(worker(body) for body in requests))
+        wall = time.perf_counter() - wall_start
+
+        cpu_end = (await client.get(f"{adapter_url}/__bench/cpu")).json()["cpu"]
+        backend_stats = await collect_backend_stats(client, backends)
+        ok = [result for result in results if result["ok"]]
+        checks = await check_failover(client, adapter_url, killed, len(results) - len(ok)) if kill_after else {}
+
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "ttfb_ms": summarize([result["ttfb"] * 1000 for result in ok if result["ttfb"] is not None]),
+        "ttfa_ms": summarize([result["ttfa"] * 1000 for result in ok if result["ttfa"] is not None]),
+        "total_ms": summarize([result["total"] * 1000 for result in ok]),
+        "wall_seconds": wall,
+        "throughput_rps": len(ok) / wall if wall > 0 else None,
+        "audio_bytes_per_second": sum(result["bytes"] for result in ok) / wall if wall > 0 else None,
+        "cpu_ms_per_request": (cpu_end - cpu_start) * 1000 / len(results) if results else None,
+        "weight_switches": backend_stats["gpt_switches"] + backend_stats["sovits_switches"],
+        "switches_during_synthesis": backend_stats["switches_during_synthesis"],
+        # 停掉的后端不再计入
+        "backend_requests": backend_stats["tts_requests"],
+        "backend_max_concurrency": backend_stats["max_active"],
+        "checks": checks,
+    }
+
+
+def start_adapter(port: int, backend_urls: List[str], translator_url: str, workdir: str, models: dict, overrides: List[str]):
+    command = [
+        sys.executable, "-m", "benchmark.serveAdapter",
+        "--port", str(port),
+        "--translator", translator_url,
+        "--workdir", workdir,
+        "--models", json.dumps(models),
+    ]
+    for url in backend_urls:
+        command += ["--backend", url]
+    for item in overrides:
+        command += ["--set", item]
+    log = open(os.path.join(workdir, "adapter.log"), "wb")
+    process = subprocess.Popen(command, cwd=REPO_DIR, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"适配器启动失败，日志见 {log.name}")
+        try:
+            if httpx.get(f"{url}/__bench/cpu", timeout=1, trust_env=False).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("等待适配器启动超时")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def lookup(result: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(result, dict) or part not in result:
+            return None
+        result = result[part]
+    return result
+
+
+def compare(current: dict, baseline: dict, max_regression: Optional[float]) -> bool:
+    """ 打印与基准结果的对比，超过允许的退化比例时返回 False """
+    passed = True
+    print(f"\n与基准结果对比 (基准: {baseline.get('git_commit')}, 当前: {current.get('git_commit')})")
+    for name, result in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        print(f"[{name}]")
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            new, old = lookup(result, metric), lookup(base, metric)
+            if new is None or old is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            regression = change if metric in LOWER_IS_BETTER else -change
+            flag = ""
+            if max_regression is not None and regression > max_regression:
+                flag = "  <-- 退化"
+                passed = False
+            print(f"  {metric:<22} {old:>10.2f} -> {new:>10.2f} ({change:+.1%}){flag}")
+    return passed
+
+
+def print_summary(results: dict):
+    for name, result in results["scenarios"].items():
+        ttfb, ttfa = result["ttfb_ms"], result["ttfa_ms"]
+        print(
+            f"[{name}] 请求 {result['requests']} (失败 {result['errors']}), "
+            f"TTFB p50/p95/p99 = {ttfb['p50'] or 0:.1f}/{ttfb['p95'] or 0:.1f}/{ttfb['p99'] or 0:.1f} ms, "
+            f"首个音频 p50/p95 = {ttfa['p50'] or 0:.1f}/{ttfa['p95'] or 0:.1f} ms, "
+            f"吞吐 {result['throughput_rps'] or 0:.2f} req/s, "
+            f"CPU {result['cpu_ms_per_request'] or 0:.2f} ms/req, 权重切换 {result['weight_switches']} 次"
+        )
+        for check, passed in result.get("checks", {}).items():
+            print(f"  检查 {check}: {'通过' if passed else '失败'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPT-SoVITS 适配器压力测试")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="结果 JSON 文件")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="只运行指定场景，可重复")
+    parser.add_argument("--compare", help="与之前的结果 JSON 对比")
+    parser.add_argument("--max-regression", type=float, help="允许的最大退化比例(如 0.2)，超过时以非零状态码退出")
+    parser.add_argument("--translate", action="store_true", help="启用翻译插件并使用模拟的硅基流动接口")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="覆盖适配器的 config.py 配置项，值为 JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backends", type=int, default=1, help="模拟后端数量(场景自身指定的除外)")
+    parser.add_argument("--ttfb", type=float, default=MockBackendSettings.ttfb)
+    parser.add_argument("--realtime-factor", type=float, default=MockBackendSettings.realtime_factor)
+    parser.add_argument("--switch-delay", type=float, default=MockBackendSettings.switch_delay)
+    parser.add_argument("--translate-delay", type=float, default=0.3)
+    args = parser.parse_args()
+
+    settings = MockBackendSettings(ttfb=args.ttfb, realtime_factor=args.realtime_factor, switch_delay=args.switch_delay)
+    translator = ServerThread(create_translator_app(args.translate_delay), free_port()).start() if args.translate else None
+
+    # 按后端数量分组，每组使用独立的模拟后端和适配器进程(故障注入不影响其他场景)
+    groups: Dict[int, List[str]] = {}
+    for name in args.scenario or list(SCENARIOS):
+        groups.setdefault(max(args.backends, SCENARIOS[name].get("backends", 1)), []).append(name)
+
+    scenarios = {}
+    try:
+        for backend_count, names in groups.items():
+            backends = start_backends(settings, [free_port() for _ in range(backend_count)])
+            with tempfile.TemporaryDirectory(prefix="adapter-bench-") as workdir:
+                models = prepare_workdir(workdir)
+                process, adapter_url = start_adapter(
+                    free_port(), [backend.url for backend in backends], translator.url if translator else "", workdir, models, args.set
+                )
+                try:
+                    for name in names:
+                        print(f"运行场景 {name} (后端 {backend_count} 个) ...")
+                        scenarios[name] = asyncio.run(run_scenario(adapter_url, backends, name, SCENARIOS[name], args.seed))
+                finally:
+                    process.terminate()
+                    try:
+                        process.wait(timeout=10)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                    for backend in backends:
+                        backend.stop()
+    finally:
+        if translator:
+            translator.stop()
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "backend": settings.to_dict(),
+            "translate": args.translate,
+            "translate_delay": args.translate_delay,
+            "overrides": args.set,
+            "seed": args.seed,
+            "backends": args.backends,
+            "scenarios": {name: SCENARIOS[name] for name in scenarios},
+        },
+        "scenarios": scenarios,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print_summary(results)
+    print(f"结果已写入 {args.output}")
+
+    passed = all(all(result.get("checks", {}).values()) for result in scenarios.values())
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        passed = compare(results, baseline, args.max_regression) and passed
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import json
+import time
+import struct
+import asyncio
+import threading
+from dataclasses import dataclass, asdict
+from typing import List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+
+@dataclass
+class MockBackendSettings:
+    """ 模拟 GPT-SoVITS 后端的性能参数 """
+    # 首个音频块的延迟(秒)
+    ttfb: float = 0.15
+    # 合成速度，每秒墙钟时间生成的音频秒数
+    realtime_factor: float = 10.0
+    # set_gpt_weights / set_sovits_weights 的耗时(秒)
+    switch_delay: float = 0.5
+    # 每个字符对应的音频时长(秒)
+    seconds_per_char: float = 0.15
+    # 流式输出每块的音频时长(毫秒)
+    chunk_ms: int = 100
+    sample_rate: int = 32000
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def wav_header(sample_rate: int, data_size: int = 0xFFFFFFFF) -> bytes:
+    riff_size = 0xFFFFFFFF if data_size == 0xFFFFFFFF else 36 + data_size
+    return (
+        b"RIFF" + struct.pack("<I", riff_size) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+        + b"data" + struct.pack("<I", data_size)
+    )
+
+
+def create_backend_app(settings: MockBackendSettings) -> FastAPI:
+    """
+    模拟的 GPT-SoVITS api_v2：流式/非流式 /tts、切换权重，
+    以及统计接口 /__stats 和 /__reset
+    """
+    app = FastAPI()
+    # switches_during_synthesis: 仍有合成在进行时收到的权重切换(多个进程争抢后端时出现)
+    stats = {"gpt_switches": 0, "sovits_switches": 0, "switches_during_synthesis": 0, "tts_requests": 0, "active": 0, "max_active": 0}
+
+    @app.get("/set_gpt_weights")
+    async def set_gpt_weights(weights_path: str):
+        if stats["active"]:
+            stats["switches_during_synthesis"] += 1
+        await asyncio.sleep(settings.switch_delay)
+        stats["gpt_switches"] += 1
+        return JSONResponse("success")
+
+    @app.get("/set_sovits_weights")
+    async def set_sovits_weights(weights_path: str):
+        if stats["active"]:
+            stats["switches_during_synthesis"] += 1
+        await asyncio.sleep(settings.switch_delay)
+        stats["sovits_switches"] += 1
+        return JSONResponse("success")
+
+    @app.post("/tts")
+    async def tts(request: Request):
+        data = await request.json()
+        stats["tts_requests"] += 1
+        # 每一行对应一个片段，片段后追加 fragment_interval 的静音(与 GPT-SoVITS 一致)
+        lines = [line for line in data.get("text", "").split("\n") if line.strip()] or [""]
+        silence = bytes(int(settings.sample_rate * data.get("fragment_interval", 0.3)) * 2)
+        bytes_per_second = settings.sample_rate * 2
+
+        def fragment(index: int, line: str) -> bytes:
+            samples = int(max(1, len(line)) * settings.seconds_per_char * settings.sample_rate)
+            return struct.pack("<h", 1000 + index) * samples + silence
+
+        stats["active"] += 1
+        stats["max_active"] = max(stats["max_active"], stats["active"])
+        if not data.get("streaming_mode"):
+            try:
+                pcm = b"".join(fragment(index, line) for index, line in enumerate(lines))
+                await asyncio.sleep(settings.ttfb + len(pcm) / bytes_per_second / settings.realtime_factor)
+                return Response(wav_header(settings.sample_rate, len(pcm)) + pcm, media_type="audio/wav")
+            finally:
+                stats["active"] -= 1
+
+        async def stream():
+            try:
+                yield wav_header(settings.sample_rate)
+                await asyncio.sleep(settings.ttfb)
+                chunk_size = bytes_per_second * settings.chunk_ms // 1000
+                for index, line in enumerate(lines):
+                    pcm = fragment(index, line)
+                    for start in range(0, len(pcm), chunk_size):
+                        chunk = pcm[start:start + chunk_size]
+                        yield chunk
+                        await asyncio.sleep(len(chunk) / bytes_per_second / settings.realtime_factor)
+            finally:
+                stats["active"] -= 1
+
+        return StreamingResponse(stream(), media_type="audio/wav")
+
+    @app.get("/__stats")
+    async def get_stats():
+        return JSONResponse(stats)
+
+    @app.post("/__reset")
+    async def reset_stats():
+        for name in stats:
+            if name != "active":
+                stats[name] = 0
+        return JSONResponse(stats)
+
+    return app
+
+
+def create_translator_app(delay: float = 0.3) -> FastAPI:
+    """ 模拟的硅基流动 chat/completions 接口，返回带标记的原文 """
+    app = FastAPI()
+    stats = {"requests": 0}
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        data = await request.json()
+        stats["requests"] += 1
+        await asyncio.sleep(delay)
+        text = data["messages"][-1]["content"]
+        if data.get("response_format", {}).get("type") == "json_object":
+            # 批量翻译
+            lines = json.loads(text)["lines"]
+            stats["batched_lines"] = stats.get("batched_lines", 0) + len(lines)
+            text = json.dumps({"translations": [f"{line}。" for line in lines]}, ensure_ascii=False)
+            return JSONResponse({"choices": [{"message": {"role": "assistant", "content": text}}]})
+        return JSONResponse({"choices": [{"message": {"role": "assistant", "content": f"{text}。"}}]})
+
+    @app.get("/__stats")
+    async def get_stats():
+        return JSONResponse(stats)
+
+    return app
+
+
+class ServerThread:
+    """ 在后台线程中运行 uvicorn，可以停止后在同一端口重新启动(模拟后端崩溃和恢复) """
+
+    def __init__(self, app: FastAPI, port: int, host: str = "127.0.0.1"):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.url = f"http://{host}:{port}"
+        self.server = None
+        self.thread = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, timeout: float = 10.0):
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host=self.host, port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError(f"模拟服务 {self.url} 启动失败")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        """ 停止接受新连接，等待进行中的请求结束 """
+        if self.server is not None:
+            self.server.should_exit = True
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+
+def start_backends(settings: MockBackendSettings, ports: List[int]) -> List[ServerThread]:
+    """ 启动多个模拟后端，每个后端有独立的统计 """
+    return [ServerThread(create_backend_app(settings), port).start() for port in ports]
@@ -0,0 +1,56 @@
+"""
+以基准测试配置启动适配器(由 loadTest 在子进程中调用，使适配器的 CPU 时间可以单独统计)。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--backend", action="append", required=True, help="模拟 GPT-SoVITS 后端地址，可重复以启动多后端")
+    parser.add_argument("--translator", default="", help="模拟硅基流动接口地址，留空则不翻译")
+    parser.add_argument("--workdir", required=True, help="参考音频和输出文件所在的临时目录")
+    parser.add_argument("--models", required=True, help="角色模型配置(JSON)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="覆盖 config.py 中的配置项，值为 JSON")
+    args = parser.parse_args()
+
+    import config
+    config.API_V2_URL = args.backend[0]
+    config.API_V2_URLS = args.backend
+    config.REF_AUDIO_DIR_NAME = os.path.join(args.workdir, "voice")
+    config.OUTPUT_DIR_NAME = os.path.join(args.workdir, "output")
+    # 基准测试期间不监听文件变化，也不使用音频缓存和空闲预热，避免干扰结果
+    config.CONFIG_RELOAD_WATCH = False
+    config.VOICE_INDEX_WATCH = False
+    config.AUDIO_CACHE_ENABLED = False
+    config.PREWARM_IDLE_ENABLED = False
+    config.PREWARM_DEFAULT_CHARACTER = ""
+    config.SILICONFLOW_API_URL = f"{args.translator}/v1/chat/completions" if args.translator else ""
+    # 翻译插件优先读取环境变量中的 API Key
+    os.environ["SILICONFLOW_API_KEY"] = "benchmark" if args.translator else ""
+    for item in args.set:
+        name, _, value = item.partition("=")
+        setattr(config, name, json.loads(value))
+
+    sys.path.insert(0, os.getcwd())
+    import adapter
+    # 先完成启动初始化再替换角色配置，lifespan 不会再次读取 models.json
+    adapter.startup()
+    adapter.CHARACTER_MODEL_MAP = json.loads(args.models)
+    adapter.voice_index.rebuild()
+
+    @adapter.app.get("/__bench/cpu")
+    def cpu_endpoint():
+        return {"cpu": time.process_time()}
+
+    uvicorn.run(adapter.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
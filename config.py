@@ -1,20 +1,177 @@
-
 # 后端地址 用于让适配器请求后端API
 API_V2_URL = "http://127.0.0.1:9880"
+# 多后端地址列表(可选)，填写后忽略 API_V2_URL，例如同一台机器或局域网内的多个 GPT-SoVITS 进程
+# 请求会优先发往已加载该角色模型的后端，否则发往未完成请求最少的后端
+API_V2_URLS = [
+    # "http://127.0.0.1:9880",
+    # "http://192.168.1.10:9880",
+]
+# 后端连续失败多少次后暂时摘除
+BACKEND_MAX_FAILURES = 3
+# 健康检查间隔(秒)，0 表示不检查；被摘除的后端在检查通过后恢复
+BACKEND_HEALTH_CHECK_INTERVAL = 10.0
+# 健康检查请求的路径，能连接且返回非 5xx 即视为健康
+BACKEND_HEALTH_CHECK_PATH = "/docs"
 
 # 调试模式
 DEBUG_MODE = False
 
+# 工作进程数(也可以用 --workers 指定)，大于 1 时启用多进程模式，充分利用多核处理文本清理、转码等 CPU 密集的工作
+# 各进程通过本机的 SQLite 文件共享后端的模型加载状态、跨进程的模型调度、后台任务状态和指标
+# 准入控制的并发数和排队数按进程数平均分配
+WORKERS = 1
+# 共享状态文件名(位于适配器目录下)，每次启动时清空
+SHARED_STATE_FILE_NAME = "adapter_state.db"
+
+# 参考音频索引：启动时扫描参考音频目录，目录内容变化时自动刷新
+VOICE_INDEX_WATCH = True
+# 未安装 watchfiles 时的轮询间隔(秒)
+VOICE_INDEX_POLL_INTERVAL = 2.0
+
+# 参考音频预处理：启动时和参考音频变化时，把参考音频转换为单声道 16 位 WAV 并统一采样率，去除首尾静音，
+# 过短时补静音，结果按内容哈希缓存，发给后端的 ref_audio_path 指向处理后的文件
+# 去除静音后仍超过时长上限的参考音频不会被截断(会与参考文本不对应)，记录错误并使用原文件，由后端报错
+# MP3/FLAC/OGG 等格式需要安装 ffmpeg，没有 ffmpeg 时只处理 WAV(且需要 Python 3.12 及以下)
+REF_AUDIO_PREPROCESS = False
+# 处理后的采样率
+REF_AUDIO_SAMPLE_RATE = 32000
+# 后端允许的参考音频时长(秒)
+REF_AUDIO_MIN_SECONDS = 3.0
+REF_AUDIO_MAX_SECONDS = 10.0
+# ffmpeg 可执行文件路径，留空则从 PATH 中查找
+FFMPEG_PATH = ""
+
+# 配置热重载：models.json / models_local.json 或本文件修改后自动重新加载(也可以调用 POST /admin/reload)
+# 目录、后端地址、连接池和插件相关的配置修改后仍需重启
+CONFIG_RELOAD_WATCH = True
+# 检查文件变化的间隔(秒)
+CONFIG_RELOAD_POLL_INTERVAL = 2.0
+
+# 在响应中附带 Server-Timing 头，列出各处理阶段的耗时(指标统一在 /metrics 以 Prometheus 格式提供)
+METRICS_SERVER_TIMING = True
+
+# 后端连接池设置(整个适配器生命周期共用一个客户端)
+# 最大连接数 / 最大保活连接数 / 保活连接的空闲过期时间(秒)
+BACKEND_MAX_CONNECTIONS = 20
+BACKEND_MAX_KEEPALIVE_CONNECTIONS = 10
+BACKEND_KEEPALIVE_EXPIRY = 30.0
+# 是否尝试使用 HTTP/2 (需要安装 h2: pip install httpx[http2]，未安装时自动回退到 HTTP/1.1)
+BACKEND_HTTP2 = True
+# 各路由的超时设置(秒)，connect 为建立连接的超时，read 为等待数据的超时
+BACKEND_TIMEOUTS = {
+    "switch_model": {"connect": 10.0, "read": 60.0},
+    "tts_stream": {"connect": 10.0, "read": 120.0},
+    "tts_file": {"connect": 10.0, "read": 300.0},
+}
+
+# 模型调度设置：按角色模型排队请求，优先执行当前已加载模型的请求，减少权重来回切换
+SCHEDULER_ENABLED = True
+# 同一模型连续执行的最大请求数，达到后若有其他角色在排队则切换
+SCHEDULER_MAX_BATCH = 8
+# 其他角色请求的最长等待时间(秒)，超过后不再插队执行当前模型的新请求
+SCHEDULER_MAX_WAIT = 10.0
+
+# 准入控制：限制同时进行合成的请求数，超出的请求排队，过载时快速返回 429/503
+# 最大同时合成的请求数，0 表示不限制
+ADMISSION_MAX_ACTIVE = 8
+# 最大排队请求数，超出时返回 429
+ADMISSION_MAX_QUEUE = 32
+# 最长排队时间(秒)，超时返回 503
+ADMISSION_MAX_WAIT = 30.0
+# 同一客户端对同一角色同一句台词的新请求到达时(如重新生成)，丢弃仍在排队的旧请求，不同客户端的请求互不影响
+ADMISSION_DROP_DUPLICATES = True
+# 拒绝请求时建议客户端重试的间隔(秒)
+ADMISSION_RETRY_AFTER = 2
+
+# 模型预热：提前加载角色模型权重，避免第一句台词等待切换模型
+# 启动时预加载的角色名，留空则不预加载
+PREWARM_DEFAULT_CHARACTER = ""
+# 后端空闲时根据使用记录预测下一个角色并提前加载(会在无请求时切换后端的模型，与其他程序共用后端时不建议开启)
+PREWARM_IDLE_ENABLED = False
+# 预测策略："recent" 最近使用的角色优先，"frequent" 使用次数最多的角色优先
+PREWARM_STRATEGY = "recent"
+# 无请求持续多少秒视为空闲
+PREWARM_IDLE_AFTER = 5.0
+# 预热时用参考音频合成一句短文本，提前填充后端的参考音频特征缓存(会额外占用一次 GPU 推理)
+PREWARM_REFERENCE_WARMUP = False
+# 各语言的预热文本，未配置的语言使用参考文本
+PREWARM_WARMUP_TEXTS = {
+    "zh": "你好。",
+    "ja": "こんにちは。",
+    "en": "Hello.",
+    "ko": "안녕하세요.",
+}
+
+# 微批处理：把同一角色、相同参数的并发非流式请求合并为一次后端批量推理，提高 GPU 利用率
+# 合并后按片段间的静音(fragment_interval)拆分音频，拆分失败时自动改为单独请求
+MICRO_BATCH_ENABLED = False
+# 等待合并的时间窗口(秒)
+MICRO_BATCH_WINDOW = 0.02
+# 每批最多合并的请求数
+MICRO_BATCH_MAX_SIZE = 8
+# 参与合并的文本最大长度，过长的文本会被后端再次切分，无法与调用方对应
+MICRO_BATCH_MAX_CHARS = 100
+
+# 流式响应整形：去除多段音频重复的 WAV 文件头，按固定时长重新切分数据块，便于客户端平稳播放
+# 每个数据块的时长(毫秒)，建议 20~100，0 表示不重新切分
+STREAM_FRAME_MS = 0
+# 多段音频(如分句流水线)拼接时，在片段之间插入请求中 fragment_interval 指定时长的静音
+STREAM_INSERT_SILENCE = False
+
+# 分句流水线：将长文本按句切分，后续句子的翻译与合成和前一句的播放并发进行，缩短首个音频的等待时间
+PIPELINE_ENABLED = False
+# 同时处理(翻译+合成)的句子数
+PIPELINE_CONCURRENCY = 2
+# 每段的最少字数，过短的句子会与后一句合并
+PIPELINE_MIN_CHARS = 12
+# 每句最多缓存的音频块数，客户端读取跟不上时暂停该句的合成，避免音频堆积在内存中
+PIPELINE_QUEUE_CHUNKS = 32
+
+# 预合成：客户端在 LLM 生成回复期间通过 POST /ingest 按消息 id 推送增量文本，适配器每完成一句就提前清理、翻译并合成，
+# 之后 /tts 收到完整消息时，与预合成文本一致的句子直接使用已合成的音频，其余句子照常合成
+SPECULATIVE_ENABLED = True
+# 同时进行预合成的句子数
+SPECULATIVE_CONCURRENCY = 2
+# 消息最后一次更新后，未被 /tts 使用的预合成结果保留的时间(秒)
+SPECULATIVE_TTL = 300
+# 最多同时保留的消息数
+SPECULATIVE_MAX_SESSIONS = 16
+
+# 合成音频缓存：相同的最终请求(文本、参考音频、模型、采样参数)直接返回之前合成的音频
+AUDIO_CACHE_ENABLED = True
+# 默认只缓存固定 seed 的请求(seed 为 -1 时每次合成结果不同)，开启后随机 seed 的请求也会被缓存
+AUDIO_CACHE_IGNORE_SEED = False
+# 内存缓存上限(字节 / 条数)
+AUDIO_CACHE_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+AUDIO_CACHE_MEMORY_MAX_ENTRIES = 256
+# 磁盘缓存上限(字节 / 条数)，条数设为 0 则不使用磁盘缓存
+AUDIO_CACHE_DISK_MAX_BYTES = 1024 * 1024 * 1024
+AUDIO_CACHE_DISK_MAX_ENTRIES = 5000
+
 # 目录设置
 # 参考音频存放目录
 REF_AUDIO_DIR_NAME = "voice"
 # srt输出音频存放目录
 OUTPUT_DIR_NAME = "output"
+# srt输出音频保留时间(秒)，超过后自动删除，0 表示不按时间清理；后台任务记录保留同样的时间
+OUTPUT_RETENTION = 3600
+# srt输出目录的总大小(字节)和文件数上限，超出时从最旧的文件开始删除，0 表示不限制(不包含音频缓存)
+OUTPUT_MAX_BYTES = 1024 * 1024 * 1024
+OUTPUT_MAX_FILES = 500
+# 检查过期输出文件的间隔(秒)
+OUTPUT_CLEANUP_INTERVAL = 300
 # 模型配置文件名
 MODELS_CONFIG_NAME = "models.json"
+# 音频缓存目录(位于 srt 输出目录下)
+AUDIO_CACHE_DIR_NAME = "cache"
+# 预处理后的参考音频目录(位于程序目录下，不在对外提供下载的 srt 输出目录中)
+REF_AUDIO_CACHE_DIR_NAME = "ref_cache"
 # 默认语言(当模型未指定语言时使用)
 GLOBAL_DEFAULT_LANG = "zh" 
 
+# 插件在首次调用其钩子时才导入(未启用的插件不会导入)；开启后服务启动完成时在后台预先导入已启用的插件，首个请求无需等待导入
+PLUGIN_PRELOAD = False
+
 # 翻译插件配置
 #SILICONFLOW_API_KEY = "your_siliconflow_api_key_here"  # 请替换为你的实际API Key
 SILICONFLOW_API_KEY = ""  # 请替换为你的实际API Key
@@ -25,9 +182,60 @@ SILICONFLOW_MODEL = "Qwen/Qwen2.5-14B-Instruct"
 
 plugins_config = {
     "clean_text":{
-        "enabled": True
+        "enabled": True,
+        # 自定义全局清理规则，不填则使用插件内置的默认规则(见 plugins/clean_text/rules.py)
+        # "rules": [{"pattern": r'\\?#[0-9a-fA-F]{6}', "replace": "", "stage": 0}],
+        # 角色专属清理规则，在全局规则的所有阶段之后执行，其中的 stage 只决定角色规则之间的先后
+        "character_rules": {
+            # "anno": [{"pattern": r'【.*?】', "replace": "", "stage": 0}],
+        }
     },
     "translate":{
-        "enabled": True
+        "enabled": True,
+        # 翻译缓存：相同文本、目标语言和模型的翻译直接复用结果
+        "cache": {
+            # 最大缓存条数
+            "max_entries": 2048,
+            # 缓存有效期(秒)，0 表示永不过期
+            "ttl": 7 * 24 * 3600,
+            # 持久化文件路径(JSONL)，留空则只缓存在内存中
+            "persist_path": "",
+        },
+        # 请求超时(秒)
+        "timeout": 20.0,
+        # 限流：每分钟最多请求数(RPM)和 token 数(TPM)，按硅基流动账户等级的额度填写，0 表示不限制
+        "rpm": 1000,
+        "tpm": 50000,
+        # 遇到 429/5xx 或网络错误时的重试次数，重试间隔按指数退避并加入随机抖动
+        "max_retries": 2,
+        "retry_base_delay": 0.5,
+        # 主模型重试后仍失败时依次尝试的备用模型/接口，未填写的字段沿用主配置
+        "fallbacks": [
+            # {"model": "Qwen/Qwen2.5-7B-Instruct"},
+            # {"url": "https://api.example.com/v1/chat/completions", "api_key": "...", "model": "..."},
+        ],
+        # 批量翻译：时间窗口内排队的多句短文本合并为一次请求(要求模型支持 JSON 输出)，结果无法拆分时自动逐句翻译
+        "batch": {
+            "enabled": False,
+            # 等待合并的时间窗口(秒)
+            "window": 0.05,
+            # 每批最多句数
+            "max_size": 8,
+            # 参与合并的单句最大长度
+            "max_chars": 80,
+        },
+    },
+    "transcode":{
+        # 将流式返回的 WAV 转码为 Opus(ogg)/MP3/AAC 或降低采样率，减少远程访问时的带宽占用
+        # 客户端通过请求的 media_type 或 ?format=ogg&sample_rate=16000 选择输出格式，编码需要安装 ffmpeg
+        # format=raw 输出不带文件头的大端序 16 位 PCM(audio/L16)，响应头中给出采样率和声道数
+        "enabled": False,
+        # ffmpeg 可执行文件路径，留空则从 PATH 中查找
+        "ffmpeg_path": "",
+        # 客户端未指定格式(请求 wav 且未指定采样率)时使用的默认格式和采样率，0 表示保持原始采样率
+        "default_format": "",
+        "default_sample_rate": 0,
+        # 各格式的码率
+        "bitrate": {"ogg": "32k", "opus": "32k", "mp3": "64k", "aac": "64k"},
     }
 }
\ No newline at end of file
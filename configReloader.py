@@ -0,0 +1,130 @@
+import os
+import json
+import asyncio
+import logging
+import importlib.util
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+
+def load_models_file(path: str) -> dict:
+    """
+    读取并校验角色模型配置文件
+    :raises ValueError: 配置格式错误
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            model_map = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{os.path.basename(path)} 不是合法的 JSON: {e}")
+    if not isinstance(model_map, dict):
+        raise ValueError(f"{os.path.basename(path)} 顶层必须是对象(角色名 -> 配置)")
+    for name, item in model_map.items():
+        if not isinstance(item, dict):
+            raise ValueError(f"角色 {name} 的配置必须是对象")
+        for field in ("gpt", "sovits", "prompt_lang"):
+            if field in item and item[field] is not None and not isinstance(item[field], str):
+                raise ValueError(f"角色 {name} 的 {field} 必须是字符串")
+    return model_map
+
+
+def load_config_file(path: str) -> dict:
+    """
+    在独立的命名空间中执行 config.py，返回其中的配置项(大写变量和 plugins_config)，
+    不会影响当前已导入的 config 模块。
+    :raises ValueError: 配置文件执行出错
+    """
+    spec = importlib.util.spec_from_file_location("_config_reload", path)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except Exception as e:
+        raise ValueError(f"{os.path.basename(path)} 执行失败: {e}")
+    return {
+        name: value for name, value in vars(module).items()
+        if name.isupper() or name == "plugins_config"
+    }
+
+
+def _type_matches(old, value) -> bool:
+    """ 新值的类型与当前值一致，浮点数配置项也接受整数 """
+    if old is None:
+        return True
+    if isinstance(old, bool) or isinstance(value, bool):
+        return isinstance(old, bool) and isinstance(value, bool)
+    if isinstance(old, float):
+        return isinstance(value, (int, float))
+    return isinstance(value, type(old))
+
+
+def validate_config(current: dict, new: dict, names: Iterable[str],
+                    minimums: Optional[Dict[str, float]] = None, choices: Optional[Dict[str, tuple]] = None):
+    """
+    按当前值的类型校验要应用的配置项，数值不能为负数(或小于 minimums 中的下限)，
+    choices 中的配置项只能取给定的值
+    :raises ValueError: 列出所有不合法的配置项
+    """
+    minimums = minimums or {}
+    choices = choices or {}
+    errors = []
+    for name in names:
+        if name not in new:
+            errors.append(f"{name} 缺失")
+            continue
+        old, value = current.get(name), new[name]
+        if not _type_matches(old, value):
+            errors.append(f"{name} 应为 {type(old).__name__}，实际为 {type(value).__name__}")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and value < minimums.get(name, 0):
+            errors.append(f"{name} 不能小于 {minimums.get(name, 0)}")
+        elif name in choices and value not in choices[name]:
+            errors.append(f"{name} 只能是 {', '.join(map(str, choices[name]))}")
+    if errors:
+        raise ValueError(f"配置校验失败: {'; '.join(errors)}")
+
+
+def diff_models(old: dict, new: dict) -> dict:
+    return {
+        "added": sorted(set(new) - set(old)),
+        "removed": sorted(set(old) - set(new)),
+        "changed": sorted(name for name in set(old) & set(new) if old[name] != new[name]),
+    }
+
+
+def _mask(name: str, value):
+    # 不在返回结果中暴露密钥
+    if "KEY" in name and value:
+        return "***"
+    return value
+
+
+def diff_config(old: dict, new: dict) -> Dict[str, dict]:
+    changed = {}
+    for name in sorted(set(old) | set(new)):
+        if old.get(name) != new.get(name):
+            changed[name] = {"old": _mask(name, old.get(name)), "new": _mask(name, new.get(name))}
+    return changed
+
+
+def file_signature(paths: List[str]):
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+async def watch_files(paths_getter: Callable[[], List[str]], on_change: Callable[[], Awaitable], poll_interval: float = 2.0):
+    """ 轮询文件的修改时间，发生变化时调用 on_change """
+    loop = asyncio.get_running_loop()
+    signature = await loop.run_in_executor(None, file_signature, paths_getter())
+    while True:
+        await asyncio.sleep(poll_interval)
+        try:
+            current = await loop.run_in_executor(None, file_signature, paths_getter())
+            if current != signature:
+                signature = current
+                await on_change()
+        except Exception as e:
+            logging.error(f"检查配置文件变化失败: {e}")
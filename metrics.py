@@ -0,0 +1,174 @@
+import time
+import json
+import bisect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 默认直方图分桶(秒)，覆盖从微秒级的文本清理到数十秒的长文本合成
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        return {json.dumps(key, ensure_ascii=False): value for key, value in self.values.items()}
+
+    def merged(self, snapshots: Sequence[dict]) -> Dict[Tuple[str, ...], float]:
+        """ 本进程的值加上其他进程快照中的值 """
+        values = dict(self.values)
+        for snapshot in snapshots:
+            for raw_key, value in snapshot.get(self.name, {}).items():
+                key = tuple(json.loads(raw_key))
+                values[key] = values.get(key, 0) + value
+        return values
+
+    def render(self, snapshots: Sequence[dict] = ()) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.merged(snapshots).items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [各分桶计数(非累计), 总和, 总数]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def snapshot(self) -> dict:
+        return {json.dumps(key, ensure_ascii=False): state for key, state in self.values.items()}
+
+    def merged(self, snapshots: Sequence[dict]) -> Dict[Tuple[str, ...], list]:
+        """ 本进程的值加上其他进程快照中的值(分桶相同才能合并) """
+        values = {key: [list(counts), total, count] for key, (counts, total, count) in self.values.items()}
+        for snapshot in snapshots:
+            for raw_key, (counts, total, count) in snapshot.get(self.name, {}).items():
+                key = tuple(json.loads(raw_key))
+                state = values.get(key)
+                if state is None:
+                    values[key] = [list(counts), total, count]
+                elif len(state[0]) == len(counts):
+                    state[0] = [a + b for a, b in zip(state[0], counts)]
+                    state[1] += total
+                    state[2] += count
+        return values
+
+    def render(self, snapshots: Sequence[dict] = ()) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.merged(snapshots).items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """ 轻量的指标注册表，以 Prometheus 文本格式输出，不依赖 prometheus_client """
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> dict:
+        """ 所有指标的当前值，可以 JSON 序列化，用于多进程汇总 """
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def render(self, snapshots: Sequence[dict] = ()) -> str:
+        """ :param snapshots: 其他工作进程的 snapshot()，与本进程的值相加后输出 """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(snapshots))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram("adapter_stage_seconds", "各处理阶段耗时(秒)", ["stage"])
+PLUGIN_SECONDS = registry.histogram("adapter_plugin_seconds", "插件钩子中单个插件的耗时(秒)", ["hook", "plugin"])
+REQUESTS = registry.counter("adapter_requests_total", "收到的合成请求数", ["endpoint"])
+AUDIO_CACHE_REQUESTS = registry.counter("adapter_audio_cache_requests_total", "音频缓存查询次数", ["result"])
+WEIGHT_SWITCHES = registry.counter("adapter_weight_switches_total", "后端权重切换次数", ["kind", "result"])
+BACKEND_ERRORS = registry.counter("adapter_backend_errors_total", "后端错误次数", ["kind"])
+ADMISSION_REJECTIONS = registry.counter("adapter_admission_rejections_total", "未被接纳的请求数", ["reason"])
+MICRO_BATCHED_REQUESTS = registry.counter("adapter_micro_batched_requests_total", "通过合并批量推理完成的请求数")
+BYTES_STREAMED = registry.counter("adapter_bytes_streamed_total", "返回给客户端的音频字节数", ["endpoint"])
+
+# 当前请求的各阶段耗时，用于生成 Server-Timing 响应头
+current_timings: "ContextVar[Optional[Dict[str, float]]]" = ContextVar("current_timings", default=None)
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = current_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage: str):
+    """ 记录代码块耗时到 adapter_stage_seconds 以及当前请求的 Server-Timing """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def observe_plugin(hook_name: str, plugin_name: str, seconds: float):
+    PLUGIN_SECONDS.observe(seconds, hook=hook_name, plugin=plugin_name)
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
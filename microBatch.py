@@ -0,0 +1,179 @@
+import json
+import struct
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from wavUtils import find_wav_data_offset, parse_wav_format
+
+# 合并后的请求只按换行切分，每个调用方的文本对应一个片段
+MERGED_SPLIT_METHOD = "cut0"
+# GPT-SoVITS 会把少于 5 个字符的片段与相邻片段合并，这类文本不参与合并
+MIN_CHARS = 5
+# 片段间静音过短时无法可靠地区分片段边界
+MIN_FRAGMENT_INTERVAL = 0.05
+
+
+def build_wav(header_format: dict, pcm: bytes) -> bytes:
+    """ 生成带正确长度的 PCM WAV 文件 """
+    channels, sample_rate, bits = header_format["channels"], header_format["sample_rate"], header_format["bits"]
+    block_align = channels * bits // 8
+    return (
+        b"RIFF" + struct.pack("<I", 36 + len(pcm)) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits)
+        + b"data" + struct.pack("<I", len(pcm)) + pcm
+    )
+
+
+def split_by_silence(pcm: bytes, count: int, silence_bytes: int, block_align: int) -> Optional[List[bytes]]:
+    """
+    按 GPT-SoVITS 在每个片段后追加的静音(全零采样)把音频拆分为 count 段，
+    每段保留其后的静音；找到的段数不符时返回 None
+    """
+    # 容许静音略短于预期(如后端按不同采样率计算静音长度)
+    min_bytes = max(block_align, int(silence_bytes * 0.9) // block_align * block_align)
+    zeros = bytes(min_bytes)
+    silence_sample = bytes(block_align)
+    segments = []
+    pos = 0
+    search = 0
+    while len(segments) < count:
+        index = pcm.find(zeros, search)
+        if index == -1:
+            return None
+        if index % block_align:
+            # 没有对齐到采样边界，从下一个采样开始检查
+            aligned = index + block_align - index % block_align
+            if pcm[aligned:aligned + min_bytes] != zeros:
+                search = index + 1
+                continue
+            index = aligned
+        end = index + min_bytes
+        while end - index < silence_bytes and pcm[end:end + block_align] == silence_sample:
+            end += block_align
+        segments.append(pcm[pos:end])
+        pos = search = end
+    # 剩余部分只能是静音
+    if pcm[pos:].strip(b"\x00"):
+        return None
+    return segments
+
+
+class MicroBatcher:
+    """
+    微批处理：在很短的时间窗口内收集同一角色、相同推理参数的并发非流式请求，
+    合并为一次多句的后端批量推理，再按片段间的静音把音频拆分给各个调用方。
+    无法合并或拆分失败时返回 None，由调用方单独请求。
+    """
+
+    def __init__(self, execute: Callable[[str, dict], Awaitable[bytes]], enabled: bool = False,
+                 window: float = 0.02, max_size: int = 8, max_chars: int = 100):
+        # execute(character_name, request_data) -> 后端返回的完整 WAV
+        self.execute = execute
+        self.enabled = enabled
+        self.window = window
+        self.max_size = max_size
+        self.max_chars = max_chars
+        # 合并键 -> 等待中的 [(request_data, future)]
+        self.groups: Dict[tuple, list] = {}
+        self.stats = {"merged_batches": 0, "merged_requests": 0, "fallbacks": 0}
+
+    def configure(self, enabled: Optional[bool] = None, window: Optional[float] = None,
+                  max_size: Optional[int] = None, max_chars: Optional[int] = None):
+        if enabled is not None:
+            self.enabled = enabled
+        if window is not None:
+            self.window = window
+        if max_size is not None:
+            self.max_size = max_size
+        if max_chars is not None:
+            self.max_chars = max_chars
+
+    def batch_key(self, character_name: str, request_data: dict) -> Optional[tuple]:
+        """ 可合并的请求返回合并键，否则返回 None """
+        text = (request_data.get("text") or "").strip()
+        if (
+            request_data.get("streaming_mode")
+            or request_data.get("media_type", "wav") != "wav"
+            or request_data.get("fragment_interval", 0) < MIN_FRAGMENT_INTERVAL
+            or "\n" in text
+            or not MIN_CHARS <= len(text) <= self.max_chars
+        ):
+            return None
+        params = {name: value for name, value in request_data.items() if name != "text"}
+        return character_name, json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+
+    async def submit(self, character_name: str, request_data: dict) -> Optional[bytes]:
+        """
+        提交请求并等待合并结果
+        :return: 该请求的 WAV 音频；无法合并时返回 None
+        """
+        if not self.enabled or self.max_size < 2:
+            return None
+        key = self.batch_key(character_name, request_data)
+        if key is None:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = []
+            asyncio.get_running_loop().call_later(self.window, self._start_flush, key, group)
+        group.append((request_data, future))
+        if len(group) >= self.max_size:
+            self._start_flush(key, group)
+        return await future
+
+    def _start_flush(self, key: tuple, group: list):
+        # 定时器触发时该组可能已因达到上限提前发出
+        if self.groups.get(key) is not group:
+            return
+        del self.groups[key]
+        asyncio.ensure_future(self._flush(key[0], group))
+
+    async def _flush(self, character_name: str, group: list):
+        group = [(request_data, future) for request_data, future in group if not future.done()]
+        if len(group) < 2:
+            for _, future in group:
+                future.set_result(None)
+            return
+        results = None
+        try:
+            results = await self._run_batch(character_name, [request_data for request_data, _ in group])
+        except Exception as e:
+            logging.warning(f"[{character_name}] 合并请求失败，改为单独请求: {e}")
+        if results is None:
+            self.stats["fallbacks"] += 1
+        else:
+            self.stats["merged_batches"] += 1
+            self.stats["merged_requests"] += len(group)
+        for index, (_, future) in enumerate(group):
+            if not future.done():
+                future.set_result(results[index] if results is not None else None)
+
+    async def _run_batch(self, character_name: str, requests: List[dict]) -> Optional[List[bytes]]:
+        first = requests[0]
+        merged = dict(
+            first,
+            text="\n".join(request_data["text"].strip() for request_data in requests),
+            text_split_method=MERGED_SPLIT_METHOD,
+            batch_size=max(len(requests), first.get("batch_size", 1)),
+        )
+        logging.info(f"[{character_name}] 合并 {len(requests)} 个请求为一次批量推理")
+        data = await self.execute(character_name, merged)
+
+        offset = find_wav_data_offset(data)
+        if offset is None or offset == -1:
+            return None
+        wav_format = parse_wav_format(data[:offset])
+        if wav_format is None or wav_format["format_tag"] != 1:
+            return None
+        block_align = wav_format["channels"] * wav_format["bits"] // 8
+        silence_bytes = int(wav_format["sample_rate"] * first["fragment_interval"]) * block_align
+        segments = split_by_silence(data[offset:], len(requests), silence_bytes, block_align)
+        if segments is None:
+            logging.warning(f"[{character_name}] 无法按片段拆分合并的音频，改为单独请求")
+            return None
+        return [build_wav(wav_format, segment) for segment in segments]
+
+    def info(self) -> dict:
+        return dict(self.stats, enabled=self.enabled, window=self.window, max_size=self.max_size)
@@ -1,8 +1,16 @@
+import os
+import json
+import asyncio
+import bisect
 import inspect
+import time
 import importlib
 import pkgutil
 import logging
-from typing import Callable, Any, List, Dict, Tuple
+from typing import Callable, Any, List, Dict, Optional, Tuple
+
+# 插件清单文件名，声明插件的版本和实现的钩子
+MANIFEST_NAME = "plugin.json"
 
 
 class AsyncPluginManager:
@@ -17,46 +25,134 @@ class AsyncPluginManager:
         # 列表里存的是元组 (priority, function_name, function_object)
         # 例如: {"on_tts_request_processing": [(10, "my_plugin_func", <function object>), ... ], ...}
         self.hooks: Dict[str, List[Tuple[int, str, Callable]]] = {}
+        # 只读插件(只观察数据，不修改返回值)，可以与相邻的只读插件并发执行
+        self.read_only: Dict[str, set] = {}
+        # 预编译的调用链，注册变化时重建
+        # 每个阶段为 (是否并发, [(name, priority, func, is_async), ...])
+        self.chains: Dict[str, tuple] = {}
+        # 插件耗时回调 observer(hook_name, plugin_name, seconds)，为 None 时不计时
+        self.observer: Optional[Callable[[str, str, float], None]] = None
+        # 插件名 -> 加载状态，用于启动报告
+        self.plugins: Dict[str, dict] = {}
 
-    def register(self, hook_name: str, func: Callable, priority: int = 0):
+    def register(self, hook_name: str, func: Callable, priority: int = 0, read_only: bool = False):
         """
         注册插件
         :param priority: 优先级，数字越小越先执行。默认为 0。
+        :param read_only: 插件只读取数据、不修改数据时可设为 True，相邻的只读插件会通过 asyncio.gather 并发执行，其返回值会被忽略
         """
         if hook_name not in self.hooks:
             self.hooks[hook_name] = []
-        
-        self.hooks[hook_name].append((priority, func.__name__, func))
-        # 根据 priority (x[0]) 从小到大排序
-        self.hooks[hook_name].sort(key=lambda x: x[0])
+            self.read_only[hook_name] = set()
 
-    async def run_hook(self, hook_name: str, data: Any, **kwargs) -> Any:
+        if any(registered is func for _, _, registered in self.hooks[hook_name]):
+            logging.warning(f"插件 {func.__name__} 已注册到 {hook_name}，忽略重复注册")
+            return
+
+        # 按 priority 插入到同优先级插件之后，保持注册顺序
+        entries = self.hooks[hook_name]
+        index = bisect.bisect_right([entry[0] for entry in entries], priority)
+        entries.insert(index, (priority, func.__name__, func))
+        if read_only:
+            self.read_only[hook_name].add(func)
+        self._compile(hook_name)
+
+    def unregister(self, hook_name: str, func: Callable):
+        """ 注销插件 """
         if hook_name not in self.hooks:
+            return
+        self.hooks[hook_name] = [entry for entry in self.hooks[hook_name] if entry[2] is not func]
+        self.read_only[hook_name].discard(func)
+        self._compile(hook_name)
+
+    def _compile(self, hook_name: str):
+        """ 预先判断同步/异步并把相邻的只读插件分为一组，运行时不再重复判断 """
+        stages = []
+        for priority, name, func in self.hooks[hook_name]:
+            item = (name, priority, func, inspect.iscoroutinefunction(func))
+            concurrent = func in self.read_only[hook_name]
+            if concurrent and stages and stages[-1][0]:
+                stages[-1][1].append(item)
+            else:
+                stages.append((concurrent, [item]))
+        self.chains[hook_name] = tuple((concurrent, tuple(items)) for concurrent, items in stages)
+
+    def has_hook(self, hook_name: str) -> bool:
+        """ 是否有插件注册到该钩子 """
+        return bool(self.chains.get(hook_name))
+
+    async def _run_read_only(self, items, data: Any, **kwargs):
+        """ 并发执行一组只读插件，忽略返回值 """
+        awaitables = []
+        names = []
+        for name, priority, func, is_async in items:
+            try:
+                if is_async:
+                    awaitables.append(func(data, **kwargs))
+                    names.append(name)
+                else:
+                    func(data, **kwargs)
+            except Exception as e:
+                logging.error(f"插件 {name} 执行出错: {e}")
+        results = await asyncio.gather(*awaitables, return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logging.error(f"插件 {name} 执行出错: {result}")
+
+    async def run_hook(self, hook_name: str, data: Any, **kwargs) -> Any:
+        chain = self.chains.get(hook_name)
+        if not chain:
             return data
 
         current_data = data
-        
-        # 遍历时解包，我们只需要 func
-        for priority, name, func in self.hooks[hook_name]:
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        observer = self.observer
+
+        for concurrent, items in chain:
+            start = time.perf_counter() if observer else 0.0
+            if concurrent:
+                await self._run_read_only(items, current_data, **kwargs)
+                if observer:
+                    observer(hook_name, "+".join(item[0] for item in items), time.perf_counter() - start)
+                continue
+            name, priority, func, is_async = items[0]
             try:
-                logging.debug(f"执行插件: {name} (优先级 {priority})")
-                if inspect.iscoroutinefunction(func):
+                if debug:
+                    logging.debug(f"执行插件: {name} (优先级 {priority})")
+                if is_async:
                     current_data = await func(current_data, **kwargs)
                 else:
                     current_data = func(current_data, **kwargs)
             except Exception as e:
                 logging.error(f"插件 {name} 执行出错: {e}")
+            if observer:
+                observer(hook_name, name, time.perf_counter() - start)
         
         return current_data
 
     # 扫描 plugins 文件夹下的所有子文件夹，尝试加载它们
-    def load_plugins_from_dir(self, plugin_dir: str = "plugins"):
+    def load_plugins_from_dir(self, plugin_dir: str = "plugins", config: Optional[dict] = None):
+        """
+        带有 plugin.json 清单的插件只读取清单：未启用的插件不会被导入，
+        启用的插件按清单注册钩子，在首次调用其实现的钩子时才导入模块。
+        没有清单的插件按旧方式立即导入并调用 init_plugin(manager)。
+        :param config: 插件配置(plugins_config)，决定带清单的插件是否启用
+        """
+        config = config or {}
 
         # 遍历plugins下的所有插件
         for _, name, is_pkg in pkgutil.iter_modules([plugin_dir]):
             if is_pkg:
                 full_module_name = f"{plugin_dir}.{name}"
+                manifest_path = os.path.join(plugin_dir, name, MANIFEST_NAME)
+                if os.path.exists(manifest_path):
+                    try:
+                        self._register_manifest(name, full_module_name, manifest_path, config.get(name, {}))
+                    except Exception as e:
+                        logging.error(f"读取插件 {name} 的清单失败: {e}")
+                    continue
                 try:
+                    start = time.perf_counter()
                     # 动态导入模块
                     module = importlib.import_module(full_module_name)
                     
@@ -64,11 +160,128 @@ class AsyncPluginManager:
                     if hasattr(module, "init_plugin"):
                         logging.info(f"加载插件 {name}")
                         module.init_plugin(self)
+                        self.plugins[name] = {
+                            "version": getattr(module, "__version__", ""), "enabled": True, "lazy": False,
+                            "module_name": full_module_name, "module": module, "hooks": [],
+                            "load_seconds": time.perf_counter() - start, "error": None, "loading": None,
+                        }
                     else:
                         logging.info(f"跳过 {name}: 未找到 init_plugin 函数")
                         
                 except Exception as e:
                     logging.error(f"加载插件 {name} 失败: {e}")
 
+    def _register_manifest(self, name: str, module_name: str, manifest_path: str, plugin_config: dict):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        hooks = manifest.get("hooks", [])
+        enabled = bool(plugin_config.get("enabled", False))
+        self.plugins[name] = {
+            "version": manifest.get("version", ""), "enabled": enabled, "lazy": True,
+            "module_name": module_name, "module": None, "hooks": sorted({hook["hook"] for hook in hooks}),
+            "load_seconds": None, "error": None,
+            # 正在进行的导入任务，并发的首次调用等待同一个任务
+            "loading": None,
+        }
+        if not enabled:
+            logging.info(f"跳过 {name}: 插件未启用")
+            return
+        for hook in hooks:
+            priority = hook.get("priority", 0)
+            if isinstance(priority, str):
+                # 可以填写优先级常量名，如 "HIGH_PRIORITY"
+                priority = getattr(self, priority)
+            handler = self._lazy_handler(name, hook["hook"], hook["handler"], hook.get("skip_if_unloaded", False))
+            self.register(hook["hook"], handler, priority=priority, read_only=hook.get("read_only", False))
+        logging.info(f"注册插件 {name} (首次调用时加载): {', '.join(self.plugins[name]['hooks'])}")
+
+    def _import_plugin(self, name: str):
+        """ 导入插件模块，在线程池中执行，避免阻塞事件循环 """
+        plugin = self.plugins[name]
+        if plugin["module"] is None:
+            start = time.perf_counter()
+            module = importlib.import_module(plugin["module_name"])
+            plugin["load_seconds"] = time.perf_counter() - start
+            plugin["module"] = module
+            logging.info(f"加载插件 {name} ({plugin['load_seconds'] * 1000:.0f} ms)")
+        return plugin["module"]
+
+    async def _load(self, name: str) -> bool:
+        """ 按需导入插件，失败时记录错误并返回 False，之后不再重试 """
+        plugin = self.plugins[name]
+        if plugin["module"] is None and plugin["error"] is None:
+            if plugin["loading"] is None:
+                plugin["loading"] = asyncio.ensure_future(self._import_in_executor(name))
+            # 某个调用方被取消时不影响其他等待同一导入的调用方
+            await asyncio.shield(plugin["loading"])
+        return plugin["module"] is not None
+
+    async def _import_in_executor(self, name: str):
+        plugin = self.plugins[name]
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._import_plugin, name)
+        except Exception as e:
+            plugin["error"] = str(e)
+            logging.error(f"加载插件 {name} 失败: {e}")
+        finally:
+            plugin["loading"] = None
+
+    def _lazy_handler(self, name: str, hook_name: str, attr: str, skip_if_unloaded: bool) -> Callable:
+        """
+        钩子的占位函数：首次调用时导入插件，把自身替换为插件中的实际函数后执行。
+        skip_if_unloaded 的钩子(如释放资源)在插件未加载时直接跳过，不会为此导入插件。
+        """
+        async def handler(data: Any, **kwargs):
+            plugin = self.plugins[name]
+            if plugin["module"] is None and skip_if_unloaded:
+                return data
+            func = getattr(plugin["module"], attr, None) if await self._load(name) else None
+            if func is None:
+                if plugin["error"] is None:
+                    plugin["error"] = f"未找到钩子函数 {attr}"
+                    logging.error(f"插件 {name} 中未找到钩子函数 {attr}")
+                self.unregister(hook_name, handler)
+                return data
+            self._replace(hook_name, handler, func)
+            result = func(data, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+
+        handler.__name__ = attr
+        return handler
+
+    def _replace(self, hook_name: str, old: Callable, new: Callable):
+        """ 用实际函数替换占位函数，保持原有的优先级和位置 """
+        entries = self.hooks.get(hook_name, [])
+        for index, (priority, _, registered) in enumerate(entries):
+            if registered is old:
+                entries[index] = (priority, new.__name__, new)
+                if old in self.read_only[hook_name]:
+                    self.read_only[hook_name].discard(old)
+                    self.read_only[hook_name].add(new)
+                self._compile(hook_name)
+                return
+
+    async def load_all(self):
+        """ 导入所有已启用但尚未加载的插件(如启动完成后在后台预加载) """
+        for name, plugin in self.plugins.items():
+            if plugin["enabled"]:
+                await self._load(name)
+
+    def info(self) -> Dict[str, dict]:
+        return {
+            name: {
+                "version": plugin["version"],
+                "enabled": plugin["enabled"],
+                "lazy": plugin["lazy"],
+                "loaded": plugin["module"] is not None,
+                "load_ms": round(plugin["load_seconds"] * 1000, 1) if plugin["load_seconds"] is not None else None,
+                "hooks": plugin["hooks"],
+                "error": plugin["error"],
+            }
+            for name, plugin in self.plugins.items()
+        }
+
 
 plugin_manager = AsyncPluginManager()
\ No newline at end of file
@@ -1,14 +1,26 @@
-import re
+from .rules import DEFAULT_RULES, build_engine
+
+# 允许 config 缺省；若未定义则使用默认规则
+try:
+    from config import plugins_config
+    CLEAN_CONFIG = plugins_config.get("clean_text", {})
+except ImportError:
+    CLEAN_CONFIG = {}
 
 # 由于ST和卡面的内容可能存在一些兼容性问题，无法识别哪些是对话，哪些是模型的参数或者单纯的加引号
-# 所以这里需要对其进行过滤，针对不同的卡面可能需要不同的处理
+# 所以这里需要对其进行过滤，针对不同的卡面可能需要不同的处理(可以在 config 中为角色单独追加规则)
 # 你要不会写这些正则，也可以使用下边的ai，但是需要联网和配置，并且得到的结果好坏需要看具体的模型。（先咕着）
+GLOBAL_RULES = CLEAN_CONFIG.get("rules") or DEFAULT_RULES
+# 规则只在加载时编译一次，配置有误时回退到默认规则
+default_engine = build_engine(GLOBAL_RULES) or build_engine(DEFAULT_RULES)
+# 角色专属规则在全局规则的所有阶段之后执行
+character_engines = {
+    name: build_engine(GLOBAL_RULES, rules) or default_engine
+    for name, rules in CLEAN_CONFIG.get("character_rules", {}).items()
+}
+
 def clean_st_garbage_text(text: str, **kwargs) -> str:
     if not text:
         return ""
-    text = re.sub(r'\\?#[0-9a-fA-F]{6}', '', text)
-    text = re.sub(r'"[^"]+"\.\s*"[^"]+"\.', '', text)
-    text = re.sub(r'"好感度".*?。', '', text)
-    text = re.sub(r'\[-?\d+,\s*\d+\].*?。', '', text)
-    text = text.replace('""', '').strip()
-    return text
\ No newline at end of file
+    engine = character_engines.get(kwargs.get("character_name"), default_engine)
+    return engine.clean(text)
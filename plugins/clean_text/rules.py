@@ -0,0 +1,87 @@
+import re
+import logging
+from typing import Dict, List, Optional
+
+# 默认清理规则，与原先的五次 re.sub 等价
+# pattern: 正则表达式；replace: 替换内容；flags: 正则标志(i/m/s)；
+# stage: 执行阶段，按阶段顺序依次执行。同一阶段内替换内容相同的规则会合并为一个正则一次扫描完成，
+#        合并后从左到右只扫描一遍，删除一处匹配不会让其他规则看到删除后的文本，
+#        所以只有匹配之间互不影响的规则才能放在同一阶段。
+# 默认规则都会互相影响(删除颜色代码、参数或状态栏后，前后文本拼接可能形成新的匹配；
+# 状态栏规则的 .*?。 也可能吞掉另一条规则匹配的开头)，因此各自占一个阶段，顺序与原实现相同
+DEFAULT_RULES = [
+    # 颜色代码，如 #ff00ff
+    {"pattern": r'\\?#[0-9a-fA-F]{6}', "replace": "", "stage": 0},
+    # 形如 "xxx". "yyy". 的参数
+    {"pattern": r'"[^"]+"\.\s*"[^"]+"\.', "replace": "", "stage": 1},
+    # 好感度等状态栏
+    {"pattern": r'"好感度".*?。', "replace": "", "stage": 2},
+    {"pattern": r'\[-?\d+,\s*\d+\].*?。', "replace": "", "stage": 3},
+    # 清理后残留的空引号
+    {"pattern": r'""', "replace": "", "stage": 4},
+]
+
+FLAG_MAP = {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL}
+
+# 含有反向引用的规则合并后组号会变化，不能合并
+BACKREFERENCE_PATTERN = re.compile(r'\\[1-9]|\(\?P=')
+GROUP_REFERENCE_PATTERN = re.compile(r'\\[1-9]|\\g<')
+
+
+def _parse_flags(flags: str) -> int:
+    value = 0
+    for flag in flags or "":
+        value |= FLAG_MAP.get(flag.lower(), 0)
+    return value
+
+
+def _mergeable(rule: dict) -> bool:
+    return not BACKREFERENCE_PATTERN.search(rule["pattern"]) and not GROUP_REFERENCE_PATTERN.search(rule.get("replace", ""))
+
+
+class CleaningEngine:
+    """
+    预编译的文本清理规则引擎。
+    规则在创建时编译一次；同一阶段内替换内容相同、标志相同且没有反向引用的规则合并为一个交替正则，
+    一次扫描完成，避免每次调用都多次遍历全文。
+    """
+
+    def __init__(self, rules: List[dict]):
+        self.passes = []
+        for stage in sorted({rule.get("stage", 0) for rule in rules}):
+            stage_rules = [rule for rule in rules if rule.get("stage", 0) == stage]
+            groups: Dict[tuple, List[str]] = {}
+            for rule in stage_rules:
+                replace = rule.get("replace", "")
+                flags = _parse_flags(rule.get("flags", ""))
+                if _mergeable(rule):
+                    groups.setdefault((replace, flags), []).append(rule["pattern"])
+                else:
+                    self.passes.append((re.compile(rule["pattern"], flags), replace))
+            for (replace, flags), patterns in groups.items():
+                combined = patterns[0] if len(patterns) == 1 else "|".join(f"(?:{pattern})" for pattern in patterns)
+                self.passes.append((re.compile(combined, flags), replace))
+
+    def clean(self, text: str) -> str:
+        for pattern, replace in self.passes:
+            text = pattern.sub(replace, text)
+        return text.strip()
+
+
+def append_rules(base: List[dict], rules: List[dict]) -> List[dict]:
+    """
+    把 rules 追加到 base 之后执行：阶段号整体后移到 base 的最后一个阶段之后，
+    避免与 base 中相同阶段的规则合并而提前执行
+    """
+    offset = max((rule.get("stage", 0) for rule in base), default=-1) + 1
+    return list(base) + [dict(rule, stage=offset + rule.get("stage", 0)) for rule in rules]
+
+
+def build_engine(rules: Optional[List[dict]], extra_rules: Optional[List[dict]] = None) -> Optional[CleaningEngine]:
+    """ :param extra_rules: 在 rules 的所有阶段之后执行的规则(如角色专属规则) """
+    try:
+        rules = rules if rules is not None else DEFAULT_RULES
+        return CleaningEngine(append_rules(rules, extra_rules) if extra_rules else rules)
+    except (re.error, KeyError, TypeError) as e:
+        logging.error(f"清理规则编译失败: {e}")
+        return None
@@ -0,0 +1,10 @@
+import logging
+
+# 钩子在 plugin.json 中声明，首次调用时才导入本插件
+from .transcoder import transcode_stream, FFMPEG_PATH
+
+__package__ = "transcode"
+__version__ = "0.1.0"
+
+if not FFMPEG_PATH:
+    logging.warning("未找到 ffmpeg，转码插件只能进行 WAV 降采样")
@@ -0,0 +1,288 @@
+import array
+import shutil
+import asyncio
+import logging
+import threading
+import subprocess
+import warnings
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from config import plugins_config
+from wavUtils import find_wav_data_offset, parse_wav_format, build_streaming_header
+
+# audioop 在 Python 3.13 中被移除，可用时用于无需 ffmpeg 的 WAV 降采样
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import audioop
+except ImportError:
+    audioop = None
+
+transcode_config = plugins_config.get("transcode", {})
+
+# 需要 ffmpeg 编码的格式: ffmpeg 输出参数和 Content-Type
+ENCODED_FORMATS = {
+    "ogg": (["-c:a", "libopus", "-f", "ogg"], "audio/ogg"),
+    "opus": (["-c:a", "libopus", "-f", "ogg"], "audio/ogg"),
+    "mp3": (["-c:a", "libmp3lame", "-f", "mp3"], "audio/mpeg"),
+    "aac": (["-c:a", "aac", "-f", "adts"], "audio/aac"),
+}
+READ_SIZE = 64 * 1024
+# 转码失败时日志中保留的 ffmpeg 错误输出行数
+STDERR_LINES = 20
+
+FFMPEG_PATH = transcode_config.get("ffmpeg_path") or shutil.which("ffmpeg")
+
+
+class TranscodeError(RuntimeError):
+    """ ffmpeg 转码失败。流式响应的状态码已经发出，只能中断响应，避免客户端收到不完整的 200 """
+
+
+def resolve_output(output: dict) -> tuple:
+    """ 客户端未指定时使用插件配置的默认格式和采样率 """
+    output_format = (output.get("format") or "wav").lower()
+    sample_rate = output.get("sample_rate") or 0
+    if output_format == "wav" and not sample_rate:
+        output_format = (transcode_config.get("default_format") or "wav").lower()
+        sample_rate = transcode_config.get("default_sample_rate", 0)
+    return output_format, sample_rate
+
+
+async def _split_header(stream: AsyncIterator[bytes]):
+    """
+    读取到 WAV 文件头为止
+    :return: (文件头, 剩余数据的迭代器)；不是 WAV 时文件头为 None，迭代器输出原始数据
+    """
+    iterator = stream.__aiter__()
+    buffer = b""
+    offset = None
+    async for chunk in iterator:
+        buffer += chunk
+        offset = find_wav_data_offset(buffer)
+        if offset is not None:
+            break
+
+    async def rest(head: bytes):
+        if head:
+            yield head
+        async for chunk in iterator:
+            yield chunk
+
+    if offset is None or offset == -1:
+        return None, rest(buffer)
+    return buffer[:offset], rest(buffer[offset:])
+
+
+async def _resample(pcm: AsyncIterator[bytes], wav_format: dict, sample_rate: int):
+    """ 使用 audioop.ratecv 增量降采样，保留跨数据块的滤波状态 """
+    width = wav_format["bits"] // 8
+    frame_size = width * wav_format["channels"]
+    state = None
+    remainder = b""
+    async for chunk in pcm:
+        data = remainder + chunk
+        usable = len(data) - len(data) % frame_size
+        remainder = data[usable:]
+        if not usable:
+            continue
+        converted, state = audioop.ratecv(
+            data[:usable], width, wav_format["channels"], wav_format["sample_rate"], sample_rate, state
+        )
+        yield converted
+
+
+async def _swap_bytes(pcm: AsyncIterator[bytes]):
+    """ WAV 中的 PCM 为小端序，audio/L16 规定为网络字节序(大端序) """
+    remainder = b""
+    async for chunk in pcm:
+        data = remainder + chunk
+        usable = len(data) - len(data) % 2
+        remainder = data[usable:]
+        if not usable:
+            continue
+        samples = array.array("h", data[:usable])
+        samples.byteswap()
+        yield samples.tobytes()
+
+
+async def _ffmpeg(pcm: AsyncIterator[bytes], wav_format: dict, output_args: list):
+    """
+    在 ffmpeg 子进程中转码：写入在线程池中执行，读取使用独立线程，事件循环不会被阻塞。
+    ffmpeg 异常退出时记录其错误输出并抛出 TranscodeError
+    """
+    loop = asyncio.get_running_loop()
+    process = subprocess.Popen(
+        [
+            FFMPEG_PATH, "-hide_banner", "-loglevel", "error",
+            "-f", f"s{wav_format['bits']}le", "-ar", str(wav_format["sample_rate"]), "-ac", str(wav_format["channels"]),
+            "-i", "pipe:0", *output_args, "pipe:1"
+        ],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def put(data):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, data)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def read():
+        try:
+            while data := process.stdout.read1(READ_SIZE):
+                put(data)
+        except (OSError, ValueError):
+            pass
+        finally:
+            put(None)
+
+    # 只保留最后几行错误输出，必须持续读取，否则 ffmpeg 写满管道后会阻塞
+    stderr_lines = deque(maxlen=STDERR_LINES)
+
+    def read_stderr():
+        try:
+            for line in process.stderr:
+                stderr_lines.append(line.decode("utf-8", errors="replace").rstrip())
+        except (OSError, ValueError):
+            pass
+
+    def write(data: bytes) -> bool:
+        try:
+            process.stdin.write(data)
+            process.stdin.flush()
+            return True
+        except (BrokenPipeError, OSError, ValueError):
+            # ffmpeg 已经退出
+            return False
+
+    def close_stdin():
+        try:
+            process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+    async def feed():
+        try:
+            async for chunk in pcm:
+                if not await loop.run_in_executor(None, write, chunk):
+                    break
+        finally:
+            await loop.run_in_executor(None, close_stdin)
+
+    threading.Thread(target=read, name="ffmpeg-reader", daemon=True).start()
+    stderr_reader = threading.Thread(target=read_stderr, name="ffmpeg-stderr", daemon=True)
+    stderr_reader.start()
+    feeder = asyncio.create_task(feed())
+    try:
+        while (data := await queue.get()) is not None:
+            yield data
+        await feeder
+        returncode = await loop.run_in_executor(None, process.wait)
+        if returncode != 0:
+            await loop.run_in_executor(None, stderr_reader.join, 1.0)
+            detail = "\n".join(stderr_lines)
+            logging.error(f"ffmpeg 转码失败(退出码 {returncode}): {detail}")
+            raise TranscodeError(f"ffmpeg 退出码 {returncode}")
+    finally:
+        if not feeder.done():
+            feeder.cancel()
+            await asyncio.gather(feeder, return_exceptions=True)
+        if process.poll() is None:
+            process.kill()
+            # kill 后立即回收，避免残留僵尸进程
+            process.wait()
+        if hasattr(pcm, "aclose"):
+            await pcm.aclose()
+
+
+def _pcm16_format(header: Optional[bytes]) -> Optional[dict]:
+    """ 可以转码的 16 位 PCM WAV 的格式信息，其他情况返回 None """
+    wav_format = parse_wav_format(header) if header is not None else None
+    if wav_format is None or wav_format["format_tag"] != 1 or wav_format["bits"] != 16:
+        return None
+    return wav_format
+
+
+async def _transcode(stream: AsyncIterator[bytes], output_format: str, sample_rate: int, split: Optional[tuple] = None):
+    """ :param split: 已经读取的 (文件头, 剩余数据的迭代器)，为 None 时从 stream 中读取 """
+    header, rest = split or await _split_header(stream)
+    try:
+        wav_format = _pcm16_format(header)
+        if wav_format is None:
+            # 错误信息或不支持的格式，原样输出
+            async for chunk in rest:
+                yield chunk
+            return
+
+        if output_format in ("wav", "raw"):
+            target_rate = sample_rate or wav_format["sample_rate"]
+            if output_format == "wav":
+                yield build_streaming_header(wav_format["channels"], target_rate, 16)
+            if target_rate == wav_format["sample_rate"] or audioop is not None:
+                pcm = rest if target_rate == wav_format["sample_rate"] else _resample(rest, wav_format, target_rate)
+                if output_format == "raw":
+                    pcm = _swap_bytes(pcm)
+                async for chunk in pcm:
+                    yield chunk
+                return
+            output_args = ["-ar", str(target_rate), "-f", "s16le" if output_format == "wav" else "s16be"]
+        else:
+            output_args, _ = ENCODED_FORMATS[output_format]
+            output_args = list(output_args)
+            bitrate = transcode_config.get("bitrate", {}).get(output_format)
+            if bitrate:
+                output_args += ["-b:a", str(bitrate)]
+            if sample_rate:
+                output_args += ["-ar", str(sample_rate)]
+
+        transcoder = _ffmpeg(rest, wav_format, output_args)
+        try:
+            async for chunk in transcoder:
+                yield chunk
+        finally:
+            # 先结束 ffmpeg 子进程和写入任务，写入任务仍在读取上游流时不能关闭上游流
+            await transcoder.aclose()
+    finally:
+        # 客户端断开时依次关闭上游流
+        await rest.aclose()
+        if hasattr(stream, "aclose"):
+            await stream.aclose()
+
+
+async def transcode_stream(stream: AsyncIterator[bytes], output: Optional[dict] = None, **kwargs):
+    """
+    on_tts_response_streaming 钩子：把后端返回的 WAV 流转码为客户端要求的格式，
+    并通过 output["media_type"] 告知适配器响应的 Content-Type
+    """
+    if output is None:
+        return stream
+    output_format, sample_rate = resolve_output(output)
+    if output_format in ENCODED_FORMATS:
+        if not FFMPEG_PATH:
+            logging.warning(f"未找到 ffmpeg，无法转码为 {output_format}，返回原始 WAV")
+            return stream
+        output["media_type"] = ENCODED_FORMATS[output_format][1]
+    elif output_format == "raw" or (output_format == "wav" and sample_rate):
+        if sample_rate and audioop is None and not FFMPEG_PATH:
+            logging.warning("audioop 不可用且未找到 ffmpeg，无法降采样，返回原始 WAV")
+            return stream
+        if output_format == "raw":
+            # audio/L16 的响应头需要给出采样率和声道数，先读取后端的 WAV 文件头。
+            # 此时响应还未开始，流式响应结束时关闭上游的逻辑不会执行，出错或被取消时需要在这里关闭
+            try:
+                split = await _split_header(stream)
+            except BaseException:
+                if hasattr(stream, "aclose"):
+                    await stream.aclose()
+                raise
+            wav_format = _pcm16_format(split[0])
+            if wav_format is not None:
+                rate = sample_rate or wav_format["sample_rate"]
+                output["media_type"] = f"audio/L16;rate={rate};channels={wav_format['channels']}"
+            return _transcode(stream, output_format, sample_rate, split)
+        output["media_type"] = "audio/wav"
+    else:
+        return stream
+    return _transcode(stream, output_format, sample_rate)
@@ -1,12 +1,2 @@
-from .translate import translate_text
-from config import plugins_config
-
-# 插件开关
-enabled = plugins_config.get("translate", {}).get("enabled", False)
-
-def init_plugin(manager):
-    if not enabled:
-        return
-    # 注册插件hook函数
-    manager.register("on_tts_request_streaming", translate_text, priority=manager.HIGH_PRIORITY)
-    manager.register("on_srt_request_streaming", translate_text, priority=manager.HIGH_PRIORITY)
\ No newline at end of file
+# 钩子在 plugin.json 中声明，首次调用时才导入本插件
+from .translate import translate_text, close_translation_client
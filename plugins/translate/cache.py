@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger("Translator")
+
+CacheKey = Tuple[str, str, str]
+
+
+@contextmanager
+def file_lock(path: str):
+    """ 跨进程的文件锁，多个工作进程共用同一个持久化文件时保证追加和重写不会交错 """
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class TranslationCache:
+    """
+    翻译结果缓存，键为 (原文, 目标语言, 模型)，按 LRU 淘汰并带有过期时间。
+    可选持久化到本地 JSONL 文件，重启后继续使用。
+    同一时间相同的翻译请求只会向上游发送一次，其余请求等待该结果。
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 7 * 24 * 3600, persist_path: str = ""):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist_path = persist_path
+        # key -> (写入时间, 译文)
+        self.entries: "OrderedDict[CacheKey, Tuple[float, str]]" = OrderedDict()
+        # 正在进行中的翻译
+        self.in_flight: Dict[CacheKey, asyncio.Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0}
+        if self.persist_path:
+            self._load()
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl > 0 and time.time() - stored_at > self.ttl
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with file_lock(self.persist_path + ".lock"):
+                self._load_locked()
+        except OSError as e:
+            logger.warning(f"读取翻译缓存文件失败: {e}")
+
+    def _load_locked(self):
+        total = 0
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    total += 1
+                    try:
+                        record = json.loads(line)
+                        key = tuple(record["key"])
+                        stored_at, value = record["time"], record["value"]
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    if self._expired(stored_at):
+                        continue
+                    self.entries.pop(key, None)
+                    self.entries[key] = (stored_at, value)
+        except OSError as e:
+            logger.warning(f"读取翻译缓存文件失败: {e}")
+            return
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        # 文件中存在过期或被覆盖的记录时重写文件，避免无限增长
+        if total > len(self.entries):
+            self._rewrite()
+        logger.info(f"已加载 {len(self.entries)} 条翻译缓存")
+
+    def _rewrite(self):
+        # 调用方已持有文件锁
+        tmp_path = self.persist_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for key, (stored_at, value) in self.entries.items():
+                    f.write(json.dumps({"key": list(key), "value": value, "time": stored_at}, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            logger.warning(f"写入翻译缓存文件失败: {e}")
+
+    def _append(self, key: CacheKey, stored_at: float, value: str):
+        try:
+            with file_lock(self.persist_path + ".lock"), open(self.persist_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": list(key), "value": value, "time": stored_at}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"写入翻译缓存文件失败: {e}")
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        item = self.entries.get(key)
+        if item is None:
+            return None
+        stored_at, value = item
+        if self._expired(stored_at):
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def put(self, key: CacheKey, value: str):
+        stored_at = time.time()
+        self.entries.pop(key, None)
+        self.entries[key] = (stored_at, value)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        if self.persist_path:
+            await asyncio.get_running_loop().run_in_executor(None, self._append, key, stored_at, value)
+
+    async def get_or_fetch(self, key: CacheKey, fetch: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        """
+        优先返回缓存，未命中时调用 fetch 获取并写入缓存。
+        fetch 返回 None 表示翻译失败，失败结果不会被缓存。
+        """
+        cached = self.get(key)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return cached
+
+        # 合并相同的进行中请求
+        if key in self.in_flight:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self.in_flight[key])
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            result = await fetch()
+            if result is not None:
+                await self.put(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            # 发起方被取消或出错时，让等待者自行回退到原文
+            if not future.done():
+                future.set_result(None)
+            raise e
+        finally:
+            self.in_flight.pop(key, None)
@@ -0,0 +1,262 @@
+import json
+import time
+import random
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger("Translator")
+
+# 可重试的状态码：限流和上游临时故障
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# 单次退避的最长等待时间(秒)
+MAX_BACKOFF = 10.0
+
+
+def estimate_tokens(text: str) -> int:
+    """ 粗略估计一次翻译消耗的 token 数(输入+输出)，用于 TPM 限流 """
+    return 64 + 2 * len(text)
+
+
+class TokenBucket:
+    """
+    令牌桶限流：每分钟补充 rate 个令牌，桶容量为 rate(允许一分钟内的突发)。
+    令牌可以预支为负数，后来者按顺序排在前面的预支之后等待，rate 为 0 表示不限制。
+    """
+
+    def __init__(self, rate: float):
+        self.configure(rate)
+
+    def configure(self, rate: float):
+        self.rate = rate
+        self.capacity = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    async def acquire(self, amount: float = 1):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate / 60)
+        self.updated = now
+        # 超过容量的单次请求按容量计算，避免永远等待
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens * 60 / self.rate)
+
+
+class TranslationService:
+    """
+    硅基流动翻译服务：
+    - 复用同一个连接池，不再每次请求新建客户端
+    - 按 RPM / TPM 令牌桶限流，匹配账户的调用额度
+    - 限流和临时故障时带随机抖动的指数退避重试，仍失败则依次尝试备用模型/接口
+    - 可选的批量模式：短时间内排队的多句短文本合并为一次请求，以 JSON 返回后拆分
+    """
+
+    def __init__(self, url: str, settings: Optional[dict] = None):
+        self.url = url
+        self.client: Optional[httpx.AsyncClient] = None
+        self.requests_limiter = TokenBucket(0)
+        self.tokens_limiter = TokenBucket(0)
+        # (目标语言, api_key, 模型) -> 等待中的 [(原文, future)]
+        self.batches: Dict[tuple, list] = {}
+        self.stats = {"requests": 0, "retries": 0, "fallbacks": 0, "failures": 0, "batches": 0, "batched_lines": 0}
+        self.configure(settings or {})
+
+    def configure(self, settings: dict):
+        self.timeout = settings.get("timeout", 20.0)
+        self.max_retries = settings.get("max_retries", 2)
+        self.retry_base_delay = settings.get("retry_base_delay", 0.5)
+        # 备用模型/接口列表: [{"model": ..., "url": ..., "api_key": ...}]，未填写的字段沿用主配置
+        self.fallbacks: List[dict] = list(settings.get("fallbacks", []))
+        self.requests_limiter.configure(settings.get("rpm", 0))
+        self.tokens_limiter.configure(settings.get("tpm", 0))
+        batch = settings.get("batch", {})
+        self.batch_enabled = batch.get("enabled", False)
+        self.batch_window = batch.get("window", 0.05)
+        self.batch_max_size = batch.get("max_size", 8)
+        self.batch_max_chars = batch.get("max_chars", 80)
+
+    def get_client(self) -> httpx.AsyncClient:
+        # 首次使用时创建，保证客户端绑定到适配器运行的事件循环
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                trust_env=True,
+            )
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def endpoints(self, api_key: str, model: str) -> List[Tuple[str, str, str]]:
+        """ 主接口和备用接口，返回 [(url, api_key, model)] """
+        result = [(self.url, api_key, model)]
+        for fallback in self.fallbacks:
+            result.append((fallback.get("url") or self.url, fallback.get("api_key") or api_key, fallback.get("model") or model))
+        return result
+
+    async def translate(self, text: str, lang_name: str, api_key: str, model: str) -> Optional[str]:
+        """
+        翻译一段文本，开启批量模式时短文本会与同一时间窗口内的其他文本合并请求
+        :return: 译文，所有接口都失败时返回 None
+        """
+        if self.batch_enabled and self.batch_max_size > 1 and len(text) <= self.batch_max_chars:
+            return await self._submit_batch(text, lang_name, api_key, model)
+        return await self._translate_single(text, lang_name, api_key, model)
+
+    async def _translate_single(self, text: str, lang_name: str, api_key: str, model: str) -> Optional[str]:
+        system_prompt = (
+            "You are a professional translator. "
+            f"Translate the user's input text into {lang_name}. "
+            "Output ONLY the translated text. Do not output any explanation, notes, or punctuation marks that were not in the original tone."
+        )
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": text}
+        ]
+        return await self.complete(messages, api_key, model, estimate_tokens(text))
+
+    async def complete(self, messages: list, api_key: str, model: str, tokens: int, json_output: bool = False) -> Optional[str]:
+        """
+        发送 chat/completions 请求，依次尝试主接口和备用接口，每个接口按配置重试
+        :return: 模型输出的文本，全部失败时返回 None
+        """
+        for index, (url, key, endpoint_model) in enumerate(self.endpoints(api_key, model)):
+            if index:
+                self.stats["fallbacks"] += 1
+                logger.warning(f"改用备用翻译模型 {endpoint_model}")
+            payload = {
+                "model": endpoint_model,
+                "messages": messages,
+                "temperature": 0.3,
+                "max_tokens": 4096,
+            }
+            if json_output:
+                payload["response_format"] = {"type": "json_object"}
+            content = await self._post_with_retry(url, key, payload, tokens)
+            if content is not None:
+                return content
+        self.stats["failures"] += 1
+        return None
+
+    async def _post_with_retry(self, url: str, api_key: str, payload: dict, tokens: int) -> Optional[str]:
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+            await self.requests_limiter.acquire()
+            await self.tokens_limiter.acquire(tokens)
+            self.stats["requests"] += 1
+            retry_after = None
+            try:
+                response = await self.get_client().post(url, json=payload, headers=headers)
+                if response.status_code == 200:
+                    return response.json()["choices"][0]["message"]["content"].strip()
+                logger.error(f"与API通信时出错 ({response.status_code}): {response.text[:200]}")
+                if response.status_code not in RETRYABLE_STATUS:
+                    # 鉴权失败、模型不存在等错误重试无意义，直接尝试下一个接口
+                    return None
+                retry_after = response.headers.get("Retry-After")
+            except (httpx.TransportError, ValueError, KeyError, IndexError, TypeError) as e:
+                logger.error(f"翻译请求异常: {e}")
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+        return None
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        """ 指数退避加全抖动，服务端给出 Retry-After 时不早于该时间 """
+        delay = random.uniform(0, min(MAX_BACKOFF, self.retry_base_delay * 2 ** attempt))
+        try:
+            return max(delay, min(MAX_BACKOFF, float(retry_after)))
+        except (TypeError, ValueError):
+            return delay
+
+    async def _submit_batch(self, text: str, lang_name: str, api_key: str, model: str) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        key = (lang_name, api_key, model)
+        future = loop.create_future()
+        group = self.batches.get(key)
+        if group is None:
+            group = self.batches[key] = []
+            loop.call_later(self.batch_window, self._start_flush, key, group)
+        group.append((text, future))
+        if len(group) >= self.batch_max_size:
+            self._start_flush(key, group)
+        return await future
+
+    def _start_flush(self, key: tuple, group: list):
+        # 定时器触发时该组可能已因达到上限提前发出
+        if self.batches.get(key) is not group:
+            return
+        del self.batches[key]
+        asyncio.ensure_future(self._flush(key, group))
+
+    async def _flush(self, key: tuple, group: list):
+        lang_name, api_key, model = key
+        results = None
+        try:
+            if len(group) > 1:
+                results = await self._translate_batch([text for text, _ in group], lang_name, api_key, model)
+            if results is None:
+                # 只有一句或批量结果无法拆分时逐句翻译
+                results = await asyncio.gather(*(
+                    self._translate_single(text, lang_name, api_key, model) for text, _ in group
+                ))
+        except Exception as e:
+            logger.error(f"批量翻译失败: {e}")
+            results = [None] * len(group)
+        for (_, future), result in zip(group, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _translate_batch(self, lines: List[str], lang_name: str, api_key: str, model: str) -> Optional[List[str]]:
+        system_prompt = (
+            "You are a professional translator. "
+            f"The user sends a JSON object whose \"lines\" field is an array of independent lines of dialogue. "
+            f"Translate every line into {lang_name}. "
+            "Respond with ONLY a JSON object of the form {\"translations\": [...]}, containing exactly one translated string per input line, in the same order. "
+            "Do not add explanations, notes, or punctuation marks that were not in the original tone."
+        )
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": json.dumps({"lines": lines}, ensure_ascii=False)}
+        ]
+        content = await self.complete(messages, api_key, model, sum(estimate_tokens(line) for line in lines), json_output=True)
+        if content is None:
+            return None
+        translations = parse_batch_output(content, len(lines))
+        if translations is None:
+            logger.warning(f"批量翻译结果无法与原文对应，改为逐句翻译: {content[:100]}")
+            return None
+        self.stats["batches"] += 1
+        self.stats["batched_lines"] += len(lines)
+        logger.info(f"批量翻译 {len(lines)} 句 -> [{lang_name}]")
+        return translations
+
+
+def parse_batch_output(content: str, count: int) -> Optional[List[str]]:
+    """ 解析批量翻译的 JSON 输出，条数不符或格式错误时返回 None """
+    # 部分模型会把 JSON 包在 ``` 代码块中
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        data = json.loads(content[start:end + 1])
+    except ValueError:
+        return None
+    translations = data.get("translations") if isinstance(data, dict) else None
+    if not isinstance(translations, list) or len(translations) != count:
+        return None
+    if not all(isinstance(item, str) and item.strip() for item in translations):
+        return None
+    return [item.strip() for item in translations]
@@ -1,6 +1,9 @@
 import os
-import httpx
 import logging
+from typing import Optional
+
+from .cache import TranslationCache
+from .service import TranslationService
 
 # 允许 config 缺省；若未定义则回退到环境变量或空串
 try:
@@ -15,6 +18,23 @@ SILICONFLOW_API_KEY = os.getenv("SILICONFLOW_API_KEY", SILICONFLOW_API_KEY)
 # 配置日志
 logger = logging.getLogger("Translator")
 
+# 翻译缓存和翻译服务配置，位于 plugins_config["translate"]
+try:
+    from config import plugins_config
+    TRANSLATE_CONFIG = plugins_config.get("translate", {})
+except ImportError:
+    TRANSLATE_CONFIG = {}
+CACHE_CONFIG = TRANSLATE_CONFIG.get("cache", {})
+
+translation_cache = TranslationCache(
+    max_entries=CACHE_CONFIG.get("max_entries", 2048),
+    ttl=CACHE_CONFIG.get("ttl", 7 * 24 * 3600),
+    persist_path=CACHE_CONFIG.get("persist_path", ""),
+)
+
+# 共用连接池、限流、重试和批量翻译
+translation_service = TranslationService(SILICONFLOW_API_URL, TRANSLATE_CONFIG)
+
 # 语言代码映射表：将 GPT-SoVITS 的简写映射为自然语言，方便 LLM 理解
 LANG_MAP = {
     "zh": "Chinese (Simplified)",
@@ -27,81 +47,68 @@ LANG_MAP = {
     "auto": "the target language suitable for the context"
 }
 
-MAX_TOKENS = 4096
-
 async def translate_text_handle(text: str, target_lang_code: str, api_key: str, model: str = "Qwen/Qwen2.5-14B-Instruct") -> str:
     """
-    使用硅基流动 API 进行翻译
+    使用硅基流动 API 进行翻译，相同的 (原文, 目标语言, 模型) 优先使用缓存
     :param text: 原始文本
     :param target_lang_code: 目标语言代码 (zh, ja, en)
     :param api_key: SiliconFlow API Key
     :param model: 模型名称
-    :return: 翻译后的文本
+    :return: 翻译后的文本，失败时返回原文
+    """
+    translated_text = await translate_or_none(text, target_lang_code, api_key, model)
+    return text if translated_text is None else translated_text
+
+async def translate_or_none(text: str, target_lang_code: str, api_key: str, model: str) -> Optional[str]:
+    """
+    同 translate_text_handle，但翻译失败或跳过翻译时返回 None，便于调用方保留原文的语言
     """
     if not text or not text.strip():
-        return text
+        return None
 
     # 如果目标语言是 auto，或者不在映射表中，默认不做翻译或者尝试翻成中文
     # 但通常 GPT-SoVITS 的 prompt_lang 都是明确的 zh/ja/en
     if target_lang_code not in LANG_MAP:
         logger.warning(f"未知目标语言: {target_lang_code}，跳过翻译")
-        return text
+        return None
 
-    target_lang_name = LANG_MAP[target_lang_code]
-    
-    # 构建 Prompt
-    system_prompt = (
-        "You are a professional translator. "
-        f"Translate the user's input text into {target_lang_name}. "
-        "Output ONLY the translated text. Do not output any explanation, notes, or punctuation marks that were not in the original tone."
+    return await translation_cache.get_or_fetch(
+        (text, target_lang_code, model),
+        lambda: request_translation(text, target_lang_code, api_key, model)
     )
 
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": text}
-        ],
-        "temperature": 0.3,
-        "max_tokens": MAX_TOKENS
-    }
-
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-
-    try:
-        async with httpx.AsyncClient(timeout=httpx.Timeout(20.0, connect=10.0), trust_env=True) as client:
-            response = await client.post(SILICONFLOW_API_URL, json=payload, headers=headers)
-            
-            if response.status_code != 200:
-                logger.error(f"与API通信时出错 ({response.status_code}): {response.text}")
-                return text # 翻译失败，返回原文
-            
-            data = response.json()
-            translated_text = data["choices"][0]["message"]["content"].strip()
-            
-            logger.info(f"翻译: [{text[:10]}...] -> [{target_lang_code}] -> [{translated_text[:10]}...]")
-            return translated_text
+async def request_translation(text: str, target_lang_code: str, api_key: str, model: str) -> Optional[str]:
+    """
+    向硅基流动 API 发送翻译请求(经过限流、重试和备用模型)
+    :return: 翻译后的文本，失败时返回 None
+    """
+    translated_text = await translation_service.translate(text, LANG_MAP[target_lang_code], api_key, model)
+    if translated_text is not None:
+        logger.info(f"翻译: [{text[:10]}...] -> [{target_lang_code}] -> [{translated_text[:10]}...]")
+    return translated_text
 
-    except Exception as e:
-        logger.error(f"翻译请求异常: {e}")
-        return text # 发生异常则返回原文
-    
 # 插件主函数
 async def translate_text(request_data: dict, **kwargs) -> dict:
     target_lang = kwargs.get("target_lang", "zh")
     original_text = request_data["text"]
     
-    if original_text and SILICONFLOW_API_KEY != "":
-        translated_text = await translate_text_handle(
+    if original_text and original_text.strip() and SILICONFLOW_API_KEY != "":
+        translated_text = await translate_or_none(
             text=original_text,
             target_lang_code=target_lang, # 翻译成参考音频的语言
             api_key=SILICONFLOW_API_KEY,
             model=SILICONFLOW_MODEL
         )
+        if translated_text is None:
+            # 翻译失败时保留原文及其语言，避免按目标语言朗读未翻译的文本
+            logger.warning(f"翻译失败，按原文语言 {request_data.get('text_lang')} 合成")
+            return request_data
         request_data["text"] = translated_text
         request_data["text_lang"] = target_lang # 翻译后，输入文本语言就等于目标语言
 
-    return request_data
\ No newline at end of file
+    return request_data
+
+async def close_translation_client(data=None, **kwargs):
+    """ on_shutdown 钩子：关闭翻译服务的连接池 """
+    await translation_service.close()
+    return data
@@ -0,0 +1,120 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# 根据角色排名挑选本次要预热的角色和目标后端，没有需要预热的返回 None
+PlanFunc = Callable[[List[str]], Optional[Tuple[str, Any]]]
+# 在目标后端上预热角色，返回预热结果(ok 表示是否成功)，不能预热时返回 None
+WarmFunc = Callable[..., Awaitable[Optional[dict]]]
+
+
+class Prewarmer:
+    """
+    模型预热：记录角色的使用情况，后端空闲时按最近/最常使用预测下一个角色并提前加载权重，
+    把切换模型的数秒延迟移出交互路径。
+    """
+
+    def __init__(self, plan: PlanFunc, warm: WarmFunc, enabled: bool = True, strategy: str = "recent",
+                 idle_after: float = 5.0, retry_after: float = 60.0, max_tracked: int = 64):
+        self.plan = plan
+        self.warm = warm
+        self.enabled = enabled
+        # "recent": 最近使用优先; "frequent": 使用次数优先
+        self.strategy = strategy
+        # 无请求持续多少秒视为空闲
+        self.idle_after = idle_after
+        # 预热失败的角色在此时间内不再自动重试
+        self.retry_after = retry_after
+        self.max_tracked = max_tracked
+        # 角色名 -> 使用次数，按最近使用排序(最近的在末尾)
+        self.usage: "OrderedDict[str, int]" = OrderedDict()
+        self.last_activity = time.monotonic()
+        self.failed: Dict[str, float] = {}
+        self.inflight: Dict[str, asyncio.Future] = {}
+
+    def configure(self, enabled: Optional[bool] = None, strategy: Optional[str] = None, idle_after: Optional[float] = None):
+        if enabled is not None:
+            self.enabled = enabled
+        if strategy is not None:
+            self.strategy = strategy
+        if idle_after is not None:
+            self.idle_after = idle_after
+
+    def record(self, character_name: str):
+        """ 记录一次角色使用 """
+        self.last_activity = time.monotonic()
+        self.usage[character_name] = self.usage.pop(character_name, 0) + 1
+        while len(self.usage) > self.max_tracked:
+            self.usage.popitem(last=False)
+
+    def ranking(self) -> List[str]:
+        """ 按预测策略排序的角色列表，最可能被使用的在前 """
+        recent = list(reversed(self.usage))
+        if self.strategy == "frequent":
+            # 次数相同时最近使用的优先(sorted 是稳定排序)
+            return sorted(recent, key=lambda name: -self.usage[name])
+        return recent
+
+    def is_idle(self) -> bool:
+        return time.monotonic() - self.last_activity >= self.idle_after
+
+    async def prewarm(self, character_name: str, target: Any = None, **kwargs) -> Optional[dict]:
+        """
+        预热角色，同一角色的并发预热会合并为一次(参数以先发起的为准)
+        :return: 预热结果(ok 表示是否成功)，出错或不能预热时返回 None
+        """
+        future = self.inflight.get(character_name)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[character_name] = future
+        try:
+            result = await self.warm(character_name, target, **kwargs)
+        except Exception as e:
+            logging.error(f"预热角色 {character_name} 失败: {e}")
+            result = None
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self.inflight.pop(character_name, None)
+        future.set_result(result)
+        if result and result.get("ok"):
+            self.failed.pop(character_name, None)
+        else:
+            self.failed[character_name] = time.monotonic()
+        return result
+
+    async def run_idle(self, interval: float = 1.0):
+        """ 后台循环：空闲时为最可能使用的角色预热 """
+        while True:
+            await asyncio.sleep(interval)
+            if not self.enabled or not self.usage or not self.is_idle():
+                continue
+            now = time.monotonic()
+            ranking = [
+                name for name in self.ranking()
+                if now - self.failed.get(name, -self.retry_after) >= self.retry_after
+            ]
+            try:
+                planned = self.plan(ranking)
+                if planned is None:
+                    continue
+                character_name, target = planned
+                logging.info(f"后端空闲，预热角色 {character_name}")
+                await self.prewarm(character_name, target)
+            except Exception as e:
+                logging.error(f"空闲预热失败: {e}")
+
+    async def prewarm_on_startup(self, character_name: str, retries: int = 3, delay: float = 5.0):
+        """ 启动时预加载默认角色，后端可能尚未就绪，失败时稍后重试 """
+        for attempt in range(retries + 1):
+            result = await self.prewarm(character_name)
+            if result and result["ok"]:
+                return True
+            if attempt < retries:
+                await asyncio.sleep(delay)
+        logging.warning(f"启动预热角色 {character_name} 失败")
+        return False
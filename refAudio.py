@@ -0,0 +1,268 @@
+import os
+import json
+import wave
+import array
+import shutil
+import hashlib
+import logging
+import tempfile
+import warnings
+import threading
+import subprocess
+from typing import Dict, Iterable, Optional, Tuple
+
+# audioop 在 Python 3.13 中被移除，没有 ffmpeg 时用于处理 WAV 参考音频
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import audioop
+except ImportError:
+    audioop = None
+
+# 处理方式变化时修改版本号，使旧的缓存文件失效
+PROCESS_VERSION = 2
+# 静音检测的窗口(秒)和阈值(16 位采样的绝对值)
+SILENCE_WINDOW = 0.02
+SILENCE_THRESHOLD = 300
+# 去除首尾静音后保留的静音(秒)，避免切掉字的起止
+SILENCE_PADDING = 0.1
+# 与后端时长限制保持的余量(秒)，避免重采样的舍入误差导致被拒绝
+LENGTH_MARGIN = 0.05
+# ffmpeg 最多解码的时长(秒)
+MAX_DECODE_SECONDS = 120
+# 缓存目录中记录 源文件 -> 内容哈希 的清单，重启后不必重新读取和哈希参考音频
+# 以 . 开头的文件(清单和写入中的临时文件)不会被清理
+MANIFEST_NAME = ".index.json"
+
+
+def peak(samples: array.array, start: int, length: int) -> int:
+    chunk = samples[start:start + length]
+    return max(max(chunk), -min(chunk)) if chunk else 0
+
+
+class RefAudioPreprocessor:
+    """
+    参考音频预处理：把参考音频转换为单声道 16 位 WAV 并统一采样率，去除首尾静音，过短时补静音。
+    去除静音后仍超过时长上限的参考音频不做截断(截断后与参考文本不再对应)，记录错误并继续使用原文件。
+    结果按内容哈希保存在缓存目录中，参考音频不变时直接复用。
+    """
+
+    def __init__(self, cache_dir: str, sample_rate: int = 32000, min_seconds: float = 3.0, max_seconds: float = 10.0,
+                 ffmpeg_path: str = ""):
+        self.cache_dir = cache_dir
+        self.sample_rate = sample_rate
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.ffmpeg_path = ffmpeg_path or shutil.which("ffmpeg")
+        # (源文件路径, 修改时间, 大小) -> 处理结果，避免目录每次变化时重新读取所有文件
+        self.memo: Dict[Tuple[str, int, int], dict] = {}
+        # 持久化的清单: 源文件路径 -> {"mtime", "size", "settings", "digest"}，首次使用时读取
+        self.manifest: Optional[Dict[str, dict]] = None
+        # 索引可能在多个线程中重建(启动后的后台预处理、目录变化、配置重载)
+        self.lock = threading.Lock()
+
+    def settings_key(self) -> str:
+        return f"v{PROCESS_VERSION}-{self.sample_rate}-{self.min_seconds}-{self.max_seconds}"
+
+    def _manifest(self) -> Dict[str, dict]:
+        if self.manifest is None:
+            try:
+                with open(os.path.join(self.cache_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                    self.manifest = json.load(f)
+            except (OSError, ValueError):
+                self.manifest = {}
+        return self.manifest
+
+    def _write_atomic(self, path: str, write):
+        """ 先写入唯一的临时文件再替换，多个工作进程同时处理同一文件时互不影响 """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _load_result(self, digest: str) -> Optional[dict]:
+        wav_path = os.path.join(self.cache_dir, digest + ".wav")
+        meta_path = os.path.join(self.cache_dir, digest + ".json")
+        # 元数据在音频之后写入，存在即表示音频已完整
+        if not os.path.exists(wav_path) or not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return dict(json.load(f), path=wav_path)
+        except (OSError, ValueError):
+            return None
+
+    def cached(self, path: str) -> Optional[dict]:
+        """
+        只查询已有的处理结果(内存或持久化清单)，不读取、不哈希、不转换音频，用于启动时快速建立索引
+        :return: 处理结果；尚未处理过或源文件已变化时返回 None
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        memo_key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if memo_key in self.memo:
+                return self.memo[memo_key]
+            record = self._manifest().get(path)
+        if not record or (record.get("mtime"), record.get("size"), record.get("settings")) != (stat.st_mtime_ns, stat.st_size, self.settings_key()):
+            return None
+        result = self._load_result(record["digest"])
+        if result is not None:
+            with self.lock:
+                self.memo[memo_key] = result
+        return result
+
+    def process(self, path: str) -> Optional[dict]:
+        """
+        处理一个参考音频
+        :return: {"path": 处理后的文件, "seconds": 时长}；无法处理或超过时长上限时返回 None，调用方使用原文件
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        memo_key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if memo_key in self.memo:
+                return self.memo[memo_key]
+        result = self.cached(path)
+        if result is not None:
+            return result
+        try:
+            result = self._process(path)
+        except Exception as e:
+            logging.warning(f"预处理参考音频 {os.path.basename(path)} 失败，使用原文件: {e}")
+        with self.lock:
+            # 失败的结果也记录，文件修改后才会重试
+            self.memo[memo_key] = result
+            if result is not None:
+                self._manifest()[path] = {
+                    "mtime": stat.st_mtime_ns, "size": stat.st_size, "settings": self.settings_key(),
+                    "digest": os.path.splitext(os.path.basename(result["path"]))[0],
+                }
+                self._save_manifest()
+        return result
+
+    def _save_manifest(self):
+        # 多个工作进程同时写入时以最后一次为准，丢失的记录只会让下次启动重新哈希该文件
+        data = json.dumps(self.manifest, ensure_ascii=False).encode("utf-8")
+        try:
+            self._write_atomic(os.path.join(self.cache_dir, MANIFEST_NAME), lambda f: f.write(data))
+        except OSError as e:
+            logging.warning(f"保存参考音频预处理清单失败: {e}")
+
+    def _process(self, path: str) -> Optional[dict]:
+        with open(path, "rb") as f:
+            content = f.read()
+        digest = hashlib.sha1(content + self.settings_key().encode()).hexdigest()[:20]
+        os.makedirs(self.cache_dir, exist_ok=True)
+        result = self._load_result(digest)
+        if result is not None:
+            return result
+
+        pcm = self._decode(path)
+        if pcm is None:
+            return None
+        seconds = len(pcm) / 2 / self.sample_rate
+        pcm = self._fit_length(pcm)
+        if pcm is None:
+            logging.error(
+                f"参考音频 {os.path.basename(path)} 去除首尾静音后仍超过 {self.max_seconds} 秒(原长 {seconds:.1f} 秒)，"
+                f"后端会拒绝该参考音频，请更换为 {self.min_seconds}~{self.max_seconds} 秒的音频"
+            )
+            return None
+
+        def write_wav(f):
+            with wave.open(f, "wb") as wav_file:
+                wav_file.setnchannels(1)
+                wav_file.setsampwidth(2)
+                wav_file.setframerate(self.sample_rate)
+                wav_file.writeframes(pcm)
+
+        meta = {"source": os.path.basename(path), "seconds": round(len(pcm) / 2 / self.sample_rate, 3)}
+        meta_data = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        wav_path = os.path.join(self.cache_dir, digest + ".wav")
+        self._write_atomic(wav_path, write_wav)
+        self._write_atomic(os.path.join(self.cache_dir, digest + ".json"), lambda f: f.write(meta_data))
+        logging.info(f"参考音频 {meta['source']} 已预处理: {meta['seconds']} 秒")
+        return dict(meta, path=wav_path)
+
+    def _decode(self, path: str) -> Optional[bytes]:
+        """ 解码为单声道 16 位目标采样率的 PCM，优先使用 ffmpeg """
+        if self.ffmpeg_path:
+            completed = subprocess.run(
+                [
+                    self.ffmpeg_path, "-hide_banner", "-loglevel", "error", "-t", str(MAX_DECODE_SECONDS),
+                    "-i", path, "-ac", "1", "-ar", str(self.sample_rate), "-f", "s16le", "pipe:1"
+                ],
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60
+            )
+            if completed.returncode != 0:
+                raise RuntimeError(completed.stderr.decode("utf-8", errors="replace").strip())
+            return completed.stdout
+        if audioop is None or not path.lower().endswith(".wav"):
+            logging.warning(f"未找到 ffmpeg，无法预处理参考音频 {os.path.basename(path)}，使用原文件")
+            return None
+        with wave.open(path, "rb") as f:
+            channels, width, rate = f.getnchannels(), f.getsampwidth(), f.getframerate()
+            data = f.readframes(f.getnframes())
+        if channels > 2:
+            logging.warning(f"参考音频 {os.path.basename(path)} 有 {channels} 个声道，需要 ffmpeg 处理，使用原文件")
+            return None
+        if width == 1:
+            # 8 位 WAV 为无符号采样
+            data = audioop.bias(data, 1, -128)
+        if width != 2:
+            data = audioop.lin2lin(data, width, 2)
+        if channels == 2:
+            data = audioop.tomono(data, 2, 0.5, 0.5)
+        if rate != self.sample_rate:
+            data, _ = audioop.ratecv(data, 2, 1, rate, self.sample_rate, None)
+        return data
+
+    def _fit_length(self, pcm: bytes) -> Optional[bytes]:
+        """ 去除首尾静音，过短时补静音；去除静音后仍超过时长上限时返回 None """
+        samples = array.array("h", pcm[:len(pcm) - len(pcm) % 2])
+        window = max(1, int(self.sample_rate * SILENCE_WINDOW))
+        loud = [start for start in range(0, len(samples), window) if peak(samples, start, window) > SILENCE_THRESHOLD]
+        padding = int(self.sample_rate * SILENCE_PADDING)
+        if loud:
+            samples = samples[max(0, loud[0] - padding):min(len(samples), loud[-1] + window + padding)]
+        if len(samples) > int((self.max_seconds - LENGTH_MARGIN) * self.sample_rate):
+            return None
+        min_samples = int((self.min_seconds + LENGTH_MARGIN) * self.sample_rate)
+        if len(samples) < min_samples:
+            samples.extend([0] * (min_samples - len(samples)))
+        return samples.tobytes()
+
+    def prune(self, active_paths: Iterable[str]):
+        """ 删除不再被任何参考音频使用的缓存文件，并从清单中移除已不存在的源文件 """
+        active = {os.path.splitext(os.path.basename(path))[0] for path in active_paths}
+        with self.lock:
+            manifest = self._manifest()
+            removed = [path for path, record in manifest.items() if record.get("digest") not in active]
+            for path in removed:
+                del manifest[path]
+            if removed:
+                self._save_manifest()
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_file() and entry.name.split(".")[0] not in active:
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+        except OSError:
+            pass
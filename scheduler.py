@@ -0,0 +1,144 @@
+import time
+import asyncio
+import logging
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Hashable, Optional, Tuple
+
+
+class ModelScheduler:
+    """
+    按模型亲和度调度请求，避免多角色交错请求时后端来回切换权重。
+
+    同一时间只允许一个模型(key)的请求在后端执行，持有租约期间模型不会被切走，
+    因此 "切换模型 + 合成" 是一个整体。当前模型执行完毕后，优先继续执行该模型排队中的请求，
+    直到达到批次上限或其他模型的请求等待超过 max_wait 秒，再切换到等待最久的模型，保证不会饿死。
+    """
+
+    def __init__(self, max_batch: int = 8, max_wait: float = 10.0):
+        # 同一模型连续执行的最大请求数(达到后若有其他模型在排队则让出)
+        self.max_batch = max_batch
+        # 其他模型请求的最长等待时间(秒)，超过后当前模型不再接收新请求
+        self.max_wait = max_wait
+        # 当前占用后端的模型 key
+        self.current: Optional[Hashable] = None
+        # 当前模型正在执行的请求数
+        self.active = 0
+        # 当前模型本批次已放行的请求数
+        self.served_in_batch = 0
+        # 每个模型的等待队列，元素为 (入队时间, future)
+        self.queues: "OrderedDict[Hashable, Deque[Tuple[float, asyncio.Future]]]" = OrderedDict()
+
+    def configure(self, max_batch: Optional[int] = None, max_wait: Optional[float] = None):
+        if max_batch is not None:
+            self.max_batch = max_batch
+        if max_wait is not None:
+            self.max_wait = max_wait
+
+    def pending(self) -> Dict[Any, int]:
+        """ 各模型排队中的请求数 """
+        return {key: len(queue) for key, queue in self.queues.items() if queue}
+
+    def forget(self):
+        """
+        后端的模型加载状态未知(切换失败、后端被摘除)时清除当前模型。
+        执行中的请求不受影响，新请求不再直接加入当前批次，结束后按等待时间重新选择模型
+        """
+        self.current = None
+        self.served_in_batch = 0
+
+    def _oldest_other_wait(self, now: float) -> float:
+        """ 除当前模型外，其他模型中等待最久的请求已等待的时间 """
+        oldest = 0.0
+        for key, queue in self.queues.items():
+            if key != self.current and queue:
+                oldest = max(oldest, now - queue[0][0])
+        return oldest
+
+    def _others_waiting(self) -> bool:
+        return any(queue for key, queue in self.queues.items() if key != self.current)
+
+    def _should_rotate(self) -> bool:
+        """ 是否应当让出后端给其他模型 """
+        if not self._others_waiting():
+            return False
+        if self.served_in_batch >= self.max_batch:
+            return True
+        return self._oldest_other_wait(time.monotonic()) >= self.max_wait
+
+    def _grant(self, key: Hashable, future: Optional[asyncio.Future] = None):
+        if key != self.current:
+            self.current = key
+            self.served_in_batch = 0
+        self.active += 1
+        self.served_in_batch += 1
+        if future is not None:
+            future.set_result(True)
+
+    def _dispatch(self):
+        """ 当前模型的请求全部结束后，选择下一个执行的模型并放行其排队请求 """
+        if self.active > 0:
+            return
+        current_queue = self.queues.get(self.current)
+        if current_queue and not self._should_rotate():
+            next_key = self.current
+            # 没有其他模型在排队时，批次上限没有意义，开启新一批
+            if self.served_in_batch >= self.max_batch:
+                self.served_in_batch = 0
+        else:
+            candidates = [(queue[0][0], key) for key, queue in self.queues.items() if queue]
+            if not candidates:
+                return
+            next_key = min(candidates, key=lambda x: x[0])[1]
+            if next_key != self.current:
+                self.current = next_key
+                self.served_in_batch = 0
+
+        queue = self.queues[next_key]
+        while queue and self.served_in_batch < self.max_batch:
+            _, future = queue.popleft()
+            if future.done():
+                continue
+            self._grant(next_key, future)
+        if not queue:
+            del self.queues[next_key]
+        # 队列中全是已取消的请求时，继续寻找下一个模型
+        if self.active == 0 and self.queues:
+            self._dispatch()
+
+    def _release(self):
+        self.active -= 1
+        if self.active == 0:
+            self._dispatch()
+
+    @asynccontextmanager
+    async def acquire(self, key: Hashable):
+        """
+        获取指定模型的执行租约，离开上下文时释放。
+        :param key: 模型标识，相同 key 的请求可以同时执行
+        """
+        can_join = key == self.current and self.active > 0 and not self._should_rotate()
+        is_idle = self.active == 0 and not any(self.queues.values())
+        if can_join or is_idle:
+            self._grant(key)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.queues.setdefault(key, deque()).append((time.monotonic(), future))
+            logging.debug(f"请求进入排队: {key} (当前模型 {self.current}, 执行中 {self.active})")
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # 已被放行但调用方取消，归还租约
+                    self._release()
+                else:
+                    queue = self.queues.get(key)
+                    if queue:
+                        self.queues[key] = deque(item for item in queue if item[1] is not future)
+                        if not self.queues[key]:
+                            del self.queues[key]
+                raise
+        try:
+            yield
+        finally:
+            self._release()
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (pid INTEGER PRIMARY KEY, heartbeat REAL NOT NULL, metrics TEXT);
+CREATE TABLE IF NOT EXISTS backends (url TEXT PRIMARY KEY, gpt TEXT, sovits TEXT);
+CREATE TABLE IF NOT EXISTS leases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, model TEXT NOT NULL,
+    pid INTEGER NOT NULL, granted INTEGER NOT NULL DEFAULT 0, since REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leases_url ON leases (url, granted);
+CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS audio_cache (key TEXT PRIMARY KEY, size INTEGER NOT NULL, used REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS audio_cache_used ON audio_cache (used);
+"""
+
+
+class SharedState:
+    """
+    多工作进程(uvicorn --workers)共享的状态，保存在本机的 SQLite 文件中：
+    - 各后端当前加载的模型权重
+    - 跨进程的模型租约：同一后端同一时间只执行一个模型的请求，切换模型前等待其他进程的请求结束
+    - 工作进程心跳和指标快照，用于汇总 /metrics
+    - 后台任务的状态，任意工作进程都能查询
+    - 合成音频磁盘缓存的索引和 LRU 顺序，各进程共用同一个容量限制
+    数据库操作在专用线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, path: str, max_wait: float = 10.0, heartbeat_interval: float = 2.0, worker_timeout: float = 15.0):
+        self.path = path
+        self.pid = os.getpid()
+        # 其他模型的请求等待超过该时间(秒)后，当前模型的新请求不再插队
+        self.max_wait = max_wait
+        self.heartbeat_interval = heartbeat_interval
+        # 超过该时间(秒)没有心跳的工作进程视为已退出，其持有的租约被回收
+        self.worker_timeout = worker_timeout
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @staticmethod
+    def reset(path: str):
+        """ 主进程启动工作进程前清除上次运行遗留的状态 """
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _transaction(self, func, *args):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    # 心跳与指标
+
+    def _heartbeat(self, conn: sqlite3.Connection, metrics_snapshot: Optional[dict]):
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO workers (pid, heartbeat, metrics) VALUES (?, ?, ?)",
+            (self.pid, now, json.dumps(metrics_snapshot, ensure_ascii=False) if metrics_snapshot is not None else None)
+        )
+        # 回收已退出进程的租约
+        conn.execute(
+            "DELETE FROM leases WHERE pid NOT IN (SELECT pid FROM workers WHERE heartbeat >= ?)",
+            (now - self.worker_timeout,)
+        )
+
+    async def heartbeat(self, metrics_snapshot: Optional[dict] = None):
+        await self._run(self._transaction, self._heartbeat, metrics_snapshot)
+
+    def _other_metrics(self) -> List[dict]:
+        rows = self._connect().execute(
+            "SELECT metrics FROM workers WHERE pid != ? AND heartbeat >= ? AND metrics IS NOT NULL",
+            (self.pid, time.time() - self.worker_timeout)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    async def other_metrics(self) -> List[dict]:
+        """ 其他存活工作进程最近一次上报的指标快照 """
+        return await self._run(self._other_metrics)
+
+    def _is_leader(self) -> bool:
+        row = self._connect().execute(
+            "SELECT MIN(pid) FROM workers WHERE heartbeat >= ?", (time.time() - self.worker_timeout,)
+        ).fetchone()
+        return row[0] is None or row[0] == self.pid
+
+    async def is_leader(self) -> bool:
+        """ 存活工作进程中 pid 最小的一个负责只需执行一次的后台任务(如空闲预热) """
+        return await self._run(self._is_leader)
+
+    def _can_prewarm(self, url: str) -> bool:
+        busy = self._connect().execute("SELECT 1 FROM leases WHERE url = ? LIMIT 1", (url,)).fetchone()
+        return busy is None and self._is_leader()
+
+    async def can_prewarm(self, url: str) -> bool:
+        """ 空闲预热只由主导进程执行，且后端没有任何进程的请求在执行或排队 """
+        return await self._run(self._can_prewarm, url)
+
+    # 后端加载状态
+
+    def _load_backends(self) -> Dict[str, dict]:
+        rows = self._connect().execute("SELECT url, gpt, sovits FROM backends").fetchall()
+        return {url: {"gpt": gpt, "sovits": sovits} for url, gpt, sovits in rows}
+
+    async def sync_backends(self, backends: Iterable):
+        """ 用共享的加载状态更新本进程的后端对象 """
+        loaded = await self._run(self._load_backends)
+        for backend in backends:
+            if backend.url in loaded:
+                backend.loaded = dict(loaded[backend.url])
+
+    def _save_backend(self, url: str, gpt: Optional[str], sovits: Optional[str]):
+        self._connect().execute("INSERT OR REPLACE INTO backends (url, gpt, sovits) VALUES (?, ?, ?)", (url, gpt, sovits))
+
+    async def save_backend(self, backend):
+        await self._run(self._save_backend, backend.url, backend.loaded["gpt"], backend.loaded["sovits"])
+
+    # 跨进程模型租约
+
+    def _enqueue(self, conn: sqlite3.Connection, url: str, model: str) -> int:
+        cursor = conn.execute(
+            "INSERT INTO leases (url, model, pid, granted, since) VALUES (?, ?, ?, 0, ?)",
+            (url, model, self.pid, time.time())
+        )
+        return cursor.lastrowid
+
+    def _try_grant(self, conn: sqlite3.Connection, lease_id: int, url: str, model: str) -> bool:
+        now = time.time()
+        holders = {row[0] for row in conn.execute("SELECT DISTINCT model FROM leases WHERE url = ? AND granted = 1", (url,))}
+        waiters = conn.execute("SELECT id, model, since FROM leases WHERE url = ? AND granted = 0 ORDER BY since, id", (url,)).fetchall()
+        row = conn.execute("SELECT gpt, sovits FROM backends WHERE url = ?", (url,)).fetchone()
+        # 模型标识即 (gpt, sovits)，后端已加载该模型时其他请求可以直接加入，否则由一个请求负责切换
+        loaded = row is not None and json.dumps(list(row), ensure_ascii=False) == model
+        if holders:
+            # 与正在执行的模型相同且切换已完成时加入，除非其他模型已等待过久
+            granted = holders == {model} and loaded and not any(
+                other != model and now - since >= self.max_wait for _, other, since in waiters
+            )
+        else:
+            # 后端空闲时交给等待最久的模型
+            granted = not waiters or waiters[0][0] == lease_id or (loaded and waiters[0][1] == model)
+        if granted:
+            conn.execute("UPDATE leases SET granted = 1 WHERE id = ?", (lease_id,))
+        return granted
+
+    def _release(self, lease_id: int):
+        self._connect().execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+
+    @asynccontextmanager
+    async def model_lease(self, url: str, key: Hashable, poll_interval: float = 0.02, max_poll_interval: float = 0.2):
+        """
+        获取后端的跨进程模型租约，持有期间其他进程不会把该后端切换到其他模型。
+        相同模型的请求可以同时持有。
+        """
+        model = json.dumps(key, ensure_ascii=False)
+        lease_id = await self._run(self._transaction, self._enqueue, url, model)
+        try:
+            while not await self._run(self._transaction, self._try_grant, lease_id, url, model):
+                await asyncio.sleep(poll_interval)
+                poll_interval = min(poll_interval * 2, max_poll_interval)
+            yield
+        finally:
+            # 取消时也要归还，放在 shield 中保证执行
+            await asyncio.shield(self._run(self._release, lease_id))
+
+    # 后台任务
+
+    def _save_job(self, job: dict):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO jobs (id, data, updated) VALUES (?, ?, ?)",
+            (job["id"], json.dumps(job, ensure_ascii=False, default=str), time.time())
+        )
+
+    async def save_job(self, job: dict):
+        await self._run(self._save_job, job)
+
+    def _load_job(self, job_id: str) -> Optional[dict]:
+        row = self._connect().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def load_job(self, job_id: str) -> Optional[dict]:
+        return await self._run(self._load_job, job_id)
+
+    def _expire_jobs(self, retention: float):
+        self._connect().execute("DELETE FROM jobs WHERE updated < ?", (time.time() - retention,))
+
+    async def expire_jobs(self, retention: float):
+        await self._run(self._expire_jobs, retention)
+
+    # 音频磁盘缓存索引
+
+    def _audio_cache_evict(self, conn: sqlite3.Connection, max_entries: int, max_bytes: int) -> Tuple[List[str], int, int]:
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM audio_cache").fetchone()
+        evicted = []
+        if count > max_entries or total > max_bytes:
+            for key, size in conn.execute("SELECT key, size FROM audio_cache ORDER BY used").fetchall():
+                if count <= max_entries and total <= max_bytes:
+                    break
+                evicted.append(key)
+                count -= 1
+                total -= size
+            conn.executemany("DELETE FROM audio_cache WHERE key = ?", [(key,) for key in evicted])
+        return evicted, count, total
+
+    def _audio_cache_load(self, conn: sqlite3.Connection, entries: List[Tuple[float, str, int]], max_entries: int, max_bytes: int):
+        # 各进程启动时都会扫描目录，已登记的记录保留原有的访问时间
+        conn.executemany("INSERT OR IGNORE INTO audio_cache (key, size, used) VALUES (?, ?, ?)",
+                         [(key, size, mtime) for mtime, key, size in entries])
+        return self._audio_cache_evict(conn, max_entries, max_bytes)
+
+    def _audio_cache_add(self, conn: sqlite3.Connection, key: str, size: int, max_entries: int, max_bytes: int):
+        conn.execute("INSERT OR REPLACE INTO audio_cache (key, size, used) VALUES (?, ?, ?)", (key, size, time.time()))
+        return self._audio_cache_evict(conn, max_entries, max_bytes)
+
+    def _audio_cache_touch(self, key: str) -> bool:
+        cursor = self._connect().execute("UPDATE audio_cache SET used = ? WHERE key = ?", (time.time(), key))
+        return cursor.rowcount > 0
+
+    def _audio_cache_remove(self, key: str):
+        self._connect().execute("DELETE FROM audio_cache WHERE key = ?", (key,))
+
+    def close(self):
+        def close_connection():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self.executor.submit(close_connection)
+        self.executor.shutdown(wait=True)
+
+
+class SharedAudioCacheIndex:
+    """ 多进程共享的音频磁盘缓存索引，接口与 audioCache.DiskIndex 相同 """
+
+    def __init__(self, state: SharedState):
+        self.state = state
+        # 最近一次更新索引时的总条数和总大小，用于统计接口
+        self.count = 0
+        self.bytes = 0
+
+    async def _evicting(self, func, *args) -> List[str]:
+        evicted, self.count, self.bytes = await self.state._run(self.state._transaction, func, *args)
+        return evicted
+
+    async def load(self, entries: List[Tuple[float, str, int]], max_entries: int, max_bytes: int) -> List[str]:
+        return await self._evicting(self.state._audio_cache_load, entries, max_entries, max_bytes)
+
+    async def touch(self, key: str) -> bool:
+        return await self.state._run(self.state._audio_cache_touch, key)
+
+    async def add(self, key: str, size: int, max_entries: int, max_bytes: int) -> List[str]:
+        return await self._evicting(self.state._audio_cache_add, key, size, max_entries, max_bytes)
+
+    async def remove(self, key: str):
+        await self.state._run(self.state._audio_cache_remove, key)
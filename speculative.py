@@ -0,0 +1,187 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# 比较预合成参数与正式请求时忽略的字段(文本按句比较，输出格式由适配器决定)
+IGNORED_PARAMS = ("text", "media_type", "streaming_mode")
+
+
+class SpeculativeSession:
+    """ 一条正在生成中的消息：累积的原文和已提交预合成的句子 """
+
+    def __init__(self, message_id: str, character_name: str, target_lang: str, request_data: dict):
+        self.message_id = message_id
+        self.character_name = character_name
+        self.target_lang = target_lang
+        # 已补全参考音频和参考文本的请求参数，text 为空
+        self.request_data = request_data
+        self.raw = ""
+        self.done = False
+        # [(句子, 合成任务)]，任务结果为完整的 WAV，失败时为 None
+        self.segments: List[Tuple[str, asyncio.Task]] = []
+        self.updated = time.monotonic()
+
+    def cancel(self, start: int = 0):
+        """ 取消从 start 开始的句子的合成 """
+        for _, task in self.segments[start:]:
+            task.cancel()
+        del self.segments[start:]
+
+    def info(self) -> dict:
+        return {
+            "message_id": self.message_id,
+            "character": self.character_name,
+            "done": self.done,
+            "sentences": len(self.segments),
+            "ready": sum(1 for _, task in self.segments if task.done() and not task.cancelled() and task.result() is not None),
+        }
+
+
+class SpeculativeStore:
+    """
+    预合成：LLM 仍在生成回复时，由客户端把增量文本按消息 id 推送过来，
+    每完成一句就清理、翻译并合成，保存合成好的片段。
+    之后 /tts 收到完整消息时，文本与参数一致的句子直接使用已合成的片段，其余句子照常合成。
+    """
+
+    def __init__(self, clean: Callable[[str, SpeculativeSession], Awaitable[str]],
+                 split: Callable[[str], List[str]],
+                 synthesize: Callable[[SpeculativeSession, str], Awaitable[bytes]],
+                 enabled: bool = False, ttl: float = 300.0, max_sessions: int = 16, concurrency: int = 2):
+        # clean(原文, session) -> 清理后的文本
+        self.clean = clean
+        # split(文本) -> 句子列表，必须与 /tts 分句的方式一致
+        self.split = split
+        # synthesize(session, 句子) -> 完整的 WAV
+        self.synthesize = synthesize
+        self.enabled = enabled
+        # 消息最后一次更新后保留的时间(秒)
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.concurrency = concurrency
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.sessions: "OrderedDict[str, SpeculativeSession]" = OrderedDict()
+        self.stats = {"sessions": 0, "segments": 0, "used": 0, "discarded": 0}
+
+    def configure(self, enabled: Optional[bool] = None, ttl: Optional[float] = None,
+                  max_sessions: Optional[int] = None, concurrency: Optional[int] = None):
+        if enabled is not None:
+            self.enabled = enabled
+            if not enabled:
+                self.clear()
+        if ttl is not None:
+            self.ttl = ttl
+        if max_sessions is not None:
+            self.max_sessions = max_sessions
+        if concurrency is not None and concurrency != self.concurrency:
+            self.concurrency = concurrency
+            # 新提交的句子使用新的并发数
+            self.semaphore = None
+
+    def get(self, message_id: str) -> Optional[SpeculativeSession]:
+        self._expire()
+        return self.sessions.get(message_id)
+
+    def open(self, message_id: str, character_name: str, target_lang: str, request_data: dict) -> SpeculativeSession:
+        session = SpeculativeSession(message_id, character_name, target_lang, request_data)
+        self.sessions[message_id] = session
+        self.stats["sessions"] += 1
+        self._expire()
+        return session
+
+    def discard(self, message_id: str) -> bool:
+        """ 丢弃消息(如生成被中止)，取消未完成的合成 """
+        session = self.sessions.pop(message_id, None)
+        if session is None:
+            return False
+        self.stats["discarded"] += len(session.segments)
+        session.cancel()
+        return True
+
+    def clear(self):
+        for message_id in list(self.sessions):
+            self.discard(message_id)
+
+    def _expire(self):
+        now = time.monotonic()
+        for message_id, session in list(self.sessions.items()):
+            if len(self.sessions) > self.max_sessions or now - session.updated > self.ttl:
+                self.discard(message_id)
+
+    async def feed(self, session: SpeculativeSession, delta: str, done: bool = False):
+        """ 追加增量文本，为新完成的句子提交合成；done 表示消息已生成完毕，最后一句也会提交 """
+        session.raw += delta
+        session.done = session.done or done
+        session.updated = time.monotonic()
+        self.sessions.move_to_end(session.message_id)
+        sentences = self.split(await self.clean(session.raw, session))
+        if not session.done:
+            # 最后一句可能尚未完成
+            sentences = sentences[:-1]
+        # 清理规则可能因后续文本改变前面的结果，从第一处不一致的句子开始重新提交
+        for index, (sentence, _) in enumerate(session.segments):
+            if index >= len(sentences) or sentences[index] != sentence:
+                self.stats["discarded"] += len(session.segments) - index
+                session.cancel(index)
+                break
+        for sentence in sentences[len(session.segments):]:
+            session.segments.append((sentence, asyncio.ensure_future(self._run(session, sentence))))
+            self.stats["segments"] += 1
+
+    async def _run(self, session: SpeculativeSession, sentence: str) -> Optional[bytes]:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(max(1, self.concurrency))
+        try:
+            async with self.semaphore:
+                return await self.synthesize(session, sentence)
+        except Exception as e:
+            logging.warning(f"[{session.character_name}] 预合成失败: {e}")
+            return None
+
+    def match(self, character_name: str, request_data: dict, sentences: List[str],
+              message_id: Optional[str] = None) -> Optional[Dict[int, asyncio.Task]]:
+        """
+        查找与完整消息对应的预合成片段，未指定消息 id 时按角色和首句查找最近的消息。
+        找到后该消息从等待列表中移除。
+        :return: 句子序号 -> 合成任务；没有可用的片段时返回 None
+        """
+        if not self.sessions or not sentences:
+            return None
+        self._expire()
+        if message_id is not None:
+            session = self.sessions.get(message_id)
+        else:
+            session = next((
+                candidate for candidate in reversed(self.sessions.values())
+                if candidate.character_name == character_name and candidate.segments and candidate.segments[0][0] == sentences[0]
+            ), None)
+        if session is None or session.character_name != character_name:
+            return None
+        if not same_params(session.request_data, request_data):
+            logging.info(f"[{character_name}] 请求参数与预合成时不同，不使用预合成的片段")
+            return None
+        prepared = {
+            index: task for index, (sentence, task) in enumerate(session.segments)
+            if index < len(sentences) and sentences[index] == sentence
+        }
+        if not prepared:
+            return None
+        del self.sessions[session.message_id]
+        # 文本不一致的片段不会再被使用
+        for index, (_, task) in enumerate(session.segments):
+            if index not in prepared:
+                task.cancel()
+        self.stats["used"] += len(prepared)
+        self.stats["discarded"] += len(session.segments) - len(prepared)
+        logging.info(f"[{character_name}] 使用预合成的片段: {len(prepared)}/{len(sentences)} 句")
+        return prepared
+
+    def info(self) -> dict:
+        return dict(self.stats, enabled=self.enabled, pending=[session.info() for session in self.sessions.values()])
+
+
+def same_params(speculative: dict, request_data: dict) -> bool:
+    keys = (set(speculative) | set(request_data)) - set(IGNORED_PARAMS)
+    return all(speculative.get(key) == request_data.get(key) for key in keys)
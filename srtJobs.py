@@ -0,0 +1,203 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+# 输出目录中由清理策略管理的文件后缀，其他文件(如 tts-out.srt)不会被删除
+MANAGED_SUFFIXES = (".wav", ".ogg", ".mp3", ".flac", ".aac", ".opus", ".raw", ".part")
+
+
+class OutputStore:
+    """
+    srt 输出目录：为每个请求生成唯一文件名，分块写入磁盘(文件操作在线程中执行，不阻塞事件循环)，
+    并按保留时间、总大小和文件数清理旧文件。
+    """
+
+    def __init__(self, output_dir: str, retention: float = 3600.0, max_bytes: int = 1024 * 1024 * 1024, max_files: int = 500):
+        self.output_dir = output_dir
+        # 文件保留时间(秒)，0 表示不按时间清理
+        self.retention = retention
+        # 总大小和文件数上限，0 表示不限制
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        # 正在写入的文件，清理时跳过
+        self.writing: Set[str] = set()
+
+    def configure(self, retention: Optional[float] = None, max_bytes: Optional[int] = None, max_files: Optional[int] = None):
+        if retention is not None:
+            self.retention = retention
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if max_files is not None:
+            self.max_files = max_files
+
+    @staticmethod
+    def new_filename(suffix: str = ".wav") -> str:
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:12]}{suffix}"
+
+    async def write(self, filename: str, chunks: AsyncIterator[bytes]) -> int:
+        """
+        把数据块依次写入临时文件，完整写入后再重命名为目标文件，失败时删除临时文件
+        :return: 写入的字节数
+        """
+        loop = asyncio.get_running_loop()
+        path = os.path.join(self.output_dir, filename)
+        tmp_path = path + ".part"
+        self.writing.add(filename + ".part")
+        size = 0
+        try:
+            f = await loop.run_in_executor(None, open, tmp_path, "wb")
+            try:
+                async for chunk in chunks:
+                    await loop.run_in_executor(None, f.write, chunk)
+                    size += len(chunk)
+            finally:
+                await loop.run_in_executor(None, f.close)
+                if hasattr(chunks, "aclose"):
+                    await chunks.aclose()
+            await loop.run_in_executor(None, os.replace, tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        finally:
+            self.writing.discard(filename + ".part")
+        return size
+
+    def _scan(self):
+        """ 返回 [(修改时间, 大小, 文件名)]，按修改时间从旧到新排序 """
+        files = []
+        try:
+            with os.scandir(self.output_dir) as it:
+                for entry in it:
+                    if not entry.is_file() or not entry.name.lower().endswith(MANAGED_SUFFIXES) or entry.name in self.writing:
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.name))
+        except OSError:
+            pass
+        files.sort()
+        return files
+
+    def cleanup(self) -> int:
+        """ 删除过期文件，然后从最旧的文件开始删除直到满足大小和数量限制，返回删除的文件数 """
+        files = self._scan()
+        now = time.time()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for index, (mtime, size, name) in enumerate(files):
+            remaining = len(files) - index
+            expired = self.retention > 0 and now - mtime > self.retention
+            over_size = self.max_bytes > 0 and total > self.max_bytes
+            over_count = self.max_files > 0 and remaining > self.max_files
+            if not (expired or over_size or over_count):
+                break
+            try:
+                os.remove(os.path.join(self.output_dir, name))
+                removed += 1
+            except OSError as e:
+                logging.warning(f"删除输出文件 {name} 失败: {e}")
+            total -= size
+        if removed:
+            logging.info(f"已清理 {removed} 个过期输出文件")
+        return removed
+
+    async def run_cleanup(self, interval: float):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.cleanup)
+            except Exception as e:
+                logging.error(f"清理输出目录失败: {e}")
+            await asyncio.sleep(interval)
+
+
+class JobManager:
+    """
+    后台合成任务，提交后立即返回任务 id，客户端轮询任务状态获取结果。
+    多工作进程时任务状态同时写入共享存储，轮询请求可以落在任意工作进程上。
+    """
+
+    def __init__(self, retention: float = 3600.0, max_jobs: int = 1000, store=None):
+        # 已结束任务的记录保留时间(秒)
+        self.retention = retention
+        self.max_jobs = max_jobs
+        self.jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self.tasks: Dict[str, asyncio.Task] = {}
+        # 共享存储，需提供 save_job / load_job / expire_jobs，为 None 时只保存在本进程
+        self.store = store
+
+    def submit(self, func: Callable[[], Awaitable[dict]]) -> dict:
+        self._expire()
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "pending",
+            "created": time.time(),
+            "finished": None,
+            "result": None,
+            "error": None,
+        }
+        self.jobs[job["id"]] = job
+        self.tasks[job["id"]] = asyncio.create_task(self._run(job, func))
+        return job
+
+    async def _run(self, job: dict, func: Callable[[], Awaitable[dict]]):
+        job["status"] = "running"
+        await self._save(job)
+        try:
+            job["result"] = await func()
+            job["status"] = "done"
+        except asyncio.CancelledError:
+            job["status"] = "cancelled"
+            raise
+        except Exception as e:
+            job["status"] = "error"
+            job["error"] = getattr(e, "detail", None) or str(e)
+            logging.error(f"后台任务 {job['id']} 失败: {job['error']}")
+        finally:
+            job["finished"] = time.time()
+            self.tasks.pop(job["id"], None)
+            await asyncio.shield(self._save(job))
+
+    async def _save(self, job: dict):
+        if self.store is None:
+            return
+        try:
+            await self.store.save_job(job)
+        except Exception as e:
+            logging.error(f"保存后台任务 {job['id']} 状态失败: {e}")
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.jobs.get(job_id)
+
+    async def lookup(self, job_id: str) -> Optional[dict]:
+        """ 查找任务，本进程没有时查询共享存储(任务可能由其他工作进程创建) """
+        job = self.jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = await self.store.load_job(job_id)
+        return job
+
+    def _expire(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            finished = job["finished"]
+            if finished is None:
+                continue
+            if len(self.jobs) > self.max_jobs or now - finished > self.retention:
+                del self.jobs[job_id]
+        if self.store is not None:
+            asyncio.ensure_future(self.store.expire_jobs(self.retention))
+
+    async def shutdown(self):
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,177 @@
+import os
+import asyncio
+import logging
+import mimetypes
+from typing import Callable, Dict, List, Optional
+
+from refAudio import RefAudioPreprocessor
+
+# 可作为参考音频的文件后缀
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".ogg", ".flac")
+
+MIME_TO_EXTENSION = {
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/ogg": "ogg",
+    "audio/mpeg": "mp3",
+    "audio/flac": "flac",
+    "audio/x-flac": "flac",
+}
+
+
+def get_real_audio_extension(file_path: str) -> str:
+    """
+    获取给定路径文件的真实音频拓展名。
+    通过文件头判断常见音频文件类型，如 wav, ogg, mp3, flac 等。
+    """
+    # 先尝试获取文件的 MIME 类型
+    mime_type, _ = mimetypes.guess_type(file_path)
+    # 根据 MIME 类型返回对应的音频拓展名，无法识别时返回空字符串
+    return MIME_TO_EXTENSION.get(mime_type, "")
+
+
+class VoiceIndex:
+    """
+    参考音频索引，启动时扫描参考音频目录，按文件名和角色名缓存路径、格式、参考文本和语言，
+    请求时直接查表，不再访问文件系统。目录变化时通过 watchfiles(若已安装)或轮询自动重建。
+    """
+
+    def __init__(self, ref_audio_dir: str, default_lang: str, model_map_getter: Callable[[], dict],
+                 preprocessor: Optional[RefAudioPreprocessor] = None):
+        self.ref_audio_dir = ref_audio_dir
+        self.default_lang = default_lang
+        # 获取当前角色模型配置的函数，用于合并 prompt_lang
+        self.model_map_getter = model_map_getter
+        # 参考音频预处理，为 None 时直接使用原文件
+        self.preprocessor = preprocessor
+        # 文件名 -> 索引项
+        self.by_filename: Dict[str, dict] = {}
+        # 角色名 -> 索引项
+        self.by_name: Dict[str, dict] = {}
+        self._signature = None
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def _scan_signature(self):
+        """ 目录内容签名，文件增删或修改时发生变化 """
+        try:
+            with os.scandir(self.ref_audio_dir) as it:
+                return tuple(sorted((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size) for entry in it if entry.is_file()))
+        except OSError:
+            return ()
+
+    def _build_entry(self, filename: str, has_prompt_file: bool, model_map: dict, preprocess: bool = True) -> dict:
+        character_name = os.path.splitext(filename)[0]
+        abs_file_path = os.path.join(self.ref_audio_dir, filename)
+        prompt_lang = model_map.get(character_name, {}).get("prompt_lang") or self.default_lang
+        # 读取参考文本，不存在时使用角色名
+        prompt_text = character_name
+        if has_prompt_file:
+            try:
+                with open(os.path.join(self.ref_audio_dir, character_name + ".txt"), "r", encoding="utf-8") as f:
+                    prompt_text = f.read().strip()
+            except Exception:
+                prompt_text = ""
+                logging.warning(f"读取角色 {character_name} 参考文本失败，推理将以不使用参考文本的形式进行")
+        # 发给后端的参考音频，预处理后指向缓存目录中的规范化文件
+        path = abs_file_path
+        processed = None
+        if self.preprocessor is not None:
+            processed = self.preprocessor.process(abs_file_path) if preprocess else self.preprocessor.cached(abs_file_path)
+        if processed is not None:
+            path = processed["path"]
+        return {
+            "name": character_name,
+            "voice_id": filename,
+            "path": path,
+            "source_path": abs_file_path,
+            "media_type": get_real_audio_extension(abs_file_path),
+            "prompt_text": prompt_text,
+            "prompt_lang": prompt_lang,
+            "preprocessed": processed is not None,
+        }
+
+    def rebuild(self, preprocess: bool = True):
+        """
+        重新扫描参考音频目录，整体替换索引
+        :param preprocess: 为 False 时只使用已有的预处理结果，尚未处理的参考音频暂时使用原文件，
+                           用于启动时快速建立索引，之后再在后台完整重建
+        """
+        signature = self._scan_signature()
+        names = {name for name, _, _ in signature}
+        model_map = self.model_map_getter()
+        by_filename = {}
+        by_name = {}
+        for name in sorted(names):
+            if not name.lower().endswith(AUDIO_EXTENSIONS):
+                continue
+            entry = self._build_entry(name, os.path.splitext(name)[0] + ".txt" in names, model_map, preprocess)
+            by_filename[name] = entry
+            by_name.setdefault(entry["name"], entry)
+        self.by_filename, self.by_name = by_filename, by_name
+        self._signature = signature
+        pending = 0
+        if self.preprocessor is not None:
+            pending = sum(1 for entry in by_filename.values() if not entry["preprocessed"])
+            if preprocess:
+                self.preprocessor.prune(entry["path"] for entry in by_filename.values())
+        logging.info(f"参考音频索引: 共 {len(by_filename)} 个参考音频{f'，{pending} 个待预处理' if pending and not preprocess else ''}")
+        return pending
+
+    def probe(self, filename: str) -> dict:
+        """ 不经过索引直接读取文件系统，用于索引中尚未收录的文件 """
+        txt_path = os.path.join(self.ref_audio_dir, os.path.splitext(filename)[0] + ".txt")
+        return self._build_entry(filename, os.path.exists(txt_path), self.model_map_getter())
+
+    def get(self, filename: str) -> Optional[dict]:
+        return self.by_filename.get(filename)
+
+    def get_by_name(self, character_name: str) -> Optional[dict]:
+        return self.by_name.get(character_name)
+
+    def voices(self, extensions=(".wav", ".mp3", ".ogg")) -> List[dict]:
+        return [
+            {"name": entry["name"], "voice_id": entry["voice_id"]}
+            for entry in self.by_filename.values()
+            if entry["voice_id"].lower().endswith(extensions)
+        ]
+
+    async def refresh_if_changed(self) -> bool:
+        """ 在线程中检查目录签名，有变化时重建索引 """
+        loop = asyncio.get_running_loop()
+        signature = await loop.run_in_executor(None, self._scan_signature)
+        if signature == self._signature:
+            return False
+        await loop.run_in_executor(None, self.rebuild)
+        return True
+
+    async def _watch(self, poll_interval: float):
+        try:
+            from watchfiles import awatch
+        except ImportError:
+            awatch = None
+        if awatch is not None:
+            try:
+                async for _ in awatch(self.ref_audio_dir):
+                    await self.refresh_if_changed()
+                return
+            except Exception as e:
+                logging.warning(f"监听参考音频目录失败，改为轮询: {e}")
+        while True:
+            await asyncio.sleep(poll_interval)
+            try:
+                await self.refresh_if_changed()
+            except Exception as e:
+                logging.error(f"刷新参考音频索引失败: {e}")
+
+    def start_watching(self, poll_interval: float = 2.0):
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch(poll_interval))
+
+    async def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
@@ -0,0 +1,212 @@
+import struct
+from typing import Optional
+
+# 流式 WAV 中未知长度使用的占位大小
+STREAMING_SIZE = 0xFFFFFFFF
+
+
+def find_wav_data_offset(buffer: bytes) -> Optional[int]:
+    """
+    查找 WAV 数据块(data)中音频数据的起始位置，即文件头长度。
+    :return: 文件头长度；数据不足以判断时返回 None；不是 WAV 时返回 -1
+    """
+    if len(buffer) < 12:
+        return None if b"RIFF".startswith(bytes(buffer[:4])) else -1
+    if buffer[:4] != b"RIFF" or buffer[8:12] != b"WAVE":
+        return -1
+    offset = 12
+    while True:
+        if len(buffer) < offset + 8:
+            return None
+        chunk_id = bytes(buffer[offset:offset + 4])
+        chunk_size = struct.unpack_from("<I", buffer, offset + 4)[0]
+        if chunk_id == b"data":
+            return offset + 8
+        # 块大小为奇数时有一个填充字节
+        offset += 8 + chunk_size + (chunk_size & 1)
+
+
+def make_streaming_header(header: bytes) -> bytes:
+    """ 将文件头中的 RIFF 大小和 data 大小改为流式占位值，用于拼接多段音频 """
+    patched = bytearray(header)
+    struct.pack_into("<I", patched, 4, STREAMING_SIZE)
+    struct.pack_into("<I", patched, len(patched) - 4, STREAMING_SIZE)
+    return bytes(patched)
+
+
+def parse_wav_format(header: bytes) -> Optional[dict]:
+    """
+    解析文件头中的 fmt 块
+    :return: {"format_tag", "channels", "sample_rate", "bits"}，没有 fmt 块时返回 None
+    """
+    offset = 12
+    while offset + 8 <= len(header):
+        chunk_id = bytes(header[offset:offset + 4])
+        chunk_size = struct.unpack_from("<I", header, offset + 4)[0]
+        if chunk_id == b"fmt " and offset + 24 <= len(header):
+            format_tag, channels, sample_rate = struct.unpack_from("<HHI", header, offset + 8)
+            bits = struct.unpack_from("<H", header, offset + 22)[0]
+            return {"format_tag": format_tag, "channels": channels, "sample_rate": sample_rate, "bits": bits}
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def build_streaming_header(channels: int, sample_rate: int, bits: int = 16) -> bytes:
+    """ 生成长度未知的 PCM WAV 文件头 """
+    block_align = channels * bits // 8
+    return (
+        b"RIFF" + struct.pack("<I", STREAMING_SIZE) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits)
+        + b"data" + struct.pack("<I", STREAMING_SIZE)
+    )
+
+
+class WavStreamNormalizer:
+    """
+    增量整理流式 WAV 数据：
+    - 文件头只输出一次(长度改为流式占位)，后续片段重复的文件头被去除；
+    - 按固定时长重新切分 PCM 数据，最后不足一块的部分补静音；
+    - 可选在片段之间插入静音。
+    数据通过 memoryview 切片，只在输出时复制一次。不是 WAV 的数据原样输出。
+    """
+
+    # 尚未确定是否为文件头的数据的最大长度，超过后按普通数据输出
+    MAX_HEADER_SIZE = 4096
+
+    def __init__(self, frame_ms: float = 0, silence_seconds: float = 0):
+        self.frame_ms = frame_ms
+        self.silence_seconds = silence_seconds
+        self.header: Optional[bytes] = None
+        self.passthrough = False
+        self.block_align = 2
+        self.byte_rate = 0
+        self.frame_bytes = 0
+        # 第一个文件头解析完成前收到的数据
+        self.head = b""
+        # 上一块末尾可能是下一个文件头开头的数据
+        self.tail = b""
+        # 不足一块的数据
+        self.pending = bytearray()
+        self.fragments = 1
+
+    def _set_format(self, header: bytes):
+        self.header = header
+        wav_format = parse_wav_format(header)
+        if wav_format is None:
+            return
+        self.block_align = max(1, wav_format["channels"] * wav_format["bits"] // 8)
+        self.byte_rate = wav_format["sample_rate"] * self.block_align
+        if self.frame_ms > 0:
+            frames = max(1, int(wav_format["sample_rate"] * self.frame_ms / 1000))
+            self.frame_bytes = frames * self.block_align
+
+    def _emit(self, view: memoryview, out: list):
+        if not len(view):
+            return
+        frame = self.frame_bytes
+        if frame <= 0:
+            out.append(view)
+            return
+        if self.pending:
+            need = frame - len(self.pending)
+            self.pending += view[:need]
+            view = view[need:]
+            if len(self.pending) < frame:
+                return
+            out.append(bytes(self.pending))
+            self.pending.clear()
+        whole = len(view) - len(view) % frame
+        for start in range(0, whole, frame):
+            out.append(view[start:start + frame])
+        if whole < len(view):
+            self.pending += view[whole:]
+
+    def _emit_silence(self, out: list):
+        size = int(self.byte_rate * self.silence_seconds)
+        size -= size % self.block_align
+        if size > 0:
+            self._emit(memoryview(bytes(size)), out)
+
+    def _process(self, buffer: bytes, out: list):
+        view = memoryview(buffer)
+        emit_from = 0
+        search_from = 0
+        while True:
+            index = buffer.find(b"RIFF", search_from)
+            if index == -1:
+                # 末尾可能是被切开的 "RIFF"
+                keep = next((k for k in (3, 2, 1) if buffer.endswith(b"RIFF"[:k])), 0)
+                end = max(emit_from, len(buffer) - keep)
+                self._emit(view[emit_from:end], out)
+                self.tail = buffer[end:]
+                return
+            offset = find_wav_data_offset(view[index:])
+            if offset is None and len(buffer) - index <= self.MAX_HEADER_SIZE:
+                # 文件头不完整，等待更多数据
+                self._emit(view[emit_from:index], out)
+                self.tail = buffer[index:]
+                return
+            if offset is None or offset == -1:
+                # PCM 数据中偶然出现的 "RIFF"
+                search_from = index + 1
+                continue
+            # 新片段的文件头
+            self._emit(view[emit_from:index], out)
+            self.fragments += 1
+            self._emit_silence(out)
+            emit_from = search_from = index + offset
+
+    def feed(self, chunk: bytes) -> list:
+        """ 输入一块数据，返回可以输出的数据块(bytes 或 memoryview) """
+        if self.passthrough:
+            return [chunk]
+        out = []
+        if self.header is None:
+            self.head += chunk
+            offset = find_wav_data_offset(self.head)
+            if offset is None:
+                return out
+            if offset == -1:
+                self.passthrough = True
+                out.append(self.head)
+                self.head = b""
+                return out
+            self._set_format(bytes(self.head[:offset]))
+            out.append(make_streaming_header(self.header))
+            buffer = bytes(self.head[offset:])
+            self.head = b""
+        else:
+            buffer = self.tail + bytes(chunk) if self.tail else bytes(chunk)
+            self.tail = b""
+        self._process(buffer, out)
+        return out
+
+    def flush(self) -> list:
+        """ 输入结束，返回剩余的数据 """
+        out = []
+        if self.head:
+            out.append(self.head)
+            self.head = b""
+        if self.tail:
+            self._emit(memoryview(self.tail), out)
+            self.tail = b""
+        if self.pending:
+            # 补静音到完整的一块，保持块大小一致
+            self.pending += bytes(self.frame_bytes - len(self.pending))
+            out.append(bytes(self.pending))
+            self.pending.clear()
+        return out
+
+
+async def normalize_wav_stream(stream, frame_ms: float = 0, silence_seconds: float = 0):
+    """ 对异步音频流应用 WavStreamNormalizer """
+    normalizer = WavStreamNormalizer(frame_ms, silence_seconds)
+    try:
+        async for chunk in stream:
+            for piece in normalizer.feed(chunk):
+                yield piece if isinstance(piece, bytes) else piece.tobytes()
+        for piece in normalizer.flush():
+            yield piece if isinstance(piece, bytes) else piece.tobytes()
+    finally:
+        if hasattr(stream, "aclose"):
+            await stream.aclose()